@@ -0,0 +1,124 @@
+# ==================================================
+# CCMBenchmark.py
+# --------------------------------------------------
+# Runs outside ArcGIS: python CCMBenchmark.py [options]
+# --------------------------------------------------
+#
+# Measures the throughput of the CCM engine (ccmengine.benchmark): cells per second of every stage
+# of the mounted and dismounted pipelines, for each worker count and tile size, on synthetic
+# fractal DEMs of several sizes with synthetic vegetation, soil and roughness layers, and on the
+# MaderaEnvironment.gdb layers.  The results are saved as JSON; with --baseline the run is
+# compared with an earlier result and the stages that slowed down by more than --tolerance are
+# listed, and the script exits with status 1.
+#
+# Multi-valued options are ";" separated, e.g. --sizes "1024;4096" --workers "1;4".
+#
+# The 16384 and 32768 cell DEMs take a long time and about 5 and 20 GB in the work folder.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import os, sys, argparse, shutil, tempfile, time, traceback
+from ccmengine import benchmark
+
+
+# LOCALS ===========================================
+dataFolder = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+supportingData = os.path.join(dataFolder, "SupportingData.gdb")
+maderaData = os.path.join(dataFolder, "MaderaEnvironment.gdb")
+sizes = ";".join(str(size) for size in benchmark.SIZES)
+polygons = ";".join("%s=%d" % item for item in sorted(benchmark.POLYGON_COUNTS.items()))
+pipelines = ";".join(benchmark.PIPELINES)
+engines = ";".join(benchmark.ENGINES)
+workers = "1;0" # 0 = one per core
+tileSizes = "512;1024;2048"
+resultFolder = os.path.join(tempfile.gettempdir(), "CCMBenchmarks")
+
+# ARGUMENTS ========================================
+parser = argparse.ArgumentParser(description="Cross Country Mobility engine benchmark")
+parser.add_argument("--sizes", default=sizes, help="synthetic DEM sizes in cells per side")
+parser.add_argument("--polygons", default=polygons, help="polygons per synthetic layer, e.g. f3=10000;f4=1000;f5=10000")
+parser.add_argument("--vertices", type=int, default=4, help="vertices bending each synthetic polygon edge")
+parser.add_argument("--cell-size", type=float, default=10.0, help="synthetic DEM cell size in metres")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--madera", default=maderaData, help="MaderaEnvironment.gdb (\"\" to leave it out)")
+parser.add_argument("--elevation", default="", help="File Geodatabase DEM for the Madera layers (default fractal)")
+parser.add_argument("--supporting-data", default=supportingData, help="SupportingData.gdb")
+parser.add_argument("--pipelines", default=pipelines)
+parser.add_argument("--engines", default=engines)
+parser.add_argument("--workers", default=workers)
+parser.add_argument("--tile-sizes", default=tileSizes)
+parser.add_argument("--pipeline-max-cells", type=int, default=benchmark.PIPELINE_MAX_CELLS)
+parser.add_argument("--work", default="", help="folder for the datasets (default a temporary folder)")
+parser.add_argument("--output", default="", help="results JSON (default in " + resultFolder + ")")
+parser.add_argument("--baseline", default="", help="earlier results JSON to compare with")
+parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown reported as a regression (0.1 = 10%%)")
+arguments = parser.parse_args()
+# ==================================================
+
+
+def splitValues(text):
+    return [value.strip() for value in text.split(";") if value.strip() != ""]
+
+
+def log(message):
+    print(time.strftime("%H:%M:%S ", time.localtime()) + message)
+    sys.stdout.flush()
+
+
+try:
+
+    log("START")
+    polygonCounts = {}
+    for item in splitValues(arguments.polygons):
+        name, count = item.split("=")
+        polygonCounts[name.strip()] = int(count)
+
+    datasets = benchmark.syntheticDatasets([int(size) for size in splitValues(arguments.sizes)], polygonCounts,
+                                           arguments.cell_size, arguments.seed, arguments.vertices)
+    if arguments.madera:
+        datasets.extend(benchmark.maderaDatasets(arguments.madera, arguments.elevation or None, arguments.seed))
+
+    work = arguments.work or tempfile.mkdtemp(prefix="CCMBenchmark")
+    try:
+        results = benchmark.benchmark(datasets, arguments.supporting_data, work,
+                                      splitValues(arguments.pipelines), splitValues(arguments.engines),
+                                      [int(count) for count in splitValues(arguments.workers)],
+                                      [int(size) for size in splitValues(arguments.tile_sizes)],
+                                      arguments.pipeline_max_cells, log)
+    finally:
+        if not arguments.work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    output = arguments.output or os.path.join(resultFolder, time.strftime("benchmark_%Y%m%d_%H%M%S.json", time.localtime()))
+    benchmark.writeResults(results, output)
+    for line in benchmark.summary(results):
+        print(line)
+    log("Results: " + output)
+
+    if arguments.baseline:
+        rows, regressions = benchmark.compare(benchmark.readResults(arguments.baseline), results, arguments.tolerance)
+        log("Compared " + str(len(rows)) + " stages with " + arguments.baseline)
+        for line in benchmark.comparisonLines(regressions):
+            print(line)
+        if regressions:
+            log(str(len(regressions)) + " stages slowed down by more than " + str(arguments.tolerance * 100.0) + "%")
+            sys.exit(1)
+    log("DONE")
+
+except SystemExit:
+    raise
+
+except:
+    log("CRASH")
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+
+    # Print Python error messages
+    print(pymsg + "\n")
+    sys.exit(2)
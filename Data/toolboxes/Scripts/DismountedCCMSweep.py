@@ -0,0 +1,224 @@
+# ==================================================
+# DismountedCCMSweep.py
+# --------------------------------------------------
+# Built on ArcGIS Pro (Python 3)
+# --------------------------------------------------
+#
+# Generates dismounted Cross Country Mobility rasters for every combination of visibility, soldier
+# load, vegetation MIN/MAX and soil WET/DRY in one run.  Slope, F2 and the vegetation, soil and
+# roughness code rasters are computed once; each tile is read once and all the scenarios are
+# evaluated from it.  The result is one multiband raster (band order: visibility, then weight, then
+# MIN/MAX, then WET/DRY, as listed in the messages) or, with an output folder, one raster per
+# scenario.
+#
+# Multi-valued parameters are ";" separated, e.g. "Day;Night" and "150;185;220".
+#
+# Data is presumed to be in the WGS 1984 Auxiliary Sphere spatial reference (GCS_WGS_1984)
+#
+# Spatial Analyst is required.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import os, sys, math, tempfile, time, traceback, itertools
+import arcpy
+from arcpy import da
+from arcpy import env
+from arcpy import sa
+import ccmengine
+from ccmengine import arcpyio
+from ccmengine import params
+
+
+# LOCALS ===========================================
+# Check out the ArcGIS Spatial Analyst extension license
+arcpy.CheckOutExtension("Spatial")
+deleteme = []
+debug = True
+# Walk the DEM in tiles of tileSize x tileSize cells (0 = the whole AOI at once).  Every tile holds
+# one float64 band per scenario, so large sweeps want smaller tiles.
+tileSize = 512
+# Worker processes (0 = one per core)
+workers = 1
+# Slope and focal range are kept here between runs ("" = no cache); the cache is capped at terrainCacheMB
+terrainCache = os.path.join(tempfile.gettempdir(), "CCMTerrainCache")
+terrainCacheMB = 4096
+ccmFactorList = []
+
+# ARGUMENTS ========================================
+inputAOI = arcpy.GetParameterAsText(0) # area of interest polygon
+inputVisibilities = arcpy.GetParameterAsText(1) # "Day", "Night" or "Day;Night"
+inputFootMarchParameterTable = arcpy.GetParameterAsText(2)
+inputElevation = arcpy.GetParameterAsText(3)
+outputCCM = arcpy.GetParameterAsText(4) # multiband raster, one band per scenario
+
+inputVegetation = arcpy.GetParameterAsText(5)
+inputVegetationTable = arcpy.GetParameterAsText(6)
+inputMinMax = arcpy.GetParameterAsText(7) # "MAX", "MIN" or "MAX;MIN"
+
+inputSoils = arcpy.GetParameterAsText(8)
+inputSoilsTable = arcpy.GetParameterAsText(9)
+inputWetDry = arcpy.GetParameterAsText(10) # "DRY", "WET" or "DRY;WET"
+
+inputSurfaceRoughness = arcpy.GetParameterAsText(11)
+inputRoughnessTable = arcpy.GetParameterAsText(12)
+
+inputWeights = arcpy.GetParameterAsText(13) # soldier loads in pounds, e.g. "150;185;220"
+
+outputFolder = arcpy.GetParameterAsText(14) # optional: one raster per scenario here instead of outputCCM
+# ==================================================
+
+env.extent = inputAOI
+env.snapRaster = inputElevation
+env.mask = inputAOI
+
+
+def splitValues(text, default):
+    values = [value.strip().strip("'\"").strip() for value in text.split(";")]
+    values = [value for value in values if value != ""]
+    if len(values) == 0:
+        return [default]
+    return values
+
+
+def categoricalFactors(inputFeatures, codeField, inputTable, factorFields, name):
+    # One factor raster per field of the parameter table (e.g. f4dry and f4wet) from a single
+    # burn of the polygons, or a single Clip -> JoinField followed by one PolygonToRaster per field
+    factors = [os.path.join(scratch, name + field) for field in factorFields]
+    deleteme.extend(factors)
+    if arcpyio.factorRasters(inputFeatures, codeField, inputTable, factorFields, inputElevation, inputAOI, factors) is not None:
+        return factors
+    clipped = os.path.join("in_memory", name + "Clip")
+    deleteme.append(clipped)
+    arcpyio.clipByIndex(inputFeatures, inputAOI, clipped)
+    arcpy.JoinField_management(clipped, codeField, inputTable, codeField)
+    for field, factor in zip(factorFields, factors):
+        factorT = os.path.join(scratch, name + field + "t")
+        deleteme.append(factorT)
+        arcpy.PolygonToRaster_conversion(clipped, field, factorT)
+        outFactor = sa.Con(sa.IsNull(factorT), 1.0, factorT)
+        outFactor.save(factor)
+    return factors
+
+
+try:
+
+    if debug == True:
+        arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    scratch = env.scratchGDB
+    if debug == True: arcpy.AddMessage("scratch: " + str(scratch))
+    env.overwriteOutput = True
+    env.resample = "NEAREST"
+    env.compression = "LZ77"
+    env.rasterStatistics = 'STATISTICS'
+
+    elevationDescription = arcpy.Describe(inputElevation)
+    env.cellSize = elevationDescription.children[0].meanCellHeight
+
+    visibilities = splitValues(inputVisibilities, "Day")
+    weights = [float(weight) for weight in splitValues(inputWeights, "185")]
+    minMaxes = splitValues(inputMinMax, "MAX")
+    wetDries = splitValues(inputWetDry, "DRY")
+
+    # Retrieve speed and max slope for each visibility
+    arcpy.AddMessage("Retrieving foot march info based on visibility...")
+    footMarch = {}
+    for visibility in visibilities:
+        footMarch[visibility] = params.footMarchParameters(inputFootMarchParameterTable, visibility)
+        if footMarch[visibility] is None:
+            expression = arcpy.AddFieldDelimiters(inputFootMarchParameterTable, "visibility") + " = '" + visibility + "'"
+            with arcpy.da.SearchCursor(inputFootMarchParameterTable, ["maxmph", "onslope"], where_clause=expression) as marchCursor:
+                for row in marchCursor:
+                    footMarch[visibility] = (float(row[0]), float(row[1]))
+        if footMarch[visibility] is None:
+            raise ValueError("No foot march parameters for visibility '%s' in %s" % (visibility, inputFootMarchParameterTable))
+        if debug == True: arcpy.AddMessage(visibility + " speed, max slope: " + str(footMarch[visibility]))
+
+    ##########################################################
+    # F3, F4, F5: every variant the sweep needs, burned once per layer
+    ##########################################################
+    f3Position = {}
+    f4Position = {}
+    f5Positions = []
+    if inputVegetation and arcpy.Exists(inputVegetation) == True:
+        arcpy.AddMessage("Rasterizing vegetation...")
+        fields = ["f3max" if minMax == "MAX" else "f3min" for minMax in minMaxes]
+        for minMax, factor in zip(minMaxes, categoricalFactors(inputVegetation, "f_code", inputVegetationTable, fields, "f3")):
+            f3Position[minMax] = [len(ccmFactorList)]
+            ccmFactorList.append(factor)
+
+    if inputSoils and arcpy.Exists(inputSoils) == True:
+        arcpy.AddMessage("Rasterizing soils...")
+        fields = ["f4dry" if wetDry == "DRY" else "f4wet" for wetDry in wetDries]
+        for wetDry, factor in zip(wetDries, categoricalFactors(inputSoils, "soilcode", inputSoilsTable, fields, "f4")):
+            f4Position[wetDry] = [len(ccmFactorList)]
+            ccmFactorList.append(factor)
+
+    if inputSurfaceRoughness and arcpy.Exists(inputSurfaceRoughness) == True:
+        arcpy.AddMessage("Rasterizing roughness...")
+        f5Positions = [len(ccmFactorList)]
+        ccmFactorList.extend(categoricalFactors(inputSurfaceRoughness, "roughnesscode", inputRoughnessTable, ["f5"], "f5"))
+
+    ##########################################################
+    # One band per scenario: F1 from its visibility and load, F3/F4 from its MIN/MAX and WET/DRY
+    ##########################################################
+    paramsList = []
+    bandFactors = []
+    outputRasters = []
+    for band, (visibility, weight, minMax, wetDry) in enumerate(itertools.product(visibilities, weights, minMaxes, wetDries)):
+        (speed, maxSlopePercent) = footMarch[visibility]
+        speedOverWt = ccmengine.dismountedSpeedOverWeight(speed, weight)
+        paramsList.append(ccmengine.CCMParameters(maxSlopePercent, speedOverWt))
+        bandFactors.append(f3Position.get(minMax, []) + f4Position.get(wetDry, []) + f5Positions)
+        scenario = "%s_%g_%s_%s" % (visibility, weight, minMax, wetDry)
+        outputRasters.append(os.path.join(outputFolder, "ccm_" + scenario + ".tif") if outputFolder else None)
+        arcpy.AddMessage("Band " + str(band + 1) + ": " + scenario)
+
+    if debug == True: arcpy.AddMessage(str(time.strftime(str(len(paramsList)) + " scenarios (" + str(workers) + " workers): %m/%d/%Y  %H:%M:%S", time.localtime())))
+    output = outputRasters if outputFolder else outputCCM
+    arcpyio.ccmBatchTiled(inputElevation, inputAOI, paramsList, ccmFactorList, output, tileSize, workers, env.scratchFolder, cacheFolder=terrainCache, cacheMB=terrainCacheMB, bandFactors=bandFactors)
+
+    # set the output
+    if outputFolder:
+        arcpy.SetParameter(14, outputFolder)
+    else:
+        arcpy.SetParameter(4, outputCCM)
+    if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+
+    # cleanup intermediate datasets
+    if debug == True: arcpy.AddMessage("Removing intermediate datasets...")
+    for i in deleteme:
+        if debug == True: arcpy.AddMessage("Removing: " + str(i))
+        if arcpy.Exists(i):
+            arcpy.Delete_management(i)
+    if debug == True: arcpy.AddMessage("Done")
+
+except arcpy.ExecuteError:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+    arcpy.AddError("Traceback: " + tbinfo)
+    # Get the tool error messages
+    msgs = arcpy.GetMessages()
+    arcpy.AddError(msgs)
+    print(msgs)
+
+except:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+    msgs = "ArcPy ERRORS:\n" + arcpy.GetMessages() + "\n"
+
+    # Return python error messages for use in script tool or Python Window
+    arcpy.AddError(pymsg)
+    arcpy.AddError(msgs)
+
+    # Print Python error messages for use in Python / Python Window
+    print(pymsg + "\n")
+    print(msgs)
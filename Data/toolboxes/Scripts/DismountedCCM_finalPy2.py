@@ -16,7 +16,7 @@
 
 
 # IMPORTS ==========================================
-import os, sys, math, traceback, types
+import os, sys, math, time, traceback, types
 import arcpy
 from arcpy import da
 from arcpy import env
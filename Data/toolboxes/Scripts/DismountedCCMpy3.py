@@ -16,11 +16,15 @@
 
 
 # IMPORTS ==========================================
-import os, sys, math, traceback, types
+import os, sys, math, tempfile, time, traceback, types
 import arcpy
 from arcpy import da
 from arcpy import env
 from arcpy import sa
+import ccmengine
+from ccmengine import arcpyio
+from ccmengine import params
+from ccmengine import profiling
 
 
 # LOCALS ===========================================
@@ -28,6 +32,33 @@ from arcpy import sa
 arcpy.CheckOutExtension("Spatial")
 deleteme = []
 debug = True
+# Compute slope -> Con -> F1 in memory with the NumPy engine instead of Spatial Analyst
+useNumpyEngine = True
+# Walk the DEM in tiles of tileSize x tileSize cells (0 = the whole AOI at once), so peak
+# memory is bounded by the tile size rather than the AOI size
+tileSize = 0
+# Worker processes for tiled runs (0 = one per core)
+workers = 1
+# Slope and focal range of tiled runs are kept here between runs, keyed by the DEM values,
+# the AOI window and the algorithm settings ("" = no cache); the cache is capped at terrainCacheMB
+terrainCache = os.path.join(tempfile.gettempdir(), "CCMTerrainCache")
+terrainCacheMB = 4096
+# Every stage of untiled runs is stored here and only the stages whose inputs or settings
+# changed are recomputed on the next run ("" = off); the folder is capped at pipelineMB.  The
+# vegetation, soils and roughness code rasters of the other runs are kept here too, so switching
+# MIN/MAX or WET/DRY only redoes the table lookup.
+pipelineFolder = os.path.join(tempfile.gettempdir(), "CCMPipeline")
+pipelineMB = 4096
+# Pixel type of F1..F5 and the CCM written by the NumPy engine: "FLOAT32", or "UINT16" / "UINT8"
+# to store them scaled over [0, largest possible value] at half / a quarter of the size, with the
+# scale and offset in a .quantization.json beside each raster.  The largest error is half a step:
+# 1/131068 (UINT16) or 1/508 (UINT8) of the range.
+outputType = "FLOAT32"
+# Time every stage (wall and CPU time, cells, bytes read and written, peak memory) and show a table
+# of them at the end; the stages are also saved to profileFolder ("" = no file) as a Chrome trace
+# (open in chrome://tracing or ui.perfetto.dev)
+profile = True
+profileFolder = os.path.join(tempfile.gettempdir(), "CCMProfiles")
 GCS_WGS_1984 = arcpy.SpatialReference("WGS 1984")
 webMercator = arcpy.SpatialReference("WGS 1984 Web Mercator (Auxiliary Sphere)")
 ccmFactorList = []
@@ -80,6 +111,8 @@ try:
 
     if debug == True:
         arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    profiler = profiling.start("DismountedCCM") if profile == True else profiling.Profiler("DismountedCCM")
+    profiler.begin("parameters")
     scratch = env.scratchGDB
     if debug == True: arcpy.AddMessage("scratch: " + str(scratch))
     env.overwriteOutput = True
@@ -88,6 +121,8 @@ try:
     env.rasterStatistics = 'STATISTICS'
 
     elevationRaster = arcpy.Raster(inputElevation)
+    aoiGrid = arcpyio.aoiWindow(elevationRaster, inputAOI)
+    aoiCells = aoiGrid.nrows * aoiGrid.ncols
     elevationDescription = arcpy.Describe(inputElevation)
     elevationCellSize = elevationDescription.children[0].meanCellHeight
     env.cellSize=elevationCellSize
@@ -102,195 +137,278 @@ try:
 
     # Retrieve speed from table based on visibility: day or night
     arcpy.AddMessage("Retrieving foot march info based on visibility...")
-    expression = arcpy.AddFieldDelimiters(inputFootMarchParameterTable, "visibility") + " = '" + inputVisibility + "'"
-    #There should only be one row
-    with arcpy.da.SearchCursor(inputFootMarchParameterTable,["maxmph", "onslope"], where_clause=expression) as marchCursor:
-        for row in marchCursor:
-            speed = float(row[0])
-            maxSlopePercent = float(row[1])
+    footMarch = None
+    if useNumpyEngine == True:
+        footMarch = params.footMarchParameters(inputFootMarchParameterTable, inputVisibility)
+    if footMarch is not None:
+        (speed, maxSlopePercent) = footMarch
+    else:
+        expression = arcpy.AddFieldDelimiters(inputFootMarchParameterTable, "visibility") + " = '" + inputVisibility + "'"
+        #There should only be one row
+        with arcpy.da.SearchCursor(inputFootMarchParameterTable,["maxmph", "onslope"], where_clause=expression) as marchCursor:
+            for row in marchCursor:
+                speed = float(row[0])
+                maxSlopePercent = float(row[1])
 
     arcpy.AddMessage("Speed: " + str(speed))
     arcpy.AddMessage("Max slope: " + str(maxSlopePercent))
 
 
-    arcpy.AddMessage("Generating slope...")
-    slopeClip = os.path.join(scratch,"slopeClip")
-    outSlope = sa.Slope(inputElevation, "PERCENT_RISE")
-    outSlope.save(slopeClip)
-    deleteme.append(slopeClip)
-
-
-    # Set all Slope values greater than the foot march max slope percent to the max foot march slope value
-    arcpy.AddMessage("Reclassifying Slope ...")
-    reclassSlope = os.path.join(scratch,"reclassSlope")
-    if debug == True:
-        arcpy.AddMessage("reclassSlope: " + str(reclassSlope))
-
-    if debug == True:
-        arcpy.AddMessage(str(time.strftime("Performing Con on slope: %m/%d/%Y  %H:%M:%S", time.localtime())))
-    outCon = sa.Con(sa.Raster(slopeClip) >= float(maxSlopePercent),float(maxSlopePercent),sa.Raster(slopeClip))
-    outCon.save(reclassSlope)
-    deleteme.append(reclassSlope)
-
-    # make constant raster
-    constNoEffect = os.path.join(scratch,"constNoEffect")
-    outConstNoEffect = sa.CreateConstantRaster(1.0,"FLOAT",inputElevation,arcpy.Describe(inputAOI).Extent)
-    outConstNoEffect.save(constNoEffect)
-    deleteme.append(constNoEffect)
-
-    ##########################################################
-    # F1: Calculate Slope/Speed Characteristics.
-    ##########################################################
-    # f1: foot march parameters
-    f1 = os.path.join(env.scratchFolder,"f1.tif")
-    if debug == True:
-        arcpy.AddMessage(str(time.strftime("F1: %m/%d/%Y  %H:%M:%S", time.localtime())))
-    slopeAsRaster = sa.Raster(reclassSlope)
-
-    #Original formula for vehicles
-    #outF1 = (float(minVehicleOnRoadSlope) - slopeAsRaster) / (float(minVehicleKPH) / float(maxVehicleWeight))
-
-    # For humans:
-    # 1 short ton = 2000 lbs
-    # The original formula takes in short tons; therefore, (human weight/2000)
-    weight = float(inputWeight)
-    speedOverWt = (float(speed) / float(weight/2000.0))
-    outF1 = (float(maxSlopePercent) - slopeAsRaster) / speedOverWt # hard code human weight to be 150 lbs
-    outF1.save(f1)
-    ccmFactorList.append(f1)
-    deleteme.append(f1)
-
-    ##########################################################
-    # F2: surface change
-    ##########################################################
-    arcpy.AddMessage("Surface Curvature ...")
-    f2 = os.path.join(env.scratchFolder,"f2.tif")
-    if debug == True: arcpy.AddMessage(str(time.strftime("Curvature: %m/%d/%Y  %H:%M:%S", time.localtime())))
-
-    # CURVATURE
-    curvature = os.path.join(scratch,"curvature")
-    curveSA = sa.Curvature(inputElevation)
-    curveSA.save(curvature)
-    deleteme.append(curvature)
-    if debug == True: arcpy.AddMessage(str(time.strftime("Focal Stats: %m/%d/%Y  %H:%M:%S", time.localtime())))
-
-    # FOCALSTATISTICS (RANGE)
-    focalStats = os.path.join(scratch,"focalStats")
-    window = sa.NbrCircle(3,"CELL")
-    fstatsSA = sa.FocalStatistics(curvature,window,"RANGE")
-    fstatsSA.save(focalStats)
-    deleteme.append(focalStats)
-
-    # F2
-    maxRasStat = float(str(arcpy.GetRasterProperties_management(focalStats,"MAXIMUM")))
-    fsRasStat = sa.Raster(focalStats)
-    if debug == True:
-        arcpy.AddMessage("maxRasStat: " + str(maxRasStat) + " - " + str(type(maxRasStat)))
-        arcpy.AddMessage("fsRasStat: " + str(fsRasStat) + " - " + str(type(fsRasStat)))
-    f2Calc = (maxRasStat - fsRasStat) / maxRasStat # (max - cell/max)
-    f2Calc.save(f2)
-    deleteme.append(f2)
-    ccmFactorList.append(f2)
-
-    ##########################################################
-    # F3: vegetation
-    ##########################################################
-
-    if inputVegetation != type(None) and arcpy.Exists(inputVegetation) == True:
-        f3t = os.path.join(scratch,"f3t")
-        f3 = os.path.join(scratch,"f3")
-        arcpy.AddMessage("Clipping vegetation to fishnet and joining parameter table...")
-        vegetation = os.path.join("in_memory","vegetation")
-        if debug == True: arcpy.AddMessage(str(time.strftime("Clip Vegetation: %m/%d/%Y  %H:%M:%S", time.localtime())))
-        arcpy.Clip_analysis(inputVegetation,inputAOI,vegetation)
-        deleteme.append(vegetation)
-        arcpy.JoinField_management(vegetation,"f_code",inputVegetationTable,"f_code")
-        # Convert vegetation to Raster using MIN or MAX field
-        if min_max == "MAX":
-            arcpy.PolygonToRaster_conversion(vegetation,"f3max",f3t)
+    # With a pipeline folder every stage comes from the incremental pipeline, which only rebuilds
+    # the stages whose inputs or settings changed since an earlier run (e.g. F4 and the product
+    # after switching wet_dry); it returns None when an input cannot be read natively
+    rebuilt = None
+    if useNumpyEngine == True and tileSize <= 0 and pipelineFolder:
+        factorInputs = []
+        if inputVegetation != type(None) and arcpy.Exists(inputVegetation) == True:
+            factorInputs.append(("f3", inputVegetation, "f_code", inputVegetationTable, "f3max" if min_max == "MAX" else "f3min"))
+        if inputSoils != type(None) and arcpy.Exists(inputSoils) == True:
+            factorInputs.append(("f4", inputSoils, "soilcode", inputSoilsTable, "f4dry" if wet_dry == "DRY" else "f4wet"))
+        if inputSurfaceRoughness != type(None) and arcpy.Exists(inputSurfaceRoughness) == True:
+            factorInputs.append(("f5", inputSurfaceRoughness, "roughnesscode", inputRoughnessTable, "f5"))
+        arcpy.AddMessage("Updating the CCM pipeline...")
+        profiler.begin("pipeline", aoiCells)
+        rebuilt = arcpyio.ccmIncremental(inputElevation, inputAOI, ccmengine.CCMParameters(maxSlopePercent, ccmengine.dismountedSpeedOverWeight(speed, float(inputWeight))), factorInputs, outputCCM, pipelineFolder, env.scratchFolder, pipelineMB, outputType=outputType)
+        if rebuilt is not None:
+            arcpy.AddMessage("Rebuilt stages: " + (", ".join(rebuilt) if rebuilt else "none"))
+
+    if rebuilt is None:
+        # factors are 1.0 (no effect) where no polygon applies
+        noEffect = 1.0
+
+        ##########################################################
+        # F1: Calculate Slope/Speed Characteristics.
+        ##########################################################
+        # f1: foot march parameters
+        f1 = os.path.join(env.scratchFolder,"f1.tif")
+        f2 = os.path.join(env.scratchFolder,"f2.tif")
+
+        #Original formula for vehicles
+        #outF1 = (float(minVehicleOnRoadSlope) - slopeAsRaster) / (float(minVehicleKPH) / float(maxVehicleWeight))
+
+        # For humans:
+        # 1 short ton = 2000 lbs
+        # The original formula takes in short tons; therefore, (human weight/2000)
+        weight = float(inputWeight)
+        speedOverWt = ccmengine.dismountedSpeedOverWeight(speed, weight)
+
+        if useNumpyEngine == True and tileSize > 0:
+            # F1 and F2 are generated tile by tile together with the final product
+            arcpy.AddMessage("F1 and F2 are generated with the final product...")
+            ccmParameters = ccmengine.CCMParameters(maxSlopePercent, speedOverWt)
+        elif useNumpyEngine == True:
+            # Slope, Con, F1, curvature, the focal range and F2 in one pass over the DEM held in
+            # memory, from a single read of each 3x3 neighbourhood: no slope, curvature or focalStats
+            # rasters.  slopeClip and reclassSlope are only written out when debugging.
+            arcpy.AddMessage("Generating slope, curvature, F1 and F2 in memory...")
+            profiler.begin("slope, curvature, F1, F2", aoiCells)
+            terrainParameters = ccmengine.CCMParameters(maxSlopePercent, speedOverWt)
+            demBlock = arcpyio.readRasterWindow(elevationRaster, aoiGrid, halo=terrainParameters.halo)
+            intermediates = None
+            if debug == True: intermediates = {}
+            # cell sizes in metres, row by row when the DEM is in geographic coordinates
+            cellWidth, cellHeight = aoiGrid.metricCellSizes(terrainParameters.halo)
+            f1Array, f2Array = ccmengine.terrainFactorsBlock(demBlock, cellWidth, cellHeight, terrainParameters, halo=terrainParameters.halo, intermediates=intermediates)
+            del demBlock
+            if debug == True:
+                slopeClip = os.path.join(scratch,"slopeClip")
+                arcpyio.arrayToRaster(intermediates["slope"], aoiGrid, slopeClip, elevationRaster.spatialReference)
+                deleteme.append(slopeClip)
+                reclassSlope = os.path.join(scratch,"reclassSlope")
+                arcpyio.arrayToRaster(intermediates["reclassSlope"], aoiGrid, reclassSlope, elevationRaster.spatialReference)
+                deleteme.append(reclassSlope)
+                arcpy.AddMessage("slopeClip: " + str(slopeClip))
+                arcpy.AddMessage("reclassSlope: " + str(reclassSlope))
+            arcpyio.arrayToRaster(f1Array, aoiGrid, f1, elevationRaster.spatialReference, arcpyio.outputQuantization(outputType, arcpyio.f1Maximum(terrainParameters)))
+            arcpyio.arrayToRaster(f2Array, aoiGrid, f2, elevationRaster.spatialReference, arcpyio.outputQuantization(outputType, 1.0))
+            del f1Array, f2Array
         else:
-            arcpy.PolygonToRaster_conversion(vegetation,"f3min",f3t)
-        # if F3T is null, make it 1.0 (from constNoEffect), otherwise keep F3T value
-        outF3T = sa.Con(sa.IsNull(f3t),constNoEffect,f3t)
-        outF3T.save(f3)
-        deleteme.append(f3t)
-        deleteme.append(f3)
-        ccmFactorList.append(f3)
-
-    ##########################################################
-    # F4: soils
-    ##########################################################
-    if inputSoils != type(None) and  arcpy.Exists(inputSoils) == True:
-        f4t = os.path.join(scratch,"f4t")
-        f4 = os.path.join(scratch,"f4")
-        arcpy.AddMessage("Clipping soils to fishnet and joining parameter table...")
-        clipSoils = os.path.join("in_memory","clipSoils")
-        if debug == True: arcpy.AddMessage(str(time.strftime("Clip Soils: %m/%d/%Y  %H:%M:%S", time.localtime())))
-        arcpy.Clip_analysis(inputSoils,inputAOI,clipSoils)
-        deleteme.append(clipSoils)
-        arcpy.JoinField_management(clipSoils,"soilcode",inputSoilsTable,"soilcode")
-        # Convert soils to Raster using WET or DRY field
-        if wet_dry == "DRY":
-            arcpy.PolygonToRaster_conversion(clipSoils,"f4dry",f4t)
+            arcpy.AddMessage("Generating slope...")
+            profiler.begin("slope", aoiCells)
+            slopeClip = os.path.join(scratch,"slopeClip")
+            outSlope = sa.Slope(inputElevation, "PERCENT_RISE")
+            outSlope.save(slopeClip)
+            deleteme.append(slopeClip)
+
+
+            # Set all Slope values greater than the foot march max slope percent to the max foot march slope value
+            arcpy.AddMessage("Reclassifying Slope ...")
+            reclassSlope = os.path.join(scratch,"reclassSlope")
+            if debug == True:
+                arcpy.AddMessage("reclassSlope: " + str(reclassSlope))
+
+            profiler.begin("Con", aoiCells)
+            outCon = sa.Con(sa.Raster(slopeClip) >= float(maxSlopePercent),float(maxSlopePercent),sa.Raster(slopeClip))
+            outCon.save(reclassSlope)
+            deleteme.append(reclassSlope)
+
+            profiler.begin("F1", aoiCells)
+            slopeAsRaster = sa.Raster(reclassSlope)
+            outF1 = (float(maxSlopePercent) - slopeAsRaster) / speedOverWt # hard code human weight to be 150 lbs
+            outF1.save(f1)
+        ccmFactorList.append(f1)
+        deleteme.append(f1)
+
+        ##########################################################
+        # F2: surface change
+        ##########################################################
+        if useNumpyEngine == True and tileSize > 0:
+            arcpy.AddMessage("Surface Curvature is generated with the final product...")
+        elif useNumpyEngine == True:
+            arcpy.AddMessage("Surface Curvature was generated with F1...")
         else:
-            arcpy.PolygonToRaster_conversion(clipSoils,"f4wet",f4t)
-        deleteme.append(f4t)
-        outF4T = sa.Con(sa.IsNull(f4t),constNoEffect,f4t)
-        outF4T.save(f4)
-        deleteme.append(f4)
-        ccmFactorList.append(f4)
-
-    ##########################################################
-    # F4: surface roughness
-    ##########################################################
-    if inputSurfaceRoughness != type(None) and  arcpy.Exists(inputSurfaceRoughness) == True:
-        f5t = os.path.join(scratch,"f5t")
-        f5 = os.path.join(scratch,"f5")
-        arcpy.AddMessage("Clipping roughness to fishnet and joining parameter table...")
-        clipRoughness = os.path.join("in_memory","clipRoughness")
-        if debug == True: arcpy.AddMessage(str(time.strftime("Clip Roughness: %m/%d/%Y  %H:%M:%S", time.localtime())))
-        arcpy.Clip_analysis(inputSurfaceRoughness,inputAOI,clipRoughness)
-        # Join roughness table
-        arcpy.JoinField_management(clipRoughness,"roughnesscode",inputRoughnessTable,"roughnesscode")
-        intersectionList.append(clipRoughness)
-        # Convert surface roughness to raster
-        arcpy.PolygonToRaster_conversion(clipRoughness,"f5",f5t)
-        deleteme.append(f5t)
-        outF5T = sa.Con(sa.IsNull(f5t),constNoEffect,f5t)
-        outF5T.save(f5)
-        deleteme.append(f5)
-        ccmFactorList.append(f5)
-
-    # Map Algebra to calc final CCM
-    if debug == True: arcpy.AddMessage("BEFORE: " + str(ccmFactorList) + str(time.strftime(" %m/%d/%Y  %H:%M:%S", time.localtime())))
-    tempCCM = os.path.join(env.scratchFolder,"tempCCM.tif")
-    targetCCM = ""
-    if len(ccmFactorList) == 2:
-        if debug == True: arcpy.AddMessage(str(time.strftime("Two factors " + str(ccmFactorList) + " : %m/%d/%Y  %H:%M:%S", time.localtime())))
-        targetCCM = sa.Raster(ccmFactorList[0]) * sa.Raster(ccmFactorList[1])
-    elif len(ccmFactorList) == 3:
-        if debug == True: arcpy.AddMessage(str(time.strftime("Three factors " + str(ccmFactorList) + " : %m/%d/%Y  %H:%M:%S", time.localtime())))
-        targetCCM = sa.Raster(ccmFactorList[0]) * sa.Raster(ccmFactorList[1]) * sa.Raster(ccmFactorList[2])
-    elif len(ccmFactorList) == 4:
-        if debug == True: arcpy.AddMessage(str(time.strftime("Four factors " + str(ccmFactorList) + " : %m/%d/%Y  %H:%M:%S", time.localtime())))
-        targetCCM = sa.Raster(ccmFactorList[0]) * sa.Raster(ccmFactorList[1]) * sa.Raster(ccmFactorList[2]) * sa.Raster(ccmFactorList[3])
-    elif len(ccmFactorList) == 5:
-        if debug == True: arcpy.AddMessage(str(time.strftime("Five factors " + str(ccmFactorList) + " : %m/%d/%Y  %H:%M:%S", time.localtime())))
-        targetCCM = sa.Raster(ccmFactorList[0]) * sa.Raster(ccmFactorList[1]) * sa.Raster(ccmFactorList[2]) * sa.Raster(ccmFactorList[3]) * sa.Raster(ccmFactorList[4])
-    else:
-        if debug == True: arcpy.AddMessage("ERROR!!!!!: " + str(ccmFactorList) + str(time.strftime(" %m/%d/%Y  %H:%M:%S", time.localtime())))
-        raise WrongFactors(ccmFactorList)
-    deleteme.append(tempCCM)
-    targetCCM.save(tempCCM)
-
-    #save the output
-    arcpy.CopyRaster_management(tempCCM,outputCCM)
+            arcpy.AddMessage("Surface Curvature ...")
+            profiler.begin("curvature", aoiCells)
+
+            # CURVATURE
+            curvature = os.path.join(scratch,"curvature")
+            curveSA = sa.Curvature(inputElevation)
+            curveSA.save(curvature)
+            deleteme.append(curvature)
+            profiler.begin("focal statistics", aoiCells)
+
+            # FOCALSTATISTICS (RANGE)
+            focalStats = os.path.join(scratch,"focalStats")
+            window = sa.NbrCircle(3,"CELL")
+            fstatsSA = sa.FocalStatistics(curvature,window,"RANGE")
+            fstatsSA.save(focalStats)
+            deleteme.append(focalStats)
+
+            # F2
+            profiler.begin("F2", aoiCells)
+            maxRasStat = float(str(arcpy.GetRasterProperties_management(focalStats,"MAXIMUM")))
+            fsRasStat = sa.Raster(focalStats)
+            if debug == True:
+                arcpy.AddMessage("maxRasStat: " + str(maxRasStat) + " - " + str(type(maxRasStat)))
+                arcpy.AddMessage("fsRasStat: " + str(fsRasStat) + " - " + str(type(fsRasStat)))
+            f2Calc = (maxRasStat - fsRasStat) / maxRasStat # (max - cell/max)
+            f2Calc.save(f2)
+        deleteme.append(f2)
+        ccmFactorList.append(f2)
+
+        ##########################################################
+        # F3: vegetation
+        ##########################################################
+
+        if inputVegetation != type(None) and arcpy.Exists(inputVegetation) == True:
+            profiler.begin("F3 vegetation", aoiCells)
+            f3t = os.path.join(scratch,"f3t")
+            f3 = os.path.join(scratch,"f3")
+            fieldF3 = "f3max" if min_max == "MAX" else "f3min"
+            burned = None
+            if useNumpyEngine == True:
+                arcpy.AddMessage("Rasterizing vegetation with the parameter table lookup...")
+                burned = arcpyio.factorRaster(inputVegetation,"f_code",inputVegetationTable,fieldF3,inputElevation,inputAOI,f3,pipelineFolder,pipelineMB,outputType)
+            if burned is not None:
+                deleteme.append(f3)
+            else:
+                arcpy.AddMessage("Clipping vegetation to fishnet and joining parameter table...")
+                vegetation = os.path.join("in_memory","vegetation")
+                arcpyio.clipByIndex(inputVegetation,inputAOI,vegetation)
+                deleteme.append(vegetation)
+                arcpy.JoinField_management(vegetation,"f_code",inputVegetationTable,"f_code")
+                # Convert vegetation to Raster using MIN or MAX field
+                if min_max == "MAX":
+                    arcpy.PolygonToRaster_conversion(vegetation,"f3max",f3t)
+                else:
+                    arcpy.PolygonToRaster_conversion(vegetation,"f3min",f3t)
+                # if F3T is null, make it 1.0 (noEffect), otherwise keep F3T value
+                outF3T = sa.Con(sa.IsNull(f3t),noEffect,f3t)
+                outF3T.save(f3)
+                deleteme.append(f3t)
+                deleteme.append(f3)
+            ccmFactorList.append(f3)
+
+        ##########################################################
+        # F4: soils
+        ##########################################################
+        if inputSoils != type(None) and  arcpy.Exists(inputSoils) == True:
+            profiler.begin("F4 soils", aoiCells)
+            f4t = os.path.join(scratch,"f4t")
+            f4 = os.path.join(scratch,"f4")
+            fieldF4 = "f4dry" if wet_dry == "DRY" else "f4wet"
+            burned = None
+            if useNumpyEngine == True:
+                arcpy.AddMessage("Rasterizing soils with the parameter table lookup...")
+                burned = arcpyio.factorRaster(inputSoils,"soilcode",inputSoilsTable,fieldF4,inputElevation,inputAOI,f4,pipelineFolder,pipelineMB,outputType)
+            if burned is not None:
+                deleteme.append(f4)
+            else:
+                arcpy.AddMessage("Clipping soils to fishnet and joining parameter table...")
+                clipSoils = os.path.join("in_memory","clipSoils")
+                arcpyio.clipByIndex(inputSoils,inputAOI,clipSoils)
+                deleteme.append(clipSoils)
+                arcpy.JoinField_management(clipSoils,"soilcode",inputSoilsTable,"soilcode")
+                # Convert soils to Raster using WET or DRY field
+                if wet_dry == "DRY":
+                    arcpy.PolygonToRaster_conversion(clipSoils,"f4dry",f4t)
+                else:
+                    arcpy.PolygonToRaster_conversion(clipSoils,"f4wet",f4t)
+                deleteme.append(f4t)
+                outF4T = sa.Con(sa.IsNull(f4t),noEffect,f4t)
+                outF4T.save(f4)
+                deleteme.append(f4)
+            ccmFactorList.append(f4)
+
+        ##########################################################
+        # F4: surface roughness
+        ##########################################################
+        if inputSurfaceRoughness != type(None) and  arcpy.Exists(inputSurfaceRoughness) == True:
+            profiler.begin("F5 roughness", aoiCells)
+            f5t = os.path.join(scratch,"f5t")
+            f5 = os.path.join(scratch,"f5")
+            burned = None
+            if useNumpyEngine == True:
+                arcpy.AddMessage("Rasterizing roughness with the parameter table lookup...")
+                burned = arcpyio.factorRaster(inputSurfaceRoughness,"roughnesscode",inputRoughnessTable,"f5",inputElevation,inputAOI,f5,pipelineFolder,pipelineMB,outputType)
+            if burned is not None:
+                deleteme.append(f5)
+            else:
+                arcpy.AddMessage("Clipping roughness to fishnet and joining parameter table...")
+                clipRoughness = os.path.join("in_memory","clipRoughness")
+                arcpyio.clipByIndex(inputSurfaceRoughness,inputAOI,clipRoughness)
+                # Join roughness table
+                arcpy.JoinField_management(clipRoughness,"roughnesscode",inputRoughnessTable,"roughnesscode")
+                intersectionList.append(clipRoughness)
+                # Convert surface roughness to raster
+                arcpy.PolygonToRaster_conversion(clipRoughness,"f5",f5t)
+                deleteme.append(f5t)
+                outF5T = sa.Con(sa.IsNull(f5t),noEffect,f5t)
+                outF5T.save(f5)
+                deleteme.append(f5)
+            ccmFactorList.append(f5)
+
+        # Map Algebra to calc final CCM
+        if debug == True: arcpy.AddMessage("BEFORE: " + str(ccmFactorList))
+        if useNumpyEngine == True and tileSize > 0:
+            # F1, F2, the categorical factors and their product, computed per tile on the
+            # worker processes and written straight into the output
+            profiler.begin("CCM tiles", aoiCells)
+            if debug == True: arcpy.AddMessage("CCM tiles (" + str(workers) + " workers)")
+            if debug == True:
+                arcpyio.ccmTiled(inputElevation, inputAOI, ccmParameters, ccmFactorList[2:], outputCCM, tileSize, workers, env.scratchFolder, f1, f2, cacheFolder=terrainCache, cacheMB=terrainCacheMB, outputType=outputType)
+            else:
+                arcpyio.ccmTiled(inputElevation, inputAOI, ccmParameters, ccmFactorList[2:], outputCCM, tileSize, workers, env.scratchFolder, cacheFolder=terrainCache, cacheMB=terrainCacheMB, outputType=outputType)
+        elif useNumpyEngine == True:
+            # Any number of factors multiplied block by block straight into the output, with its
+            # statistics gathered in the same pass
+            profiler.begin("product", aoiCells)
+            if debug == True: arcpy.AddMessage(str(len(ccmFactorList)) + " factors " + str(ccmFactorList))
+            arcpyio.productTiled(inputElevation, inputAOI, ccmFactorList, outputCCM, tileSize, env.scratchFolder, outputType)
+        else:
+            profiler.begin("product", aoiCells)
+            if debug == True: arcpy.AddMessage(str(len(ccmFactorList)) + " factors " + str(ccmFactorList))
+            targetCCM = sa.Raster(ccmFactorList[0])
+            for factor in ccmFactorList[1:]:
+                targetCCM = targetCCM * sa.Raster(factor)
+            targetCCM.save(outputCCM)
 
     # set the output
     arcpy.SetParameter(5,outputCCM)
     if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
 
     # cleanup intermediate datasets
+    profiler.begin("cleanup")
     if debug == True: arcpy.AddMessage("Removing intermediate datasets...")
     for i in deleteme:
         if debug == True: arcpy.AddMessage("Removing: " + str(i))
@@ -299,10 +417,14 @@ try:
             pass
     if debug == True: arcpy.AddMessage("Done")
 
-except "WrongFactors" as ccmFactorList:
-    msg = "Wrong Number of Factors given: " + str(ccmFactorList)
-    arcpy.AddError(msg)
-    print(msg)
+    # stage times
+    profiling.stop()
+    if profile == True:
+        for line in profiler.summary():
+            arcpy.AddMessage(line)
+        if profileFolder:
+            tracePath = os.path.join(profileFolder, "DismountedCCM_" + time.strftime("%Y%m%d_%H%M%S") + ".json")
+            arcpy.AddMessage("Profile: " + profiler.writeTrace(tracePath))
 
 except arcpy.ExecuteError:
     if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
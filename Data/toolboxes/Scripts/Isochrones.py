@@ -0,0 +1,98 @@
+# ==================================================
+# Isochrones.py
+# --------------------------------------------------
+# Built on ArcGIS 10.2
+# --------------------------------------------------
+#
+# Generates a travel time raster over a Cross Country Mobility raster (the output of MountedCCM.py
+# or DismountedCCMpy3.py) from every feature of a source layer at once, e.g. ZonesOfEntry: each
+# cell holds the hours needed to reach it from the nearest source.  Optionally the times are banded
+# every intervalHours into isochrone polygons.
+#
+# The CCM value of a cell is read as a relative speed: at speedKPH km/h for a CCM of 1, a cell of
+# CCM 0.5 is crossed at half that speed.  NoData and CCM values of 0 or less cannot be entered.
+#
+# Spatial Analyst is required.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import os, sys, time, traceback
+import arcpy
+from arcpy import env
+from ccmengine import arcpyio
+
+
+# LOCALS ===========================================
+# Check out the ArcGIS Spatial Analyst extension license
+arcpy.CheckOutExtension("Spatial")
+debug = True
+
+# ARGUMENTS ========================================
+inputCCM = arcpy.GetParameterAsText(0) # CCM raster
+inputSources = arcpy.GetParameterAsText(1) # e.g. ZonesOfEntry
+outputTimes = arcpy.GetParameterAsText(2) # travel time raster, hours
+outputPolygons = arcpy.GetParameterAsText(3) # optional isochrone polygons
+inputInterval = arcpy.GetParameterAsText(4) # hours per band, where "1" is default
+inputBands = arcpy.GetParameterAsText(5) # number of bands; the search stops at the last ("" = no limit)
+inputSpeed = arcpy.GetParameterAsText(6) # km/h at a CCM of 1, where "1" is default
+inputConnectivity = arcpy.GetParameterAsText(7) # "8" or "16", where "8" is default
+
+# ==================================================
+
+
+try:
+
+    if debug == True:
+        arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    env.overwriteOutput = True
+
+    intervalHours = float(inputInterval) if inputInterval else 1.0
+    bandCount = int(inputBands) if inputBands else None
+    speedKPH = float(inputSpeed) if inputSpeed else 1.0
+    connectivity = int(inputConnectivity) if inputConnectivity else 8
+    if debug == True:
+        arcpy.AddMessage("Interval (hours): " + str(intervalHours))
+        arcpy.AddMessage("Bands: " + str(bandCount))
+        arcpy.AddMessage("Speed at CCM 1 (km/h): " + str(speedKPH))
+        arcpy.AddMessage("Connectivity: " + str(connectivity))
+
+    arcpy.AddMessage("Generating travel times...")
+    arcpyio.isochroneRasters(inputCCM, inputSources, outputTimes, env.scratchFolder, intervalHours, bandCount,
+                             outputPolygons if outputPolygons else None, speedKPH / 3.6, connectivity)
+
+    # set the outputs
+    arcpy.SetParameter(2, outputTimes)
+    if outputPolygons:
+        arcpy.SetParameter(3, outputPolygons)
+    if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+
+except arcpy.ExecuteError:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+    arcpy.AddError("Traceback: " + tbinfo)
+    # Get the tool error messages
+    msgs = arcpy.GetMessages()
+    arcpy.AddError(msgs)
+    print(msgs)
+
+except:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+    msgs = "ArcPy ERRORS:\n" + arcpy.GetMessages() + "\n"
+
+    # Return python error messages for use in script tool or Python Window
+    arcpy.AddError(pymsg)
+    arcpy.AddError(msgs)
+
+    # Print Python error messages for use in Python / Python Window
+    print(pymsg + "\n")
+    print(msgs)
@@ -0,0 +1,93 @@
+# ==================================================
+# LeastTimeRoute.py
+# --------------------------------------------------
+# Built on ArcGIS 10.2
+# --------------------------------------------------
+#
+# Finds least-time routes over a Cross Country Mobility raster (the output of MountedCCM.py or
+# DismountedCCMpy3.py) between consecutive points of a point feature class, e.g. PointLocations.
+# The CCM value of a cell is read as a relative speed: at speedKPH km/h for a CCM of 1, a cell of
+# CCM 0.5 is crossed at half that speed.  NoData and CCM values of 0 or less cannot be entered.
+#
+# Each route is a polyline through cell centres with the object ids of its two points and its
+# travel time in seconds.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import sys, time, traceback
+import arcpy
+from arcpy import env
+from ccmengine import arcpyio
+
+
+# LOCALS ===========================================
+debug = True
+# Routes are least-time routes searched over the grid.  A folder here, e.g.
+# os.path.join(tempfile.gettempdir(), "CCMRouteIndex"), keeps a route index of each CCM instead,
+# so the runs after the first over the same CCM answer every route from it much faster.  Index
+# routes are approximate: in tests they took up to 1.25 times the least time, 1.01 times on
+# average (ccmengine/hierarchy.py).
+routeIndexFolder = ""
+
+# ARGUMENTS ========================================
+inputCCM = arcpy.GetParameterAsText(0) # CCM raster
+inputPoints = arcpy.GetParameterAsText(1) # route stops, visited in object id order
+outputRoutes = arcpy.GetParameterAsText(2) # polyline feature class
+inputSpeed = arcpy.GetParameterAsText(3) # km/h at a CCM of 1, where "1" is default
+inputConnectivity = arcpy.GetParameterAsText(4) # "8" or "16", where "8" is default
+
+# ==================================================
+
+
+try:
+
+    if debug == True:
+        arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    env.overwriteOutput = True
+
+    speedKPH = float(inputSpeed) if inputSpeed else 1.0
+    connectivity = int(inputConnectivity) if inputConnectivity else 8
+    if debug == True:
+        arcpy.AddMessage("Speed at CCM 1 (km/h): " + str(speedKPH))
+        arcpy.AddMessage("Connectivity: " + str(connectivity))
+
+    arcpy.AddMessage("Routing...")
+    routes = arcpyio.routePoints(inputCCM, inputPoints, outputRoutes, speedKPH / 3.6, connectivity,
+                                 indexFolder=routeIndexFolder)
+    for route in routes:
+        arcpy.AddMessage(str(len(route.cells)) + " cells, " + str(round(route.time / 60.0, 1)) + " minutes")
+
+    # set the output
+    arcpy.SetParameter(2, outputRoutes)
+    if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+
+except arcpy.ExecuteError:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+    arcpy.AddError("Traceback: " + tbinfo)
+    # Get the tool error messages
+    msgs = arcpy.GetMessages()
+    arcpy.AddError(msgs)
+    print(msgs)
+
+except:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+    msgs = "ArcPy ERRORS:\n" + arcpy.GetMessages() + "\n"
+
+    # Return python error messages for use in script tool or Python Window
+    arcpy.AddError(pymsg)
+    arcpy.AddError(msgs)
+
+    # Print Python error messages for use in Python / Python Window
+    print(pymsg + "\n")
+    print(msgs)
@@ -0,0 +1,110 @@
+# ==================================================
+# MobilityCorridors.py
+# --------------------------------------------------
+# Built on ArcGIS 10.2
+# --------------------------------------------------
+#
+# Derives mobility corridors from a Cross Country Mobility raster (the output of MountedCCM.py or
+# DismountedCCMpy3.py).  Cells are classed GO where the CCM is at least the GO threshold, SLOW-GO
+# where it is at least the SLOW-GO threshold and NO-GO below it or where the CCM is NoData.  The
+# width of open ground around each passable cell is measured to the nearest NO-GO cell, and the
+# passable cells at least the minimum width wide are joined into corridors through their 8
+# neighbours.
+#
+# Each corridor is a polygon with its number, cell count and mean width in metres.  The classes
+# (1 GO, 2 SLOW-GO, 3 NO-GO) and the widths can also be saved as rasters, and the classes as
+# polygons.  The polygons are traced from the cells without RasterToPolygon; with a simplify
+# tolerance (map units, about one cell smooths the cell steps) neighbouring polygons keep sharing
+# their boundaries.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import os, sys, time, traceback
+import arcpy
+from arcpy import env
+from ccmengine import arcpyio
+
+
+# LOCALS ===========================================
+debug = True
+tileSize = 1024 # cells per tile side
+maxWidth = 1000.0 # widths are measured up to this many metres
+
+# ARGUMENTS ========================================
+inputCCM = arcpy.GetParameterAsText(0) # CCM raster
+outputCorridors = arcpy.GetParameterAsText(1) # polygon feature class
+inputGoThreshold = arcpy.GetParameterAsText(2) # lowest CCM of GO, where "0.5" is default
+inputSlowGoThreshold = arcpy.GetParameterAsText(3) # lowest CCM of SLOW-GO, where "0.1" is default
+inputMinWidth = arcpy.GetParameterAsText(4) # narrowest corridor in metres, where "0" is default
+outputClasses = arcpy.GetParameterAsText(5) # optional GO/SLOW-GO/NO-GO raster
+outputWidth = arcpy.GetParameterAsText(6) # optional corridor width raster
+outputClassPolygons = arcpy.GetParameterAsText(7) # optional GO/SLOW-GO/NO-GO polygon feature class
+inputTolerance = arcpy.GetParameterAsText(8) # simplify tolerance in map units, where "" is no simplifying
+
+# ==================================================
+
+
+try:
+
+    if debug == True:
+        arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    env.overwriteOutput = True
+
+    goThreshold = float(inputGoThreshold) if inputGoThreshold else 0.5
+    slowGoThreshold = float(inputSlowGoThreshold) if inputSlowGoThreshold else 0.1
+    minWidth = float(inputMinWidth) if inputMinWidth else 0.0
+    tolerance = float(inputTolerance) if inputTolerance else None
+    if slowGoThreshold > goThreshold:
+        raise ValueError("The SLOW-GO threshold is above the GO threshold")
+    if debug == True:
+        arcpy.AddMessage("GO threshold: " + str(goThreshold))
+        arcpy.AddMessage("SLOW-GO threshold: " + str(slowGoThreshold))
+        arcpy.AddMessage("Minimum width (m): " + str(minWidth))
+
+    arcpy.AddMessage("Labelling corridors...")
+    statistics = arcpyio.mobilityCorridors(inputCCM, outputCorridors, env.scratchFolder, goThreshold,
+                                           slowGoThreshold, minWidth, maxWidth, tileSize,
+                                           outputClasses or None, outputWidth or None,
+                                           outputClassPolygons or None, tolerance)
+    arcpy.AddMessage(str(len(statistics["cells"]) - 1) + " corridors")
+
+    # set the outputs
+    arcpy.SetParameter(1, outputCorridors)
+    if outputClasses:
+        arcpy.SetParameter(5, outputClasses)
+    if outputWidth:
+        arcpy.SetParameter(6, outputWidth)
+    if outputClassPolygons:
+        arcpy.SetParameter(7, outputClassPolygons)
+    if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+
+except arcpy.ExecuteError:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+    arcpy.AddError("Traceback: " + tbinfo)
+    # Get the tool error messages
+    msgs = arcpy.GetMessages()
+    arcpy.AddError(msgs)
+    print(msgs)
+
+except:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+    msgs = "ArcPy ERRORS:\n" + arcpy.GetMessages() + "\n"
+
+    # Return python error messages for use in script tool or Python Window
+    arcpy.AddError(pymsg)
+    arcpy.AddError(msgs)
+
+    # Print Python error messages for use in Python / Python Window
+    print(pymsg + "\n")
+    print(msgs)
@@ -0,0 +1,209 @@
+# ==================================================
+# MountedCCMBatch.py
+# --------------------------------------------------
+# Built on ArcGIS 10.2
+# --------------------------------------------------
+#
+# Generates mounted Cross Country Mobility rasters for several convoys in one run.  The slope,
+# surface curvature, vegetation, soils and roughness factors do not depend on the convoy, so they
+# are computed once; only F1 (the lowest common denominator of each convoy's vehicle
+# characteristics) differs, and the CCM of convoy k is written to band k of a multiband output.
+#
+# Convoys are given as one string: convoys separated by ";" and the vehicles of a convoy by ",",
+# e.g. "HMMWV,HEMTT;Generic ATV".
+#
+# Data is presumed to be in the WGS 1984 Auxiliary Sphere spatial reference (GCS_WGS_1984)
+#
+# Spatial Analyst is required.
+#
+# ==================================================
+
+
+# IMPORTS ==========================================
+import os, sys, math, tempfile, time, traceback
+import arcpy
+from arcpy import da
+from arcpy import env
+from arcpy import sa
+import ccmengine
+from ccmengine import arcpyio
+from ccmengine import params
+
+
+# LOCALS ===========================================
+# Check out the ArcGIS Spatial Analyst extension license
+arcpy.CheckOutExtension("Spatial")
+deleteme = []
+debug = True
+# Walk the DEM in tiles of tileSize x tileSize cells (0 = the whole AOI at once)
+tileSize = 0
+# Worker processes (0 = one per core)
+workers = 1
+# Slope and focal range are kept here between runs ("" = no cache); the cache is capped at terrainCacheMB
+terrainCache = os.path.join(tempfile.gettempdir(), "CCMTerrainCache")
+terrainCacheMB = 4096
+ccmFactorList = []
+
+# ARGUMENTS ========================================
+inputAOI = arcpy.GetParameterAsText(0)
+inputVehicleParameterTable = arcpy.GetParameterAsText(1)
+
+# The convoys: "vehicle,vehicle;vehicle,..."
+inputConvoys = arcpy.GetParameterAsText(2)
+
+inputElevation = arcpy.GetParameterAsText(3)
+
+outputCCM = arcpy.GetParameterAsText(4)
+
+inputVegetation = arcpy.GetParameterAsText(5)
+inputVegetationConversionTable = arcpy.GetParameterAsText(6)
+min_max = arcpy.GetParameterAsText(7) # "MAX" or "MIN", where "MAX" is default
+
+inputSoils = arcpy.GetParameterAsText(8)
+inputSoilsTable = arcpy.GetParameterAsText(9)
+wet_dry = arcpy.GetParameterAsText(10) # "DRY" or "WET", #where "DRY" is default
+
+inputSurfaceRoughness = arcpy.GetParameterAsText(11)
+inputRoughnessTable = arcpy.GetParameterAsText(12)
+
+# ==================================================
+
+env.extent = inputAOI
+env.snapRaster = inputElevation
+env.mask = inputAOI
+
+
+def categoricalFactor(inputFeatures, codeField, inputTable, factorField, name):
+    # F3/F4/F5 raster: burned straight from the geodatabase when possible, otherwise
+    # Clip -> JoinField -> PolygonToRaster with no effect (1.0) where nothing applies
+    factor = os.path.join(scratch, name)
+    deleteme.append(factor)
+    if arcpyio.factorRaster(inputFeatures, codeField, inputTable, factorField, inputElevation, inputAOI, factor) is not None:
+        return factor
+    clipped = os.path.join("in_memory", name + "Clip")
+    factorT = os.path.join(scratch, name + "t")
+    deleteme.append(clipped)
+    deleteme.append(factorT)
+    arcpyio.clipByIndex(inputFeatures, inputAOI, clipped)
+    arcpy.JoinField_management(clipped, codeField, inputTable, codeField)
+    arcpy.PolygonToRaster_conversion(clipped, factorField, factorT)
+    outFactor = sa.Con(sa.IsNull(factorT), 1.0, factorT)
+    outFactor.save(factor)
+    return factor
+
+
+try:
+
+    if debug == True:
+        arcpy.AddMessage("START: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    scratch = env.scratchGDB
+    if debug == True: arcpy.AddMessage("scratch: " + str(scratch))
+    env.overwriteOutput = True
+    env.resample = "NEAREST"
+    env.compression = "LZ77"
+    env.rasterStatistics = 'STATISTICS'
+
+    ######################################################
+    # Which vehicles are in each convoy?
+    ######################################################
+    convoys = []
+    for convoy in inputConvoys.split(";"):
+        vehicles = [vehicle.strip().strip("'\"").strip() for vehicle in convoy.split(",")]
+        vehicles = [vehicle for vehicle in vehicles if vehicle != ""]
+        if len(vehicles) > 0:
+            convoys.append(vehicles)
+
+    elevationDescription = arcpy.Describe(inputElevation)
+    env.cellSize = elevationDescription.children[0].meanCellHeight
+
+    if debug == True:
+        arcpy.AddMessage("inputAOI: " + str(inputAOI))
+        arcpy.AddMessage("Extent: " + str(env.extent))
+        arcpy.AddMessage("Number of Convoys: " + str(len(convoys)))
+        arcpy.AddMessage("Cell Size: " + str(env.cellSize))
+
+    ######################################################
+    # The tolerances of every convoy from one read of the vehicle table
+    ######################################################
+    arcpy.AddMessage("Retrieving vehicle statistics...")
+    envelopes = params.convoyStatistics(inputVehicleParameterTable, convoys, arcpy.AddWarning)
+    if envelopes is None:
+        columns = arcpyio.readColumns(inputVehicleParameterTable, params.VEHICLE_FIELDS)
+        envelopes = params.convoyEnvelopes(columns, convoys, arcpy.AddWarning)
+
+    paramsList = []
+    for band, (convoy, envelope) in enumerate(zip(convoys, envelopes)):
+        (minVehicleWeight, maxVehicleWeight, minVehicleKPH, minVehicleOnRoadSlope, minVehicleOffRoadSlope) = envelope
+        speedOverWeight = ccmengine.mountedSpeedOverWeight(minVehicleKPH, maxVehicleWeight)
+        paramsList.append(ccmengine.CCMParameters(minVehicleOnRoadSlope, speedOverWeight))
+        arcpy.AddMessage("Band " + str(band + 1) + ": " + ", ".join(convoy))
+        if debug == True:
+            arcpy.AddMessage("  minVehicleWeight: " + str(minVehicleWeight))
+            arcpy.AddMessage("  maxVehicleWeight: " + str(maxVehicleWeight))
+            arcpy.AddMessage("  minVehicleKPH: " + str(minVehicleKPH))
+            arcpy.AddMessage("  minVehicleOnRoadSlope: " + str(minVehicleOnRoadSlope))
+            arcpy.AddMessage("  minVehicleOffRoadSlope: " + str(minVehicleOffRoadSlope))
+
+    ##########################################################
+    # F3, F4, F5: the categorical factors, shared by every convoy
+    ##########################################################
+    if inputVegetation and arcpy.Exists(inputVegetation) == True:
+        arcpy.AddMessage("Rasterizing vegetation...")
+        fieldF3 = "f3max" if min_max == "MAX" else "f3min"
+        ccmFactorList.append(categoricalFactor(inputVegetation, "f_code", inputVegetationConversionTable, fieldF3, "f3"))
+
+    if inputSoils and arcpy.Exists(inputSoils) == True:
+        arcpy.AddMessage("Rasterizing soils...")
+        fieldF4 = "f4dry" if wet_dry == "DRY" else "f4wet"
+        ccmFactorList.append(categoricalFactor(inputSoils, "soilcode", inputSoilsTable, fieldF4, "f4"))
+
+    if inputSurfaceRoughness and arcpy.Exists(inputSurfaceRoughness) == True:
+        arcpy.AddMessage("Rasterizing roughness...")
+        ccmFactorList.append(categoricalFactor(inputSurfaceRoughness, "roughnesscode", inputRoughnessTable, "f5", "f5"))
+
+    ##########################################################
+    # F1 per convoy, the shared F2 and one CCM band per convoy
+    ##########################################################
+    if debug == True: arcpy.AddMessage(str(time.strftime("CCM bands (" + str(workers) + " workers): %m/%d/%Y  %H:%M:%S", time.localtime())))
+    arcpyio.ccmBatchTiled(inputElevation, inputAOI, paramsList, ccmFactorList, outputCCM, tileSize, workers, env.scratchFolder, cacheFolder=terrainCache, cacheMB=terrainCacheMB)
+
+    # set the output
+    arcpy.SetParameter(4, outputCCM)
+    if debug == True: arcpy.AddMessage("DONE: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+
+    # cleanup intermediate datasets
+    if debug == True: arcpy.AddMessage("Removing intermediate datasets...")
+    for i in deleteme:
+        if debug == True: arcpy.AddMessage("Removing: " + str(i))
+        if arcpy.Exists(i):
+            arcpy.Delete_management(i)
+    if debug == True: arcpy.AddMessage("Done")
+
+except arcpy.ExecuteError:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+    arcpy.AddError("Traceback: " + tbinfo)
+    # Get the tool error messages
+    msgs = arcpy.GetMessages()
+    arcpy.AddError(msgs)
+    print(msgs)
+
+except:
+    if debug == True: arcpy.AddMessage("CRASH: " + str(time.strftime("%m/%d/%Y  %H:%M:%S", time.localtime())))
+    # Get the traceback object
+    tb = sys.exc_info()[2]
+    tbinfo = traceback.format_tb(tb)[0]
+
+    # Concatenate information together concerning the error into a message string
+    pymsg = "PYTHON ERRORS:\nTraceback info:\n" + tbinfo + "\nError Info:\n" + str(sys.exc_info()[1])
+    msgs = "ArcPy ERRORS:\n" + arcpy.GetMessages() + "\n"
+
+    # Return python error messages for use in script tool or Python Window
+    arcpy.AddError(pymsg)
+    arcpy.AddError(msgs)
+
+    # Print Python error messages for use in Python / Python Window
+    print(pymsg + "\n")
+    print(msgs)
@@ -0,0 +1,33 @@
+# ==================================================
+# ccmengine
+# --------------------------------------------------
+# NumPy backend for the Cross Country Mobility tools.
+# --------------------------------------------------
+#
+# The CCM scripts hand arrays to this package instead of chaining Spatial
+# Analyst tools through env.scratchGDB.
+#
+# ==================================================
+
+from .grid import Grid
+from .terrain import curvature, focalRange, focalRangeMax, slopePercent, surfaceDerivatives
+from .engine import (CCMParameters, clampSlope, crop, dismountedSpeedOverWeight,
+                     f1FromSlope, f2Block, f2FromRange, fusedSlopeF1, mountedSpeedOverWeight,
+                     terrainFactorsBlock)
+from .tiling import ArraySink, ArraySource, BandSplitSink, NpySource, iterTiles, runTiled
+from .parallel import ccmBatchParallel, ccmParallel
+from .gdbraster import RasterDataset, openRaster
+from .filegdb import Geodatabase, Table, openTable
+from .spatialindex import SpatialIndex
+from .rasterize import codeLookup, codeRaster, rasterizeFactor, rasterizeFactors
+from .cache import DerivativeCache
+from .pipeline import Pipeline, ccmPipeline
+from .routing import Route, RoutingGrid
+from .isochrones import travelTime
+from .hierarchy import RouteIndex, routeIndex
+from .corridors import classify, corridorsTiled, label
+from .shapefile import ShapefileWriter
+from .vectorize import ShapefileSink, polygonsTiled
+from .quantize import Quantization, QuantizedSink, QuantizedSource
+from .geotiff import GeoTiffWriter
+from .profiling import Profiler
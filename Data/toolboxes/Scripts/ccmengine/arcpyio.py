@@ -0,0 +1,851 @@
+# ==================================================
+# arcpyio.py
+# --------------------------------------------------
+# Moves rasters between arcpy and the NumPy CCM engine.
+# --------------------------------------------------
+#
+# arcpy is imported when these functions are called so the rest of the
+# engine can be used on machines without ArcGIS.
+#
+# Single band outputs with a .tif path are written by geotiff.GeoTiffWriter
+# (tiled, compressed on GEOTIFF_WORKERS threads, with internal overviews)
+# rather than through NumPyArrayToRaster and MosaicToNewRaster, so they can
+# be displayed without building pyramids first.
+#
+# Reads, writes and the AOI mask are timed as stages of the current
+# profiling.Profiler, when one is started.
+#
+# ==================================================
+
+import multiprocessing
+import os
+
+import numpy
+
+from . import cache
+from . import corridors
+from . import filegdb
+from . import geotiff
+from . import gdbraster
+from . import hierarchy
+from . import isochrones
+from . import parallel
+from . import params
+from . import pipeline
+from . import profiling
+from . import quantize
+from . import rasterize
+from . import routing
+from . import spatialindex
+from . import tiling
+from . import vectorize
+from .grid import Grid
+
+
+def rasterGrid(inputRaster):
+    # Grid of a raster dataset (path or arcpy.Raster); geographic when the
+    # raster is in degrees, so the terrain kernels use metric cell sizes
+    import arcpy
+    raster = inputRaster if isinstance(inputRaster, arcpy.Raster) else arcpy.Raster(inputRaster)
+    spatialReference = raster.spatialReference
+    geographic = spatialReference is not None and spatialReference.type == "Geographic"
+    return Grid(raster.extent.XMin, raster.extent.YMax,
+                raster.meanCellWidth, raster.meanCellHeight,
+                raster.height, raster.width, geographic)
+
+
+def readRasterWindow(inputRaster, window, halo=0):
+    # Reads a window (a Grid aligned with the raster) plus a halo of cells on
+    # every side as a float64 array with NoData as NaN.  Cells of the halo
+    # that lie beyond the raster are NoData.
+    import arcpy
+    raster = inputRaster if isinstance(inputRaster, arcpy.Raster) else arcpy.Raster(inputRaster)
+    nrows = window.nrows + 2 * halo
+    ncols = window.ncols + 2 * halo
+    lowerLeft = arcpy.Point(window.xMin - halo * window.cellWidth,
+                            window.yMin - halo * window.cellHeight)
+    quantization = rasterQuantization(raster)
+    if quantization is not None:
+        # stored codes, decoded with the scale and offset beside the raster
+        block = arcpy.RasterToNumPyArray(raster, lowerLeft, ncols, nrows, quantization.noData)
+        return quantization.decode(block.astype(quantization.dtype))
+    block = arcpy.RasterToNumPyArray(raster, lowerLeft, ncols, nrows)
+    block = block.astype(numpy.float64)
+    if raster.noDataValue is not None:
+        block[block == raster.noDataValue] = numpy.nan
+    return block
+
+
+def rasterQuantization(raster):
+    # quantize.Quantization of an arcpy.Raster, or None when it holds plain
+    # values; a sidecar left over from an earlier quantized raster of the
+    # same name is ignored when the pixel type no longer matches
+    quantization = quantize.readSidecar(raster.catalogPath)
+    if quantization is None or raster.pixelType != {"uint8": "U8", "uint16": "U16"}.get(quantization.dtype):
+        return None
+    return quantization
+
+
+def aoiWindow(inputRaster, inputAOI):
+    # The raster cells covering the AOI extent, snapped to the raster grid
+    # the way env.snapRaster = inputElevation aligns the Spatial Analyst tools.
+    import arcpy
+    grid = rasterGrid(inputRaster)
+    extent = arcpy.Describe(inputAOI).extent
+    row0, col0, nrows, ncols = grid.snap(extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+    return grid.window(row0, col0, nrows, ncols)
+
+
+# tiled GeoTIFF outputs: compression ("deflate", "lzw", "zstd" or "none"),
+# tile size and compression threads
+GEOTIFF_COMPRESSION = "deflate"
+GEOTIFF_TILE_SIZE = 256
+GEOTIFF_WORKERS = multiprocessing.cpu_count()
+
+# NumPy types of the MosaicToNewRaster pixel types
+PIXEL_TYPES = {"8_BIT_UNSIGNED": "uint8", "16_BIT_UNSIGNED": "uint16", "32_BIT_SIGNED": "int32",
+               "32_BIT_FLOAT": "float32", "64_BIT": "float64"}
+
+
+def isGeoTiff(outputRaster):
+    return outputRaster is not None and os.path.splitext(outputRaster)[1].lower() in (".tif", ".tiff")
+
+
+class GeoTiffSink(object):
+    # tiling sink writing outputRaster with geotiff.GeoTiffWriter.  Integer
+    # pixel types keep 0 as NoData and their overviews take the upper left
+    # cell, as suits class rasters.  The coordinate system goes in as its
+    # EPSG code, or through DefineProjection when it has none.
+
+    def __init__(self, grid, outputRaster, spatialReference=None, pixelType="32_BIT_FLOAT",
+                 quantization=None):
+        self.outputRaster = outputRaster
+        self.spatialReference = spatialReference
+        self.quantization = quantization
+        dtype = PIXEL_TYPES[pixelType]
+        epsg = spatialReference.factoryCode if spatialReference is not None else None
+        self.writer = geotiff.GeoTiffWriter(outputRaster, grid, dtype, quantization=quantization, epsg=epsg,
+                                            compression=GEOTIFF_COMPRESSION, tileSize=GEOTIFF_TILE_SIZE,
+                                            resampling="nearest" if dtype[0] in "ui" and quantization is None
+                                            else "average", workers=GEOTIFF_WORKERS)
+
+    def write(self, row0, col0, block):
+        self.writer.write(row0, col0, block)
+
+    def close(self):
+        import arcpy
+        self.writer.close()
+        if self.spatialReference is not None and not self.spatialReference.factoryCode:
+            arcpy.DefineProjection_management(self.outputRaster, self.spatialReference)
+        quantize.writeSidecar(self.outputRaster, self.quantization)
+        return self.outputRaster
+
+
+def arrayToRaster(array, grid, outputRaster=None, spatialReference=None, quantization=None):
+    # Converts a 2D array, or a (bands, rows, cols) array, with NaN as NoData
+    # on the grid to an arcpy.Raster.  The raster is only written to disk
+    # when outputRaster is given.  With a quantize.Quantization the codes
+    # are stored and the scale and offset written beside the raster.
+    if outputRaster is None:
+        return _saveArray(array, grid, outputRaster, spatialReference, quantization)
+    with profiling.stage(_writeStage(outputRaster), array.size) as timing:
+        timing.count(bytesWritten=array.nbytes)
+        return _saveArray(array, grid, outputRaster, spatialReference, quantization)
+
+
+def _writeStage(outputRaster):
+    return "write " + os.path.basename(outputRaster)
+
+
+def _saveArray(array, grid, outputRaster, spatialReference, quantization):
+    import arcpy
+    if isGeoTiff(outputRaster) and array.ndim == 2 and (array.dtype.kind == "f" or quantization is not None):
+        pixelType = "64_BIT" if array.dtype == numpy.float64 else "32_BIT_FLOAT"
+        sink = GeoTiffSink(grid, outputRaster, spatialReference, pixelType, quantization)
+        sink.write(0, 0, array)
+        sink.close()
+        return arcpy.Raster(outputRaster)
+    lowerLeft = arcpy.Point(grid.xMin, grid.yMin)
+    noData = numpy.nan
+    if quantization is not None:
+        array = quantization.encode(array)
+        noData = quantization.noData
+    raster = arcpy.NumPyArrayToRaster(array, lowerLeft, grid.cellWidth, grid.cellHeight, noData)
+    if outputRaster is not None:
+        raster.save(outputRaster)
+        if spatialReference is not None:
+            arcpy.DefineProjection_management(outputRaster, spatialReference)
+        quantize.writeSidecar(outputRaster, quantization)
+        raster = arcpy.Raster(outputRaster)
+    return raster
+
+
+# pixel types of the outputType of the CCM scripts
+OUTPUT_TYPES = {"FLOAT32": (None, "32_BIT_FLOAT"),
+                "UINT16": ("uint16", "16_BIT_UNSIGNED"),
+                "UINT8": ("uint8", "8_BIT_UNSIGNED")}
+
+
+def outputQuantization(outputType, upper, lower=0.0):
+    # quantize.Quantization of values in [lower, upper] stored as outputType,
+    # None for float output
+    dtype = OUTPUT_TYPES[outputType or "FLOAT32"][0]
+    if dtype is None:
+        return None
+    return quantize.Quantization.forRange(dtype, lower, upper)
+
+
+def rasterMaximum(inputRaster, tileSize=1024):
+    # Upper bound of the values of a raster: the top of the range a
+    # quantized raster was written over (f1Maximum, 1.0 or the largest
+    # factor of the table), else the maximum of its statistics, else the
+    # maximum read from the raster tile by tile.  The .tif rasters the
+    # toolbox writes carry no statistics.
+    import arcpy
+    raster = inputRaster if isinstance(inputRaster, arcpy.Raster) else arcpy.Raster(inputRaster)
+    quantization = rasterQuantization(raster)
+    if quantization is not None:
+        return quantization.upper
+    if raster.maximum is not None:
+        return float(raster.maximum)
+    source = RasterSource(raster)
+    statistics = tiling.StatisticsSink()
+    tiling.productTiled([source], source.grid, statistics, tileSize)
+    maximum = statistics.statistics()[1]
+    return 1.0 if numpy.isnan(maximum) else float(maximum)
+
+
+def f1Maximum(params):
+    # F1 = (maxSlope - clamped slope) / speedOverWeight, largest on flat ground
+    return params.maxSlope / params.speedOverWeight
+
+
+class RasterSource(object):
+    # tiling source reading windows of a raster dataset through arcpy.  Only
+    # the path is pickled, so the source can be handed to worker processes.
+
+    def __init__(self, inputRaster):
+        import arcpy
+        if isinstance(inputRaster, arcpy.Raster):
+            inputRaster = inputRaster.catalogPath
+        self.path = inputRaster
+        self.raster = None
+        self.grid = rasterGrid(inputRaster)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["raster"] = None
+        return state
+
+    def read(self, window):
+        import arcpy
+        if self.raster is None:
+            self.raster = arcpy.Raster(self.path)
+        with profiling.stage("read " + os.path.basename(self.path)) as timing:
+            block = readRasterWindow(self.raster, window)
+            timing.count(cells=block.size, bytesRead=block.nbytes)
+        return block
+
+
+class MosaicSink(object):
+    # tiling sink that saves each tile as a raster in scratchFolder and
+    # mosaics them into outputRaster when closed.  Only one tile is held in
+    # memory at a time.  A block covering the whole grid is saved straight
+    # to outputRaster, so untiled runs write the output once.  With bands
+    # the blocks are (bands, rows, cols) and the output is a multiband
+    # raster.  With a quantize.Quantization the blocks are stored as its
+    # codes.  Single band .tif outputs are streamed through a GeoTiffSink
+    # instead, without scratch tiles.
+
+    def __init__(self, grid, outputRaster, scratchFolder, spatialReference=None,
+                 pixelType="32_BIT_FLOAT", bands=1, quantization=None):
+        self.grid = grid
+        self.outputRaster = outputRaster
+        self.scratchFolder = scratchFolder
+        self.spatialReference = spatialReference
+        self.pixelType = pixelType
+        if quantization is not None:
+            self.pixelType = OUTPUT_TYPES[quantization.dtype.upper()][1]
+        self.bands = bands
+        self.quantization = quantization
+        self.tiles = []
+        self.saved = False
+        self.geoTiff = None
+        if isGeoTiff(outputRaster) and bands == 1:
+            self.geoTiff = GeoTiffSink(grid, outputRaster, spatialReference, self.pixelType, quantization)
+
+    def write(self, row0, col0, block):
+        with profiling.stage(_writeStage(self.outputRaster), block.size) as timing:
+            timing.count(bytesWritten=block.nbytes)
+            self._write(row0, col0, block)
+
+    def _write(self, row0, col0, block):
+        if self.geoTiff is not None:
+            self.geoTiff.write(row0, col0, block)
+            return
+        if not self.tiles and block.shape[-2:] == self.grid.shape:
+            _saveArray(block, self.grid, self.outputRaster, self.spatialReference, self.quantization)
+            self.saved = True
+            return
+        name = os.path.splitext(os.path.basename(self.outputRaster))[0]
+        tilePath = os.path.join(self.scratchFolder, "%s_%d_%d.tif" % (name, row0, col0))
+        tile = self.grid.window(row0, col0, block.shape[-2], block.shape[-1])
+        _saveArray(block, tile, tilePath, self.spatialReference, self.quantization)
+        self.tiles.append(tilePath)
+
+    def close(self):
+        with profiling.stage(_writeStage(self.outputRaster)):
+            return self._close()
+
+    def _close(self):
+        import arcpy
+        if self.geoTiff is not None:
+            return self.geoTiff.close()
+        if self.saved:
+            return self.outputRaster
+        arcpy.MosaicToNewRaster_management(";".join(self.tiles), os.path.dirname(self.outputRaster),
+                                           os.path.basename(self.outputRaster), self.spatialReference,
+                                           self.pixelType, self.grid.cellWidth, self.bands)
+        if self.quantization is not None:
+            arcpy.SetRasterProperties_management(self.outputRaster, nodata="1 %d" % self.quantization.noData)
+        quantize.writeSidecar(self.outputRaster, self.quantization)
+        for tilePath in self.tiles:
+            if arcpy.Exists(tilePath):
+                arcpy.Delete_management(tilePath)
+                quantize.writeSidecar(tilePath, None)
+        self.tiles = []
+        return self.outputRaster
+
+
+def elevationSource(inputElevation):
+    # The native File Geodatabase reader when the DEM is stored in a .gdb,
+    # otherwise windows read through arcpy
+    import arcpy
+    if isinstance(inputElevation, arcpy.Raster):
+        inputElevation = inputElevation.catalogPath
+    source = gdbraster.openRaster(inputElevation)
+    if source is None:
+        source = RasterSource(inputElevation)
+    return source
+
+
+def terrainFactorsTiled(inputElevation, inputAOI, params, f1, f2, tileSize, scratchFolder, outputType=None):
+    # F1 and F2 rasters for the AOI computed tile by tile
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    source = elevationSource(elevation)
+    window = aoiWindow(elevation, inputAOI)
+    spatialReference = elevation.spatialReference
+    sinks = {"f1": MosaicSink(window, f1, scratchFolder, spatialReference,
+                              quantization=outputQuantization(outputType, f1Maximum(params))),
+             "f2": MosaicSink(window, f2, scratchFolder, spatialReference,
+                              quantization=outputQuantization(outputType, 1.0))}
+    return tiling.terrainFactorsTiled(source, window, params, sinks, tileSize)
+
+
+def aoiMaskRaster(inputRaster, inputAOI, maskRaster):
+    # Rasterizes the AOI polygon onto the raster grid (env.snapRaster and
+    # env.extent are expected to be set as in the CCM scripts)
+    import arcpy
+    oidField = arcpy.Describe(inputAOI).OIDFieldName
+    with profiling.stage("AOI mask"):
+        arcpy.PolygonToRaster_conversion(inputAOI, oidField, maskRaster, "CELL_CENTER", "",
+                                         rasterGrid(inputRaster).cellWidth)
+    return maskRaster
+
+
+def setStatistics(outputRaster, statistics, quantization=None):
+    # Stores (minimum, maximum, mean, std) as the statistics of band 1, in
+    # place of the pass env.rasterStatistics would make over the raster.
+    # Statistics of a quantized raster are stored in its codes.
+    import arcpy
+    if numpy.isnan(statistics[0]):
+        return
+    if quantization is not None:
+        minimum, maximum, mean, std = statistics
+        statistics = [(value - quantization.offset) / quantization.scale for value in (minimum, maximum, mean)]
+        statistics.append(std / quantization.scale)
+    arcpy.SetRasterProperties_management(outputRaster, "", "1 %r %r %r %r" % tuple(statistics))
+
+
+def _withoutStatistics(run, *args):
+    # Runs run(*args) with env.rasterStatistics off; the callers compute
+    # the statistics while writing
+    import arcpy
+    previous = arcpy.env.rasterStatistics
+    arcpy.env.rasterStatistics = "NONE"
+    try:
+        return run(*args)
+    finally:
+        arcpy.env.rasterStatistics = previous
+
+
+def productTiled(inputElevation, inputAOI, factorRasters, outputRaster, tileSize, scratchFolder,
+                 outputType=None):
+    # Final CCM: product of any number of factor rasters, tile by tile,
+    # with the cells outside the AOI polygon set to NoData as env.mask
+    # does.  The product is written once, straight into outputRaster, and
+    # its statistics are gathered in the same pass.  outputType (see
+    # OUTPUT_TYPES) stores it quantized over [0, product of the factor
+    # maxima (rasterMaximum)].
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    window = aoiWindow(elevation, inputAOI)
+    quantization = None
+    if OUTPUT_TYPES[outputType or "FLOAT32"][0] is not None:
+        upper = numpy.prod([rasterMaximum(factor, tileSize) for factor in factorRasters])
+        quantization = outputQuantization(outputType, upper)
+    mask = aoiMaskRaster(elevation, inputAOI, os.path.join(scratchFolder, "aoiMask.tif"))
+    sources = [RasterSource(factor) for factor in factorRasters]
+    sources.append(_UnitMask(RasterSource(mask)))
+    sink = tiling.StatisticsSink(MosaicSink(window, outputRaster, scratchFolder, elevation.spatialReference,
+                                            quantization=quantization))
+    with profiling.stage("product", window.nrows * window.ncols):
+        _withoutStatistics(tiling.productTiled, sources, window, sink, tileSize)
+    setStatistics(outputRaster, sink.statistics(), quantization)
+    arcpy.Delete_management(mask)
+    return outputRaster
+
+
+def ccmTiled(inputElevation, inputAOI, params, factorRasters, outputRaster, tileSize, workers,
+             scratchFolder, f1=None, f2=None, cacheFolder=None, cacheMB=4096, outputType=None):
+    # The whole CCM in one tiled pass: F1, F2, the F3..Fn factor rasters and
+    # their product per tile on a pool of workers (parallel.ccmParallel),
+    # written straight into outputRaster.  F1 and F2 are only saved when
+    # paths are given for them.  With a cacheFolder the slope and focal
+    # range come from (or are added to) a cache.DerivativeCache.  outputType
+    # (see OUTPUT_TYPES) stores the outputs quantized.
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    window = aoiWindow(elevation, inputAOI)
+    spatialReference = elevation.spatialReference
+    quantization = None
+    if OUTPUT_TYPES[outputType or "FLOAT32"][0] is not None:
+        upper = f1Maximum(params) * numpy.prod([rasterMaximum(factor, tileSize) for factor in factorRasters])
+        quantization = outputQuantization(outputType, upper)
+    mask = aoiMaskRaster(elevation, inputAOI, os.path.join(scratchFolder, "aoiMask.tif"))
+    sources = [RasterSource(factor) for factor in factorRasters]
+    sources.append(_UnitMask(RasterSource(mask)))
+    statistics = tiling.StatisticsSink(MosaicSink(window, outputRaster, scratchFolder, spatialReference,
+                                                  quantization=quantization))
+    sinks = {"ccm": statistics}
+    if f1 is not None:
+        sinks["f1"] = MosaicSink(window, f1, scratchFolder, spatialReference,
+                                 quantization=outputQuantization(outputType, f1Maximum(params)))
+    if f2 is not None:
+        sinks["f2"] = MosaicSink(window, f2, scratchFolder, spatialReference,
+                                 quantization=outputQuantization(outputType, 1.0))
+    demSource = elevationSource(elevation)
+    derivatives = None
+    if cacheFolder:
+        derivativeCache = cache.DerivativeCache(cacheFolder, cacheMB * 1024 ** 2)
+        derivatives = derivativeCache.derivatives(demSource, window, params, tileSize)
+    _withoutStatistics(parallel.ccmParallel, demSource, window, params, sinks, sources, tileSize,
+                       workers, derivatives)
+    setStatistics(outputRaster, statistics.statistics(), quantization)
+    arcpy.Delete_management(mask)
+    return outputRaster
+
+
+def ccmBatchTiled(inputElevation, inputAOI, paramsList, factorRasters, outputRaster, tileSize,
+                  workers, scratchFolder, f1=None, f2=None, cacheFolder=None, cacheMB=4096,
+                  bandFactors=None):
+    # ccmTiled for several convoys or scenarios sharing one terrain and
+    # factor stage (parallel.ccmBatchParallel).  outputRaster, and f1 when
+    # given, get one band per entry of paramsList; f2 is shared and single
+    # band.  A list of rasters for outputRaster writes one raster per band
+    # instead.  bandFactors picks the factor rasters of each band.
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    window = aoiWindow(elevation, inputAOI)
+    spatialReference = elevation.spatialReference
+    bands = len(paramsList)
+    mask = aoiMaskRaster(elevation, inputAOI, os.path.join(scratchFolder, "aoiMask.tif"))
+    sources = [RasterSource(factor) for factor in factorRasters]
+    sources.append(_UnitMask(RasterSource(mask)))
+    if isinstance(outputRaster, (list, tuple)):
+        sinks = {"ccm": tiling.BandSplitSink([MosaicSink(window, raster, scratchFolder, spatialReference)
+                                              for raster in outputRaster])}
+    else:
+        sinks = {"ccm": MosaicSink(window, outputRaster, scratchFolder, spatialReference, bands=bands)}
+    if f1 is not None:
+        sinks["f1"] = MosaicSink(window, f1, scratchFolder, spatialReference, bands=bands)
+    if f2 is not None:
+        sinks["f2"] = MosaicSink(window, f2, scratchFolder, spatialReference)
+    demSource = elevationSource(elevation)
+    derivatives = None
+    if cacheFolder:
+        derivativeCache = cache.DerivativeCache(cacheFolder, cacheMB * 1024 ** 2)
+        derivatives = derivativeCache.derivatives(demSource, window, paramsList[0], tileSize)
+    if bandFactors is not None:
+        # the AOI mask applies to every band
+        bandFactors = [list(positions) + [len(sources) - 1] for positions in bandFactors]
+    parallel.ccmBatchParallel(demSource, window, paramsList, sinks, sources, tileSize, workers,
+                              derivatives, bandFactors)
+    arcpy.Delete_management(mask)
+    return outputRaster
+
+
+def ccmIncremental(inputElevation, inputAOI, ccmParams, factorInputs, outputRaster, pipelineFolder,
+                   scratchFolder, maxMB=4096, f1=None, f2=None, outputType=None):
+    # The whole CCM through a pipeline.Pipeline stored in pipelineFolder, so
+    # only the stages whose inputs or settings changed since an earlier run
+    # are recomputed.  factorInputs lists (name, features, codeField, table,
+    # factorField) for F3..Fn.  Returns the names of the rebuilt stages, or
+    # None (before any work) when a factor cannot be read natively (see
+    # factorRasters); the caller then runs the stages itself.  outputType
+    # (see OUTPUT_TYPES) stores the outputs quantized.
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    spatialReference = elevation.spatialReference
+    window = aoiWindow(elevation, inputAOI)
+    upper = f1Maximum(ccmParams)
+    codeFactors = []
+    for name, inputFeatures, codeField, inputTable, factorField in factorInputs:
+        table = _featureTable(inputFeatures, spatialReference)
+        if table is None:
+            return None
+        lookup = params.lookupTable(inputTable, codeField, factorField)
+        if lookup is None:
+            return None
+        codes = rasterize.tableCodes([lookup])
+        lut = rasterize.codeLookup(codes, lookup)
+        upper *= float(numpy.nanmax(lut))
+        codeFactors.append((name, _codesFingerprint(table, codeField, codes),
+                            _codesCompute(table, codeField, codes, window), lut))
+
+    with profiling.stage("read DEM") as timing:
+        dem = elevationSource(elevation).read(tiling.withHalo(window, ccmParams.halo))
+        timing.count(cells=dem.size, bytesRead=dem.nbytes)
+    maskRaster = aoiMaskRaster(elevation, inputAOI, os.path.join(scratchFolder, "aoiMask.tif"))
+    mask = RasterSource(maskRaster).read(window)
+    arcpy.Delete_management(maskRaster)
+
+    ccmPipeline = pipeline.ccmPipeline(pipeline.Pipeline(pipelineFolder, maxMB * 1024 ** 2),
+                                       dem, window, ccmParams, mask=mask, codeFactors=codeFactors)
+    ccm, f1Array, f2Array = ccmPipeline.run(["ccm", "f1", "f2"])
+    quantization = outputQuantization(outputType, upper)
+    statistics = tiling.StatisticsSink()
+    statistics.write(0, 0, ccm)
+    _withoutStatistics(arrayToRaster, ccm, window, outputRaster, spatialReference, quantization)
+    setStatistics(outputRaster, statistics.statistics(), quantization)
+    if f1 is not None:
+        arrayToRaster(f1Array, window, f1, spatialReference, outputQuantization(outputType, f1Maximum(ccmParams)))
+    if f2 is not None:
+        arrayToRaster(f2Array, window, f2, spatialReference, outputQuantization(outputType, 1.0))
+    return ccmPipeline.rebuilt
+
+
+def routePoints(inputCCM, inputPoints, outputRoutes, speedScale=1.0, connectivity=8,
+                method="bidirectional", indexFolder=None):
+    # Least-time routes (routing.RoutingGrid) over a CCM raster from each
+    # point of inputPoints to the next, in object id order, saved as a
+    # polyline feature class with the object ids of the two points and the
+    # time of each route in seconds.  Points on NoData, or with no route
+    # between them, are reported and skipped.  With an indexFolder the
+    # routes come from the hierarchy.RouteIndex of the CCM kept there,
+    # built on the first run over a CCM.
+    import arcpy
+    ccm = arcpy.Raster(inputCCM)
+    grid = rasterGrid(ccm)
+    spatialReference = ccm.spatialReference
+    if indexFolder:
+        routingGrid = hierarchy.routeIndex(indexFolder, readRasterWindow(ccm, grid), grid, speedScale,
+                                           connectivity)
+    else:
+        routingGrid = routing.RoutingGrid(readRasterWindow(ccm, grid), grid, speedScale, connectivity)
+    points = sorted(row for row in arcpy.da.SearchCursor(inputPoints, ["OID@", "SHAPE@XY"],
+                                                          spatial_reference=spatialReference))
+    arcpy.CreateFeatureclass_management(os.path.dirname(outputRoutes), os.path.basename(outputRoutes),
+                                        "POLYLINE", spatial_reference=spatialReference)
+    for field, fieldType in (("fromoid", "LONG"), ("tooid", "LONG"), ("seconds", "DOUBLE")):
+        arcpy.AddField_management(outputRoutes, field, fieldType)
+    routes = []
+    with arcpy.da.InsertCursor(outputRoutes, ["SHAPE@", "fromoid", "tooid", "seconds"]) as cursor:
+        for (fromOid, fromXY), (toOid, toXY) in zip(points, points[1:]):
+            start = grid.cellOf(*fromXY)
+            end = grid.cellOf(*toXY)
+            if not (routingGrid.passable(*start) and routingGrid.passable(*end)):
+                arcpy.AddWarning("No route from %d to %d: a point is off the CCM or on NoData" % (fromOid, toOid))
+                continue
+            if indexFolder:
+                route = routingGrid.route(start, end)
+            else:
+                route = routingGrid.route(start, end, method)
+            if route is None:
+                arcpy.AddWarning("No route from %d to %d" % (fromOid, toOid))
+                continue
+            line = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for x, y in route.points(grid)]),
+                                  spatialReference)
+            cursor.insertRow([line, fromOid, toOid, route.time])
+            routes.append(route)
+    return routes
+
+
+def sourceCells(inputFeatures, inputRaster, scratchFolder):
+    # Boolean array of the raster cells the features cover (cell centres
+    # inside polygons, cells touched by points and lines), by
+    # FeatureToRaster on the raster's grid
+    import arcpy
+    raster = arcpy.Raster(inputRaster)
+    grid = rasterGrid(raster)
+    oidField = arcpy.Describe(inputFeatures).OIDFieldName
+    burned = os.path.join(scratchFolder, "sourceCells.tif")
+    previous = (arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.mask)
+    arcpy.env.snapRaster = raster
+    arcpy.env.extent = raster.extent
+    arcpy.env.mask = None
+    try:
+        arcpy.FeatureToRaster_conversion(inputFeatures, oidField, burned, grid.cellWidth)
+        cells = ~numpy.isnan(readRasterWindow(burned, grid))
+    finally:
+        arcpy.env.snapRaster, arcpy.env.extent, arcpy.env.mask = previous
+        if arcpy.Exists(burned):
+            arcpy.Delete_management(burned)
+    return cells
+
+
+def isochroneRasters(inputCCM, inputSources, outputTimes, scratchFolder, intervalHours=1.0,
+                     bandCount=None, outputPolygons=None, speedScale=1.0, connectivity=8):
+    # Travel time in hours from the nearest of the source features over a
+    # CCM raster (isochrones.travelTime), written to outputTimes.  The
+    # search stops at bandCount intervals when given.  With outputPolygons
+    # the times are also banded every intervalHours and the bands saved as
+    # polygons (codePolygons), one multipart feature per band with its
+    # number in "gridcode" and its upper bound in the "hours" field.
+    import arcpy
+    ccm = arcpy.Raster(inputCCM)
+    grid = rasterGrid(ccm)
+    spatialReference = ccm.spatialReference
+    sources = sourceCells(inputSources, ccm, scratchFolder)
+    horizon = None
+    if bandCount:
+        horizon = intervalHours * bandCount * 3600.0
+    times = isochrones.travelTime(readRasterWindow(ccm, grid), grid, sources, speedScale, connectivity,
+                                  horizon)
+    times /= 3600.0
+    arrayToRaster(times.astype(numpy.float32), grid, outputTimes, spatialReference)
+    if outputPolygons is not None:
+        codes = isochrones.bands(times, intervalHours, bandCount)
+        hours = numpy.arange(codes.max() + 1) * float(intervalHours)
+        codePolygons(tiling.ArraySource(codes, grid), grid, outputPolygons, scratchFolder, spatialReference,
+                     fields=[("hours", "F", 19, 6)], attributes={"hours": hours})
+    return times
+
+
+def mobilityCorridors(inputCCM, outputCorridors, scratchFolder, goThreshold, slowGoThreshold,
+                      minWidth=0.0, maxWidth=1000.0, tileSize=1024, outputClasses=None, outputWidth=None,
+                      outputClassPolygons=None, tolerance=None):
+    # GO / SLOW-GO / NO-GO corridors of a CCM raster (corridors.corridorsTiled)
+    # saved as polygons (codePolygons), one multipart feature per corridor
+    # with its number in "corridor", its cell count in "cells" and its mean
+    # width in metres in "width".  The classes (1 GO, 2 SLOW-GO, 3 NO-GO)
+    # and the widths are saved when paths are given for them, the classes
+    # as polygons too with outputClassPolygons.
+    import arcpy
+    ccm = arcpy.Raster(inputCCM)
+    grid = rasterGrid(ccm)
+    spatialReference = ccm.spatialReference
+    classSink = None
+    widthSink = None
+    if outputClassPolygons:
+        classSink = tiling.ArraySink(grid, numpy.uint8, os.path.join(scratchFolder, "corridorClasses.npy"))
+    elif outputClasses:
+        classSink = _ZeroAsNoData(MosaicSink(grid, outputClasses, scratchFolder, spatialReference,
+                                             "8_BIT_UNSIGNED"))
+    if outputWidth:
+        widthSink = MosaicSink(grid, outputWidth, scratchFolder, spatialReference)
+    labelPath = os.path.join(scratchFolder, "corridorLabels.npy")
+    labels, statistics = corridors.corridorsTiled(RasterSource(ccm), grid, goThreshold, slowGoThreshold,
+                                                  minWidth, maxWidth, tileSize, classSink, widthSink,
+                                                  labelPath)
+    codePolygons(tiling.ArraySource(labels, grid), grid, outputCorridors, scratchFolder, spatialReference,
+                 tileSize, tolerance, [("corridor", "N", 11, 0), ("cells", "N", 11, 0), ("width", "F", 19, 3)],
+                 {"corridor": numpy.arange(len(statistics["cells"])), "cells": statistics["cells"],
+                  "width": statistics["meanWidth"]})
+    del labels
+    os.remove(labelPath)
+
+    if outputClassPolygons:
+        classes = classSink.array
+        codePolygons(tiling.ArraySource(classes, grid), grid, outputClassPolygons, scratchFolder,
+                     spatialReference, tileSize, tolerance, [("class", "C", 8, 0)],
+                     {"class": ["", "GO", "SLOW-GO", "NO-GO"]})
+        if outputClasses:
+            rasterSink = _ZeroAsNoData(MosaicSink(grid, outputClasses, scratchFolder, spatialReference,
+                                                  "8_BIT_UNSIGNED"))
+            for row0, col0, tile in tiling.iterTiles(grid, tileSize):
+                rasterSink.write(row0, col0, classes[row0:row0 + tile.nrows, col0:col0 + tile.ncols])
+            rasterSink.close()
+        del classes
+        classSink.array = None
+        os.remove(classSink.path)
+    return statistics
+
+
+def codePolygons(codeSource, window, outputFeatures, scratchFolder, spatialReference=None, tileSize=1024,
+                 tolerance=None, fields=(), attributes=None):
+    # Polygons of an integer code raster in place of RasterToPolygon and
+    # Dissolve on gridcode: one multipart feature per code with the code in
+    # "gridcode" and attributes[name][code] in each field (vectorize).  The
+    # features are streamed into a shapefile, copied into outputFeatures
+    # when that is not a .shp.
+    import arcpy
+    projection = spatialReference.exportToString() if spatialReference is not None else None
+    path = outputFeatures
+    if not outputFeatures.lower().endswith(".shp"):
+        path = os.path.join(scratchFolder, "codePolygons.shp")
+    sink = vectorize.ShapefileSink(path, fields, attributes, projection)
+    vectorize.polygonsTiled(codeSource, window, sink, tileSize, tolerance)
+    if path != outputFeatures:
+        arcpy.CopyFeatures_management(path, outputFeatures)
+        arcpy.Delete_management(path)
+    return outputFeatures
+
+
+class _ZeroAsNoData(object):
+    # Passes integer blocks on as float32 with 0 as NoData (NaN), the form
+    # arrayToRaster writes
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def write(self, row0, col0, block):
+        block = block.astype(numpy.float32)
+        block[block == 0] = numpy.nan
+        self.sink.write(row0, col0, block)
+
+    def close(self):
+        return self.sink.close()
+
+
+def _featureTable(inputFeatures, spatialReference):
+    # filegdb.Table of a feature class stored in a File Geodatabase in the
+    # given coordinate system, or None
+    import arcpy
+    description = arcpy.Describe(inputFeatures)
+    if description.spatialReference.name != spatialReference.name:
+        return None
+    table = filegdb.openTable(description.catalogPath)
+    if table is None or table.geometryField is None:
+        return None
+    return table
+
+
+def _codesFingerprint(table, codeField, codes):
+    # What a code raster depends on besides the window: the feature class
+    # files, the code field and the codes of the parameter table
+    digest = pipeline.fileDigest([table.path + extension for extension in (".gdbtable", ".gdbtablx")])
+    return repr((digest, codeField, codes))
+
+
+def _codesCompute(table, codeField, codes, window):
+    def compute():
+        return rasterize.codeRaster(rasterize.tablePolygons(table, codeField, window.extent), window, codes)
+    return compute
+
+
+def readColumns(inputTable, fields, whereClause=None):
+    # The fields of a table as a dict of NumPy arrays, read with one
+    # SearchCursor; the arcpy counterpart of filegdb.Table.read
+    import arcpy
+    rows = [row for row in arcpy.da.SearchCursor(inputTable, fields, whereClause)]
+    columns = {}
+    for i, field in enumerate(fields):
+        values = [row[i] for row in rows]
+        if all(isinstance(value, (int, float)) or value is None for value in values):
+            columns[field] = numpy.array([numpy.nan if value is None else value for value in values],
+                                         dtype=numpy.float64)
+        else:
+            columns[field] = numpy.array(values, dtype=object)
+    return columns
+
+
+def clipByIndex(inputFeatures, inputAOI, outputFeatures):
+    # arcpy.Clip_analysis(inputFeatures, inputAOI, outputFeatures), run only
+    # on the features whose bounding boxes meet the AOI extent.  The
+    # candidates come from the .spx spatial index when the features are in
+    # a File Geodatabase; otherwise every feature is clipped.
+    import arcpy
+    description = arcpy.Describe(inputFeatures)
+    table = filegdb.openTable(description.catalogPath)
+    if table is None or table.geometryField is None:
+        return arcpy.Clip_analysis(inputFeatures, inputAOI, outputFeatures)
+    extent = arcpy.Describe(inputAOI).extent
+    if extent.spatialReference is not None and description.spatialReference is not None:
+        extent = extent.projectAs(description.spatialReference)
+    oids = spatialindex.candidates(table, (extent.XMin, extent.YMin, extent.XMax, extent.YMax))
+    oidField = arcpy.AddFieldDelimiters(inputFeatures, table.oidField)
+    if len(oids) > 0:
+        where = oidField + " IN (" + ",".join(str(oid) for oid in oids) + ")"
+    else:
+        where = oidField + " < 0"
+    layer = arcpy.MakeFeatureLayer_management(inputFeatures, "clipCandidates", where)
+    try:
+        return arcpy.Clip_analysis(layer, inputAOI, outputFeatures)
+    finally:
+        arcpy.Delete_management(layer)
+
+
+def factorRaster(inputFeatures, codeField, inputTable, factorField, inputElevation, inputAOI,
+                 outputRaster, codeFolder=None, maxMB=4096, outputType=None):
+    # F3/F4/F5 raster on the AOI window of the DEM: the polygons burned by
+    # codeField and the codes looked up in factorField of the parameter
+    # table (rasterize.codeRaster and codeLookup), with 1.0 where nothing
+    # applies.  With a codeFolder the code raster is kept there (as a
+    # pipeline.Pipeline node), so a later run over the same features and
+    # AOI only redoes the lookup.  Returns None, leaving the
+    # Clip/JoinField/PolygonToRaster chain to the caller, unless both
+    # datasets are in File Geodatabases and the features share the DEM's
+    # coordinate system.  outputType (see OUTPUT_TYPES) stores the factor
+    # quantized over [0, the largest factor of the table].
+    rasters = factorRasters(inputFeatures, codeField, inputTable, [factorField], inputElevation,
+                            inputAOI, [outputRaster], codeFolder, maxMB, outputType)
+    if rasters is None:
+        return None
+    return rasters[0]
+
+
+def factorRasters(inputFeatures, codeField, inputTable, factorFields, inputElevation, inputAOI,
+                  outputRasters, codeFolder=None, maxMB=4096, outputType=None):
+    # factorRaster for several fields of the parameter table (f3max and
+    # f3min, f4dry and f4wet) from one code raster
+    import arcpy
+    elevation = arcpy.Raster(inputElevation)
+    spatialReference = elevation.spatialReference
+    table = _featureTable(inputFeatures, spatialReference)
+    if table is None:
+        return None
+    lookups = [params.lookupTable(inputTable, codeField, factorField) for factorField in factorFields]
+    if None in lookups:
+        return None
+    window = aoiWindow(elevation, inputAOI)
+    codes = rasterize.tableCodes(lookups)
+    compute = _codesCompute(table, codeField, codes, window)
+    if codeFolder:
+        store = pipeline.Pipeline(codeFolder, maxMB * 1024 ** 2)
+        store.node(codeField + "Codes", compute, (), (_codesFingerprint(table, codeField, codes),
+                                                      repr(window.key())))
+        burned = store.run([codeField + "Codes"])[0]
+    else:
+        with profiling.stage(codeField + "Codes", window.nrows * window.ncols):
+            burned = compute()
+    for lookup, outputRaster in zip(lookups, outputRasters):
+        lut = rasterize.codeLookup(codes, lookup)
+        quantization = outputQuantization(outputType, float(numpy.nanmax(lut)))
+        arrayToRaster(lut.astype(numpy.float32)[burned], window, outputRaster, spatialReference, quantization)
+    return list(outputRasters)
+
+
+class _UnitMask(object):
+    # The mask raster holds OIDs; 0 * mask + 1 turns it into a factor of 1
+    # inside the AOI and NoData outside
+
+    def __init__(self, source):
+        self.source = source
+
+    def read(self, window):
+        block = self.source.read(window)
+        block *= 0.0
+        block += 1.0
+        return block
@@ -0,0 +1,606 @@
+# ==================================================
+# benchmark.py
+# --------------------------------------------------
+# Throughput benchmarks of the CCM engine.
+# --------------------------------------------------
+#
+# A benchmark runs the CCM over a set of datasets for every combination of
+# pipeline (mounted: the vehicle F1; dismounted: the foot march F1),
+# engine, worker count and tile size, and records the per-stage totals of
+# a profiling.Profiler for each run, with cells per second.  The engines
+# are
+#
+#   tiled     the F3..F5 factor rasters burned tile by tile, then
+#             parallel.ccmParallel (focal maximum and CCM tile passes), as
+#             arcpyio.ccmTiled; run for each worker count and tile size
+#   pipeline  pipeline.ccmPipeline on the whole window (slope, clamp, F1,
+#             curvature, focal range, F2, the code rasters and lookups and
+#             the product), as arcpyio.ccmIncremental; run once per
+#             pipeline, on windows up to pipelineMaxCells
+#
+# The datasets are
+#
+#   synthetic  a square fractal DEM of size x size cells (FractalSource:
+#              octaves of value noise, the same height for a cell whichever
+#              tile asks) saved as a float32 .npy, and vegetation, soil and
+#              roughness layers of a chosen number of polygons
+#              (SyntheticLayer) tiling its extent, coded with the codes of
+#              the SupportingData.gdb conversion tables
+#   madera     the landcover, soils and surface_rough feature classes and
+#              the madera_aoi polygon of MaderaEnvironment.gdb, on the grid
+#              of its ccm_area raster.  The geodatabase holds no DEM, so
+#              the heights are fractal too unless an elevation raster is
+#              given.
+#
+# Every run starts from nothing: a fresh pipeline folder, new factor
+# rasters.  Datasets are built and deleted one at a time, so the work
+# folder only ever holds one of them; a 32768 x 32768 run needs about
+# 20 GB there (DEM, three factors and the CCM as float32).
+#
+# The results are a JSON document (writeResults) holding the machine, the
+# settings, the datasets and one record per run; compare() matches the
+# runs and stages of two of them and reports the change in cells per
+# second, so a slowdown shows up as a regression.
+#
+# ==================================================
+
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+import numpy
+
+from . import engine
+from . import filegdb
+from . import gdbraster
+from . import parallel
+from . import params
+from . import pipeline
+from . import profiling
+from . import rasterize
+from . import tiling
+from .grid import Grid
+
+
+FORMAT = "ccm-benchmark"
+VERSION = 1
+
+# DEM sizes (cells per side) of the synthetic datasets
+SIZES = (1024, 2048, 4096, 8192, 16384, 32768)
+
+PIPELINES = ("mounted", "dismounted")
+ENGINES = ("tiled", "pipeline")
+
+# Largest window the whole-window pipeline engine is run on
+PIPELINE_MAX_CELLS = 4096 * 4096
+
+# (factor, conversion table, code field, factor field) of the categorical
+# factors, with the scripts' defaults: MAX vegetation, DRY soils
+FACTORS = (("f3", "maotLandCover", "f_code", "f3max"),
+           ("f4", "maotSoils", "soilcode", "f4dry"),
+           ("f5", "maotSurfaceRoughness", "roughnesscode", "f5"))
+
+# Polygons per synthetic layer
+POLYGON_COUNTS = {"f3": 10000, "f4": 1000, "f5": 10000}
+
+# Feature classes of MaderaEnvironment.gdb for the factors
+MADERA_LAYERS = {"f3": "landcover", "f4": "soils", "f5": "surface_rough"}
+MADERA_AOI = "madera_aoi"
+MADERA_GRID = "ccm_area"
+
+# Convoy and foot march of the two pipelines
+VEHICLES = ("HMMWV",)
+VISIBILITY = "Day"
+SOLDIER_WEIGHT = 185.0
+
+
+# -- terrain --------------------------------------------------------------
+
+def _lattice(rows, cols, seed):
+    # Pseudo-random values in [-1, 1) at integer lattice points, a hash of
+    # (row, col, seed) so that every tile sees the same lattice
+    h = (rows.astype(numpy.uint64) * numpy.uint64(0x9E3779B97F4A7C15)) ^ \
+        (cols.astype(numpy.uint64) * numpy.uint64(0xC2B2AE3D27D4EB4F))
+    h ^= numpy.uint64((seed * 0x165667B19E3779F9) & 0xFFFFFFFFFFFFFFFF)
+    h ^= h >> numpy.uint64(33)
+    h *= numpy.uint64(0xFF51AFD7ED558CCD)
+    h ^= h >> numpy.uint64(33)
+    h *= numpy.uint64(0xC4CEB9FE1A85EC53)
+    h ^= h >> numpy.uint64(33)
+    return (h >> numpy.uint64(11)).astype(numpy.float64) * 2.0 ** -52 - 1.0
+
+
+def _weights(cells, spacing):
+    # Lattice index below each cell centre and its smoothstep weight
+    u = (cells + 0.5) / spacing
+    index = numpy.floor(u).astype(numpy.int64)
+    f = u - index
+    return index, f * f * (3.0 - 2.0 * f)
+
+
+class FractalSource(object):
+    # Fractal terrain on grid: octaves of value noise, the first with a
+    # lattice wavelength cells apart, each next one at half the spacing and
+    # roughness times the amplitude, down to a 2 cell spacing.  Heights
+    # span base +- relief / 2.  Any window can be read; cells beyond the
+    # grid are NoData, as with a raster.
+
+    def __init__(self, grid, seed=0, relief=3000.0, base=1500.0, wavelength=2048.0, roughness=0.6):
+        self.grid = grid
+        self.seed = int(seed)
+        self.relief = float(relief)
+        self.base = float(base)
+        self.wavelength = float(wavelength)
+        self.roughness = float(roughness)
+
+    def _octave(self, rows, cols, spacing, octave):
+        rowIndex, rowWeight = _weights(rows, spacing)
+        colIndex, colWeight = _weights(cols, spacing)
+        r0 = rowIndex.min()
+        c0 = colIndex.min()
+        lattice = _lattice(numpy.arange(r0, rowIndex.max() + 2)[:, None],
+                           numpy.arange(c0, colIndex.max() + 2)[None, :], self.seed * 64 + octave)
+        rowIndex -= r0
+        colIndex -= c0
+        # along the rows of the lattice, then across them
+        across = lattice[:, colIndex] * (1.0 - colWeight) + lattice[:, colIndex + 1] * colWeight
+        return across[rowIndex] * (1.0 - rowWeight)[:, None] + across[rowIndex + 1] * rowWeight[:, None]
+
+    def read(self, window):
+        row0, col0 = self.grid.offset(window)
+        rows = numpy.arange(row0, row0 + window.nrows, dtype=numpy.float64)
+        cols = numpy.arange(col0, col0 + window.ncols, dtype=numpy.float64)
+        heights = numpy.zeros(window.shape)
+        spacing = self.wavelength
+        amplitude = 1.0
+        total = 0.0
+        octave = 0
+        while spacing >= 2.0:
+            heights += amplitude * self._octave(rows, cols, spacing, octave)
+            total += amplitude
+            amplitude *= self.roughness
+            spacing /= 2.0
+            octave += 1
+        if total > 0.0:
+            heights *= self.relief / (2.0 * total)
+        heights += self.base
+        heights[(rows < 0) | (rows >= self.grid.nrows), :] = numpy.nan
+        heights[:, (cols < 0) | (cols >= self.grid.ncols)] = numpy.nan
+        return heights
+
+
+def saveDEM(source, grid, path, tileSize=4096):
+    # Writes source over grid to a float32 .npy, tile by tile, and returns
+    # a tiling.NpySource of it
+    sink = tiling.ArraySink(grid, numpy.float32, path)
+    for row0, col0, tile in tiling.iterTiles(grid, tileSize):
+        sink.write(row0, col0, source.read(tile))
+    sink.close()
+    del sink
+    return tiling.NpySource(path, grid)
+
+
+# -- polygon layers -------------------------------------------------------
+
+class SyntheticLayer(object):
+    # count polygons covering the extent of grid without gaps or overlaps:
+    # a jittered lattice of quadrilaterals whose shared edges are bent
+    # through vertices interior points, each polygon with a code drawn from
+    # codes.  polygons(extent) yields (parts, code) like
+    # rasterize.tablePolygons.
+
+    def __init__(self, grid, count, codes, seed=0, vertices=4):
+        rng = numpy.random.RandomState(seed)
+        width = grid.xMax - grid.xMin
+        height = grid.yMax - grid.yMin
+        ny = max(1, int(round(math.sqrt(count * height / width))))
+        nx = max(1, int(round(float(count) / ny)))
+        dx = width / nx
+        dy = height / ny
+        # lattice corners, jittered inside the extent
+        x = grid.xMin + dx * (numpy.arange(nx + 1)[None, :] + rng.uniform(-0.3, 0.3, (ny + 1, nx + 1)))
+        y = grid.yMax - dy * (numpy.arange(ny + 1)[:, None] + rng.uniform(-0.3, 0.3, (ny + 1, nx + 1)))
+        x[:, 0] = grid.xMin
+        x[:, -1] = grid.xMax
+        y[0, :] = grid.yMax
+        y[-1, :] = grid.yMin
+        # interior points of the edges: east along the rows, south down the
+        # columns, pushed across the edge; the outline stays straight
+        t = numpy.arange(1, vertices + 1) / (vertices + 1.0)
+        bend = numpy.sin(numpy.pi * t)
+        eastOffsets = rng.uniform(-0.15, 0.15, (ny + 1, nx, vertices)) * dy * bend
+        eastOffsets[[0, -1]] = 0.0
+        southOffsets = rng.uniform(-0.15, 0.15, (ny, nx + 1, vertices)) * dx * bend
+        southOffsets[:, [0, -1]] = 0.0
+
+        def east(i, j):
+            px = x[i, j] + (x[i, j + 1] - x[i, j]) * t
+            py = y[i, j] + (y[i, j + 1] - y[i, j]) * t + eastOffsets[i, j]
+            return numpy.column_stack((px, py))
+
+        def south(i, j):
+            px = x[i, j] + (x[i + 1, j] - x[i, j]) * t + southOffsets[i, j]
+            py = y[i, j] + (y[i + 1, j] - y[i, j]) * t
+            return numpy.column_stack((px, py))
+
+        self.rings = []
+        boxes = numpy.empty((ny * nx, 4))
+        for i in range(ny):
+            for j in range(nx):
+                # clockwise: north edge east, east edge south, south edge
+                # west, west edge north
+                ring = numpy.vstack(([[x[i, j], y[i, j]]], east(i, j), [[x[i, j + 1], y[i, j + 1]]],
+                                     south(i, j + 1), [[x[i + 1, j + 1], y[i + 1, j + 1]]],
+                                     east(i + 1, j)[::-1], [[x[i + 1, j], y[i + 1, j]]],
+                                     south(i, j)[::-1], [[x[i, j], y[i, j]]]))
+                boxes[len(self.rings)] = (ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max())
+                self.rings.append(ring)
+        self.boxes = boxes
+        self.codes = [codes[k] for k in rng.randint(0, len(codes), len(self.rings))]
+
+    def __len__(self):
+        return len(self.rings)
+
+    def polygons(self, extent):
+        boxes = self.boxes
+        meets = (boxes[:, 0] <= extent[2]) & (extent[0] <= boxes[:, 2]) & \
+            (boxes[:, 1] <= extent[3]) & (extent[1] <= boxes[:, 3])
+        for k in numpy.nonzero(meets)[0]:
+            yield [self.rings[k]], self.codes[k]
+
+
+class TableLayer(object):
+    # The polygons of a File Geodatabase feature class, coded by codeField
+
+    def __init__(self, table, codeField):
+        self.table = table
+        self.codeField = codeField
+
+    def __len__(self):
+        return len(self.table.objectIds())
+
+    def polygons(self, extent):
+        return rasterize.tablePolygons(self.table, self.codeField, extent)
+
+
+def factorLookups(supportingData):
+    # {factor: (table codes, lookup array)} of the FACTORS from the
+    # conversion tables of SupportingData.gdb
+    lookups = {}
+    for name, tableName, codeField, factorField in FACTORS:
+        lookup = params.lookupTable(os.path.join(supportingData, tableName), codeField, factorField)
+        if lookup is None:
+            raise ValueError("Cannot read %s.%s from %s" % (tableName, factorField, supportingData))
+        codes = rasterize.tableCodes([lookup])
+        lookups[name] = (codes, rasterize.codeLookup(codes, lookup))
+    return lookups
+
+
+def pipelineParameters(supportingData, pipelineName, vehicles=VEHICLES, visibility=VISIBILITY,
+                       weight=SOLDIER_WEIGHT):
+    # CCMParameters of the mounted (convoy of vehicles) or dismounted (foot
+    # march at visibility with weight pounds) pipeline, as the scripts
+    # derive them
+    if pipelineName == "mounted":
+        envelopes = params.convoyStatistics(os.path.join(supportingData, "maotVehicleParameters"), [list(vehicles)])
+        if envelopes is None:
+            raise ValueError("Cannot read maotVehicleParameters from %s" % supportingData)
+        minWeight, maxWeight, minKPH, onSlope, offSlope = envelopes[0]
+        return engine.CCMParameters(onSlope, engine.mountedSpeedOverWeight(minKPH, maxWeight))
+    if pipelineName == "dismounted":
+        footMarch = params.footMarchParameters(os.path.join(supportingData, "maotFootMarchParameters"), visibility)
+        if footMarch is None:
+            raise ValueError("Cannot read maotFootMarchParameters from %s" % supportingData)
+        speed, maxSlope = footMarch
+        return engine.CCMParameters(maxSlope, engine.dismountedSpeedOverWeight(speed, weight))
+    raise ValueError("Unknown pipeline %r, not one of %s" % (pipelineName, ", ".join(PIPELINES)))
+
+
+# -- datasets -------------------------------------------------------------
+
+class Dataset(object):
+    # A benchmark input: the DEM source, the window the CCM is computed on,
+    # the factor layers ({factor: layer}) and the AOI rings (None when the
+    # whole window is the AOI)
+
+    def __init__(self, name, dem, window, layers, aoi=None, info=None):
+        self.name = name
+        self.dem = dem
+        self.window = window
+        self.layers = layers
+        self.aoi = aoi
+        self.info = info or {}
+
+    def record(self):
+        record = {"name": self.name, "rows": self.window.nrows, "cols": self.window.ncols,
+                  "cells": self.window.nrows * self.window.ncols, "cellWidth": self.window.cellWidth,
+                  "polygons": dict((name, len(layer)) for name, layer in self.layers.items())}
+        record.update(self.info)
+        return record
+
+
+def syntheticDataset(folder, size, lookups, polygonCounts=None, cellSize=10.0, seed=0, vertices=4):
+    # size x size fractal DEM (projected, cellSize metres) with synthetic
+    # layers of polygonCounts[factor] polygons
+    polygonCounts = polygonCounts or POLYGON_COUNTS
+    grid = Grid(500000.0, 4000000.0 + size * cellSize, cellSize, cellSize, size, size)
+    with profiling.stage("generate DEM", size * size):
+        dem = saveDEM(FractalSource(grid, seed), grid, os.path.join(folder, "dem.npy"))
+    layers = {}
+    with profiling.stage("generate polygons"):
+        for k, (name, tableName, codeField, factorField) in enumerate(FACTORS):
+            if polygonCounts.get(name):
+                layers[name] = SyntheticLayer(grid, polygonCounts[name], lookups[name][0], seed + k + 1, vertices)
+    return Dataset("synthetic-%d" % size, dem, grid, layers, info={"seed": seed, "vertices": vertices})
+
+
+def maderaDataset(folder, maderaGdb, inputElevation=None, seed=0):
+    # The MaderaEnvironment.gdb layers over the cells of the madera_aoi
+    # extent.  inputElevation is a File Geodatabase raster; without one the
+    # heights are fractal on the grid of ccm_area.
+    gdb = filegdb.Geodatabase(maderaGdb)
+    aoiTable = gdb.table(MADERA_AOI)
+    aoi = [aoiTable.geometry(int(oid)) for oid in aoiTable.objectIds()]
+    rings = [ring for geometry in aoi if geometry is not None for ring in geometry.parts]
+    xMin = min(geometry.extent[0] for geometry in aoi if geometry is not None)
+    yMin = min(geometry.extent[1] for geometry in aoi if geometry is not None)
+    xMax = max(geometry.extent[2] for geometry in aoi if geometry is not None)
+    yMax = max(geometry.extent[3] for geometry in aoi if geometry is not None)
+    if inputElevation:
+        dem = gdbraster.openRaster(inputElevation)
+        if dem is None:
+            raise ValueError("Cannot open %s as a File Geodatabase raster" % inputElevation)
+        grid = dem.grid
+    else:
+        grid = gdbraster.RasterDataset(maderaGdb, MADERA_GRID).grid
+        with profiling.stage("generate DEM", grid.nrows * grid.ncols):
+            dem = saveDEM(FractalSource(grid, seed), grid, os.path.join(folder, "dem.npy"))
+    row0, col0, nrows, ncols = grid.snap(xMin, yMin, xMax, yMax)
+    window = grid.window(row0, col0, nrows, ncols)
+    layers = dict((name, TableLayer(gdb.table(MADERA_LAYERS[name]), codeField))
+                  for name, tableName, codeField, factorField in FACTORS)
+    return Dataset("madera", dem, window, layers, rings,
+                   {"elevation": inputElevation or "fractal"})
+
+
+def aoiMask(rings, window):
+    # 1.0 inside the AOI polygon, NoData outside, as the AOI mask raster
+    mask = numpy.full(window.shape, numpy.nan)
+    return rasterize.burn(mask, window, rings, 1.0)
+
+
+# -- runs -----------------------------------------------------------------
+
+def burnFactor(layer, codes, lut, window, path, tileSize):
+    # Factor raster lut[codes] of the layer over the window, burned tile by
+    # tile into a float32 .npy
+    lut = numpy.asarray(lut, dtype=numpy.float32)
+    sink = tiling.ArraySink(window, numpy.float32, path)
+    for row0, col0, tile in tiling.iterTiles(window, tileSize):
+        sink.write(row0, col0, lut[rasterize.codeRaster(layer.polygons(tile.extent), tile, codes)])
+    sink.close()
+    del sink
+    return tiling.NpySource(path, window)
+
+
+def tiledRun(dataset, ccmParameters, lookups, folder, workers, tileSize):
+    # The factor rasters, then parallel.ccmParallel into a float32 .npy
+    window = dataset.window
+    cells = window.nrows * window.ncols
+    sources = []
+    for name in sorted(dataset.layers):
+        codes, lut = lookups[name]
+        with profiling.stage(name, cells):
+            factor = burnFactor(dataset.layers[name], codes, lut, window, os.path.join(folder, name + ".npy"),
+                                tileSize)
+        sources.append(profiling.source(factor, "read " + name))
+    if dataset.aoi is not None:
+        with profiling.stage("AOI mask", cells):
+            numpy.save(os.path.join(folder, "mask.npy"), aoiMask(dataset.aoi, window).astype(numpy.float32))
+        sources.append(profiling.source(tiling.NpySource(os.path.join(folder, "mask.npy"), window), "read mask"))
+    sinks = {"ccm": profiling.sink(tiling.ArraySink(window, numpy.float32, os.path.join(folder, "ccm.npy")),
+                                   "write ccm")}
+    parallel.ccmParallel(profiling.source(dataset.dem, "read dem"), window, ccmParameters, sinks, sources,
+                         tileSize, workers)
+
+
+def pipelineRun(dataset, ccmParameters, lookups, folder):
+    # pipeline.ccmPipeline over the whole window, every node computed
+    window = dataset.window
+    with profiling.stage("read dem") as timing:
+        dem = dataset.dem.read(tiling.withHalo(window, ccmParameters.halo))
+        timing.count(cells=dem.size, bytesRead=dem.nbytes)
+    mask = None
+    if dataset.aoi is not None:
+        with profiling.stage("AOI mask", window.nrows * window.ncols):
+            mask = aoiMask(dataset.aoi, window)
+    codeFactors = []
+    for name in sorted(dataset.layers):
+        codes, lut = lookups[name]
+        layer = dataset.layers[name]
+
+        def computeCodes(layer=layer, codes=codes):
+            return rasterize.codeRaster(layer.polygons(window.extent), window, codes)
+
+        codeFactors.append((name, "%s %s" % (dataset.name, name), computeCodes, lut))
+    store = pipeline.Pipeline(os.path.join(folder, "pipeline"))
+    pipeline.ccmPipeline(store, dem, window, ccmParameters, mask=mask, codeFactors=codeFactors).run(["ccm"])
+
+
+def stageRecords(profiler):
+    # The stage totals of a run with their cells per second
+    stages = []
+    for name, total in profiler.totals():
+        record = dict(total, name=name)
+        record["cellsPerSecond"] = total["cells"] / total["wall"] if total["wall"] > 0 else None
+        stages.append(record)
+    return stages
+
+
+def measure(label, run, cells):
+    # Runs run() on a new current profiler inside a "total" stage of cells
+    # and returns the profiler
+    profiler = profiling.start(label)
+    try:
+        with profiling.stage("total", cells):
+            run()
+    finally:
+        profiling.stop()
+    return profiler
+
+
+def runKey(run):
+    return (run["dataset"], run["pipeline"], run["engine"], run["workers"], run["tileSize"])
+
+
+def benchmark(datasets, supportingData, folder, pipelines=PIPELINES, engines=ENGINES, workerCounts=(1,),
+              tileSizes=(1024,), pipelineMaxCells=PIPELINE_MAX_CELLS, log=None):
+    # Runs every configuration on each of datasets, callables (folder,
+    # lookups) -> Dataset built and deleted one at a time, and returns the
+    # results document.  log(message) hears about the progress.
+    log = log or (lambda message: None)
+    lookups = factorLookups(supportingData)
+    parameters = dict((name, pipelineParameters(supportingData, name)) for name in pipelines)
+    workerCounts = [parallel.workerCount(workers) for workers in workerCounts]
+    results = {"format": FORMAT, "version": VERSION,
+               "started": datetime.datetime.now().isoformat(),
+               "machine": machine(),
+               "settings": {"pipelines": list(pipelines), "engines": list(engines), "workers": workerCounts,
+                            "tileSizes": list(tileSizes), "pipelineMaxCells": pipelineMaxCells,
+                            "parameters": dict((name, vars(p)) for name, p in parameters.items())},
+               "datasets": [], "runs": []}
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    for build in datasets:
+        datasetFolder = tempfile.mkdtemp(prefix="dataset", dir=folder)
+        try:
+            preparation = profiling.start("dataset")
+            try:
+                dataset = build(datasetFolder, lookups)
+            finally:
+                profiling.stop()
+            record = dataset.record()
+            record["preparation"] = stageRecords(preparation)
+            results["datasets"].append(record)
+            log("%s: %d x %d cells" % (dataset.name, dataset.window.nrows, dataset.window.ncols))
+            cells = record["cells"]
+            for pipelineName in pipelines:
+                configurations = []
+                if "tiled" in engines:
+                    configurations.extend(("tiled", workers, tileSize)
+                                          for workers in workerCounts for tileSize in tileSizes)
+                if "pipeline" in engines and cells <= pipelineMaxCells:
+                    configurations.append(("pipeline", 1, None))
+                for engineName, workers, tileSize in configurations:
+                    runFolder = tempfile.mkdtemp(prefix="run", dir=datasetFolder)
+                    try:
+                        if engineName == "tiled":
+                            work = lambda: tiledRun(dataset, parameters[pipelineName], lookups, runFolder,
+                                                    workers, tileSize)
+                        else:
+                            work = lambda: pipelineRun(dataset, parameters[pipelineName], lookups, runFolder)
+                        profiler = measure(dataset.name, work, cells)
+                    finally:
+                        shutil.rmtree(runFolder, ignore_errors=True)
+                    stages = stageRecords(profiler)
+                    total = stages[0]
+                    run = {"dataset": dataset.name, "pipeline": pipelineName, "engine": engineName,
+                           "workers": workers, "tileSize": tileSize, "cells": cells, "wall": total["wall"],
+                           "cellsPerSecond": total["cellsPerSecond"], "stages": stages}
+                    results["runs"].append(run)
+                    log("%s %s %s workers=%d tileSize=%s: %.2f Mcells/s" % (
+                        dataset.name, pipelineName, engineName, workers, tileSize,
+                        (run["cellsPerSecond"] or 0.0) / 1e6))
+            # release the memory maps before the files are deleted
+            dataset = None
+        finally:
+            shutil.rmtree(datasetFolder, ignore_errors=True)
+    results["finished"] = datetime.datetime.now().isoformat()
+    return results
+
+
+def syntheticDatasets(sizes=SIZES, polygonCounts=None, cellSize=10.0, seed=0, vertices=4):
+    # benchmark() dataset builders of the synthetic datasets
+    def builder(size):
+        return lambda folder, lookups: syntheticDataset(folder, size, lookups, polygonCounts, cellSize, seed,
+                                                        vertices)
+    return [builder(size) for size in sizes]
+
+
+def maderaDatasets(maderaGdb, inputElevation=None, seed=0):
+    return [lambda folder, lookups: maderaDataset(folder, maderaGdb, inputElevation, seed)]
+
+
+def machine():
+    # What the numbers were measured on
+    return {"platform": platform.platform(), "processor": platform.processor(),
+            "cpus": multiprocessing.cpu_count(), "python": sys.version.split()[0],
+            "numpy": numpy.__version__}
+
+
+# -- results --------------------------------------------------------------
+
+def writeResults(results, path):
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, "w") as handle:
+        json.dump(results, handle, indent=1, sort_keys=True)
+    return path
+
+
+def readResults(path):
+    with open(path) as handle:
+        results = json.load(handle)
+    if results.get("format") != FORMAT:
+        raise ValueError("%s is not a CCM benchmark result" % path)
+    return results
+
+
+def summary(results):
+    # Lines of a table of the runs: total and stage rates in Mcells/s
+    lines = ["%-18s %-10s %-8s %7s %8s %10s %10s  %s" % (
+        "dataset", "pipeline", "engine", "workers", "tile", "wall s", "Mcells/s", "slowest stages")]
+    for run in results["runs"]:
+        stages = sorted([stage for stage in run["stages"][1:] if stage["cellsPerSecond"]],
+                        key=lambda stage: -stage["wall"])[:3]
+        lines.append("%-18s %-10s %-8s %7d %8s %10.3f %10.2f  %s" % (
+            run["dataset"], run["pipeline"], run["engine"], run["workers"], run["tileSize"] or "-",
+            run["wall"], (run["cellsPerSecond"] or 0.0) / 1e6,
+            ", ".join("%s %.1f" % (stage["name"], stage["cellsPerSecond"] / 1e6) for stage in stages)))
+    return lines
+
+
+def compare(baseline, current, tolerance=0.1):
+    # (key, stage, baseline cells/s, current cells/s, change) for every stage
+    # of the runs the two results share, "total" being the whole run, and
+    # the rows that slowed down by more than tolerance (0.1 = 10 %)
+    before = dict((runKey(run), run) for run in baseline["runs"])
+    rows = []
+    for run in current["runs"]:
+        old = before.get(runKey(run))
+        if old is None:
+            continue
+        oldStages = dict((stage["name"], stage) for stage in old["stages"])
+        for stage in run["stages"]:
+            oldStage = oldStages.get(stage["name"])
+            if oldStage is None or not oldStage["cellsPerSecond"] or not stage["cellsPerSecond"]:
+                continue
+            change = stage["cellsPerSecond"] / oldStage["cellsPerSecond"] - 1.0
+            rows.append((runKey(run), stage["name"], oldStage["cellsPerSecond"], stage["cellsPerSecond"], change))
+    regressions = [row for row in rows if row[4] < -tolerance]
+    return rows, regressions
+
+
+def comparisonLines(rows):
+    lines = []
+    for key, stage, before, after, change in rows:
+        lines.append("%-60s %-20s %10.2f -> %10.2f Mcells/s %+7.1f%%" % (
+            " ".join(str(part) for part in key), stage, before / 1e6, after / 1e6, change * 100.0))
+    return lines
@@ -0,0 +1,176 @@
+# ==================================================
+# cache.py
+# --------------------------------------------------
+# On-disk cache of the vehicle-independent terrain derivatives.
+# --------------------------------------------------
+#
+# Percent slope, the NbrCircle focal range of curvature and its maximum
+# depend only on the DEM, the AOI window and the algorithm settings, not on
+# the convoy, visibility, soldier weight or wet/dry choice.  The scripts
+# used to rebuild them on every run and throw them away through deleteme;
+# DerivativeCache keeps them between runs instead.
+#
+# An entry is a folder named by the SHA-1 of
+#
+#   - the DEM values of the window and its halo (read tile by tile),
+#   - the window grid (origin, cell size, rows and columns),
+#   - zFactor, focalRadius, the edge handling and ALGORITHM,
+#
+# holding slope.npy and range.npy (float64, so cached runs match uncached
+# ones bit for bit) and meta.json with the focal range maximum.  Entries
+# are written to a temporary folder and renamed into place, so concurrent
+# runs never see half an entry.  Reading an entry touches meta.json; when
+# the cache grows past maxBytes the least recently used entries are
+# deleted.
+#
+# ==================================================
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy
+
+from . import engine
+from . import tiling
+
+
+# Bump when the slope, curvature or focal range kernels change
+ALGORITHM = "horn-percent-slope/zevenbergen-thorne-curvature/nbrcircle-range/2"
+
+
+class TerrainDerivatives(object):
+    # slope and range are tiling sources over the window; focalMax is the
+    # largest focal range in it
+
+    def __init__(self, slope, range, focalMax):
+        self.slope = slope
+        self.range = range
+        self.focalMax = focalMax
+
+
+def demFingerprint(demSource, window, halo, tileSize=1024):
+    # SHA-1 of the DEM values the derivatives of the window are computed from
+    digest = hashlib.sha1()
+    for row0, col0, tile in tiling.iterTiles(tiling.withHalo(window, halo), tileSize):
+        block = numpy.ascontiguousarray(demSource.read(tile), dtype=numpy.float64)
+        digest.update(block.tobytes())
+    return digest.hexdigest()
+
+
+class DerivativeCache(object):
+
+    def __init__(self, folder, maxBytes=4 * 1024 ** 3):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def key(self, demSource, window, params, tileSize=1024):
+        digest = hashlib.sha1()
+        digest.update(demFingerprint(demSource, window, params.halo, tileSize).encode("ascii"))
+        digest.update(repr(window.key()).encode("ascii"))
+        digest.update(repr((params.zFactor, params.focalRadius, params.edge, ALGORITHM)).encode("ascii"))
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.folder, key)
+
+    def get(self, key, window):
+        # TerrainDerivatives of a cached entry, or None
+        meta = os.path.join(self._entry(key), "meta.json")
+        if not os.path.exists(meta):
+            return None
+        handle = open(meta)
+        try:
+            info = json.load(handle)
+        finally:
+            handle.close()
+        if tuple(info["grid"]) != window.key():
+            return None
+        os.utime(meta, None)
+        return self._derivatives(self._entry(key), window, info["focalMax"])
+
+    def _derivatives(self, entry, window, focalMax):
+        return TerrainDerivatives(tiling.NpySource(os.path.join(entry, "slope.npy"), window),
+                                  tiling.NpySource(os.path.join(entry, "range.npy"), window),
+                                  focalMax)
+
+    def compute(self, key, demSource, window, params, tileSize=1024):
+        # Computes the derivatives of the window tile by tile into a new entry
+        entry = self._entry(key)
+        temporary = "%s.%d.tmp" % (entry, os.getpid())
+        if os.path.isdir(temporary):
+            shutil.rmtree(temporary)
+        os.makedirs(temporary)
+        sinks = {"slope": tiling.ArraySink(window, numpy.float64, os.path.join(temporary, "slope.npy")),
+                 "range": tiling.ArraySink(window, numpy.float64, os.path.join(temporary, "range.npy"))}
+        focalMax = [numpy.nan]
+
+        def kernel(blocks, tile, halo):
+            cellWidth, cellHeight = tile.metricCellSizes(halo)
+            slope, rng, tileMax = engine.terrainDerivativesBlock(blocks["dem"], cellWidth, cellHeight,
+                                                                 params, halo)
+            focalMax[0] = numpy.fmax(focalMax[0], tileMax)
+            return {"slope": slope, "range": rng}
+
+        tiling.runTiled(window, tileSize, params.halo, {"dem": demSource}, kernel, sinks)
+        # release the memory maps; Windows cannot rename a folder with open maps
+        sinks.clear()
+        info = {"grid": list(window.key()), "focalMax": float(focalMax[0]),
+                "zFactor": params.zFactor, "focalRadius": params.focalRadius, "edge": params.edge,
+                "algorithm": ALGORITHM}
+        handle = open(os.path.join(temporary, "meta.json"), "w")
+        try:
+            json.dump(info, handle)
+        finally:
+            handle.close()
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # another run stored the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict(keep=key)
+        return self._derivatives(entry, window, info["focalMax"])
+
+    def derivatives(self, demSource, window, params, tileSize=1024):
+        # Cached TerrainDerivatives of the window, computed on a miss
+        key = self.key(demSource, window, params, tileSize)
+        cached = self.get(key, window)
+        if cached is not None:
+            return cached
+        return self.compute(key, demSource, window, params, tileSize)
+
+    # -- eviction ----------------------------------------------------------
+
+    def entries(self):
+        # (last use, size in bytes, key) of every complete entry
+        entries = []
+        for name in os.listdir(self.folder):
+            meta = os.path.join(self.folder, name, "meta.json")
+            if name.endswith(".tmp") or not os.path.exists(meta):
+                continue
+            entry = os.path.join(self.folder, name)
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(meta), size, name))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for used, size, name in self.entries())
+
+    def evict(self, keep=None):
+        # Deletes least recently used entries until the cache fits maxBytes
+        entries = self.entries()
+        total = sum(size for used, size, name in entries)
+        for used, size, name in entries:
+            if total <= self.maxBytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for used, size, name in self.entries():
+            shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
@@ -0,0 +1,239 @@
+# ==================================================
+# corridors.py
+# --------------------------------------------------
+# Mobility corridors from a CCM raster.
+# --------------------------------------------------
+#
+# The CCM is classified GO / SLOW-GO / NO-GO by two thresholds.  The
+# width of the open ground around each passable cell is measured with a
+# Euclidean distance transform to the nearest NO-GO or NoData cell, and
+# the passable cells at least minWidth wide are labelled into corridors:
+# regions connected through their 8 neighbours.
+#
+# Labelling is the two-pass run algorithm: the first pass gives every run
+# of corridor cells along a row a provisional label and records which
+# runs of neighbouring rows touch, the equivalences are resolved by a
+# union-find over the runs, and the second pass writes the final labels.
+# Both passes and the union-find (hooking roots onto the smaller root,
+# then pointer jumping) are whole-array NumPy operations.
+#
+# corridorsTiled works tile by tile: tiles are labelled on their own, the
+# labels that meet across tile seams are joined by the same union-find,
+# and the labels are renumbered 1..n in a second pass over the label
+# array (memory-mapped when given a path).
+#
+# ==================================================
+
+import math
+
+import numpy
+
+from . import tiling
+
+
+# classes
+NODATA = 0
+GO = 1
+SLOW_GO = 2
+NO_GO = 3
+
+
+def classify(ccm, goThreshold, slowGoThreshold):
+    # GO where CCM >= goThreshold, SLOW_GO where it is >= slowGoThreshold,
+    # NO_GO below, NODATA where the CCM is NoData
+    ccm = numpy.asarray(ccm, dtype=numpy.float64)
+    classes = numpy.full(ccm.shape, NO_GO, dtype=numpy.uint8)
+    classes[ccm >= slowGoThreshold] = SLOW_GO
+    classes[ccm >= goThreshold] = GO
+    classes[numpy.isnan(ccm)] = NODATA
+    return classes
+
+
+def distanceToBlocked(blocked, cellWidth, cellHeight, maxCells):
+    # Metres from every cell centre to the nearest blocked cell centre,
+    # exact up to maxCells times the smaller cell side and capped there.
+    # cellWidth and cellHeight are numbers or per-row (rows, 1) columns.
+    blocked = numpy.asarray(blocked, dtype=bool)
+    nrows, ncols = blocked.shape
+    cap = maxCells * min(numpy.min(cellWidth), numpy.min(cellHeight))
+    far = maxCells + 1
+
+    # rows to the nearest blocked cell of the same column
+    index = numpy.arange(nrows)[:, None]
+    above = numpy.where(blocked, index, -far - nrows)
+    above = index - numpy.maximum.accumulate(above, axis=0)
+    below = numpy.where(blocked, index, far + 2 * nrows)[::-1]
+    below = numpy.minimum.accumulate(below, axis=0)[::-1] - index
+    vertical = numpy.minimum(numpy.minimum(above, below), far) * numpy.asarray(cellHeight, dtype=numpy.float64)
+    vertical *= vertical
+
+    # then across the columns within reach
+    nearest = numpy.full((nrows, ncols), cap * cap)
+    for dc in range(-maxCells, maxCells + 1):
+        across = (dc * numpy.asarray(cellWidth, dtype=numpy.float64)) ** 2
+        if dc < 0:
+            target, source = nearest[:, -dc:], vertical[:, :dc]
+        elif dc > 0:
+            target, source = nearest[:, :-dc], vertical[:, dc:]
+        else:
+            target, source = nearest, vertical
+        numpy.minimum(target, source + across, out=target)
+    return numpy.sqrt(nearest)
+
+
+def unionFind(count, a, b):
+    # Root (the smallest member) of every element 0..count-1 once the pairs
+    # a[i] ~ b[i] are joined
+    parent = numpy.arange(count)
+    a = numpy.asarray(a, dtype=numpy.int64)
+    b = numpy.asarray(b, dtype=numpy.int64)
+    while True:
+        rootA = parent[a]
+        rootB = parent[b]
+        apart = rootA != rootB
+        if not apart.any():
+            return parent
+        low = numpy.minimum(rootA[apart], rootB[apart])
+        high = numpy.maximum(rootA[apart], rootB[apart])
+        numpy.minimum.at(parent, high, low)
+        while True:
+            jumped = parent[parent]
+            if numpy.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+
+def label(mask):
+    # 8-connected regions of a boolean array: labels 1..n (0 outside the
+    # mask) in row-major order of their first cell, and n
+    mask = numpy.asarray(mask, dtype=bool)
+    nrows, ncols = mask.shape
+    width = ncols + 2
+    # first pass: the runs of each row, keyed row * width + column
+    padded = numpy.zeros((nrows, width), dtype=numpy.int8)
+    padded[:, 1:-1] = mask
+    steps = numpy.diff(padded, axis=1)
+    startRows, startCols = numpy.nonzero(steps == 1)
+    endRows, endCols = numpy.nonzero(steps == -1)
+    endCols -= 1
+    runs = startRows.size
+    labels = numpy.zeros((nrows, ncols), dtype=numpy.int64)
+    if runs == 0:
+        return labels, 0
+    startKeys = startRows * width + startCols
+    endKeys = endRows * width + endCols
+
+    # runs of the row above touching each run, diagonals included
+    first = numpy.searchsorted(endKeys, (startRows - 1) * width + startCols - 1, "left")
+    last = numpy.searchsorted(startKeys, (startRows - 1) * width + endCols + 1, "right") - 1
+    counts = numpy.maximum(last - first + 1, 0)
+    below = numpy.repeat(numpy.arange(runs), counts)
+    offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    above = numpy.repeat(first, counts) + offsets
+
+    # equivalences, then the second pass
+    roots = unionFind(runs, above, below)
+    isRoot = roots == numpy.arange(runs)
+    number = numpy.cumsum(isRoot)
+    runLabels = number[roots]
+    lengths = endCols - startCols + 1
+    flat = labels.reshape(-1)
+    cells = numpy.repeat(startRows * ncols + startCols, lengths) + \
+        (numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths))
+    flat[cells] = numpy.repeat(runLabels, lengths)
+    return labels, int(number[-1])
+
+
+def _seamPairs(before, after):
+    # Label pairs of two facing lines of cells that touch (8-connected)
+    pairs = []
+    for shift in (-1, 0, 1):
+        if shift < 0:
+            a, b = before[1:], after[:-1]
+        elif shift > 0:
+            a, b = before[:-1], after[1:]
+        else:
+            a, b = before, after
+        touching = (a > 0) & (b > 0)
+        pairs.append((a[touching], b[touching]))
+    return (numpy.concatenate([a for a, b in pairs]), numpy.concatenate([b for a, b in pairs]))
+
+
+def corridorsTiled(ccmSource, window, goThreshold, slowGoThreshold, minWidth=0.0, maxWidth=1000.0,
+                   tileSize=1024, classSink=None, widthSink=None, labelPath=None):
+    # Corridors of the CCM over the window, tile by tile.  The width of a
+    # cell is twice the distance from its centre to the edge of the nearest
+    # NO-GO or NoData cell (metres, measured up to maxWidth); cells beyond
+    # the window count as NoData.  Classes and widths go to the optional
+    # sinks.  Returns (labels, corridors): labels an int32 array (a .npy
+    # memory map at labelPath) numbered 1..n, 0 outside the corridors, and
+    # corridors a dict of per-corridor arrays indexed by label, "cells" and
+    # "meanWidth" (index 0 unused).
+    cellWidth, cellHeight = window.metricCellSizes(0)
+    reach = int(math.ceil(maxWidth / 2.0 / min(numpy.min(cellWidth), numpy.min(cellHeight)))) + 1
+    labelSink = tiling.ArraySink(window, numpy.int32, labelPath)
+    # provisional labels so far, and cells and width sums per label
+    counts = [0]
+    cells = []
+    widthSums = []
+
+    def kernel(blocks, tile, halo):
+        classes = classify(blocks["ccm"], goThreshold, slowGoThreshold)
+        blocked = (classes == NO_GO) | (classes == NODATA)
+        tileWidth, tileHeight = tile.metricCellSizes(halo)
+        distance = distanceToBlocked(blocked, tileWidth, tileHeight, reach)
+        width = 2.0 * distance - numpy.minimum(tileWidth, tileHeight)
+        width = numpy.minimum(width, maxWidth)[halo:halo + tile.nrows, halo:halo + tile.ncols]
+        classes = classes[halo:halo + tile.nrows, halo:halo + tile.ncols]
+        width[blocked[halo:halo + tile.nrows, halo:halo + tile.ncols]] = numpy.nan
+        tileLabels, count = label(width >= minWidth)
+        inside = tileLabels > 0
+        cells.append(numpy.bincount(tileLabels[inside], minlength=count + 1)[1:])
+        widthSums.append(numpy.bincount(tileLabels[inside], width[inside], minlength=count + 1)[1:])
+        tileLabels[inside] += counts[0]
+        counts[0] += count
+        return {"classes": classes, "width": width.astype(numpy.float32), "labels": tileLabels.astype(numpy.int32)}
+
+    sinks = {"labels": labelSink}
+    if classSink is not None:
+        sinks["classes"] = classSink
+    if widthSink is not None:
+        sinks["width"] = widthSink
+    tiling.runTiled(window, tileSize, reach, {"ccm": ccmSource}, kernel, sinks)
+    labels = labelSink.array
+
+    # join the labels meeting across the tile seams
+    if tileSize is None or tileSize <= 0:
+        tileSize = max(window.nrows, window.ncols, 1)
+    a = [numpy.zeros(0, dtype=numpy.int32)]
+    b = [numpy.zeros(0, dtype=numpy.int32)]
+    for col in range(tileSize, window.ncols, tileSize):
+        pairs = _seamPairs(labels[:, col - 1], labels[:, col])
+        a.append(pairs[0])
+        b.append(pairs[1])
+    for row in range(tileSize, window.nrows, tileSize):
+        pairs = _seamPairs(labels[row - 1, :], labels[row, :])
+        a.append(pairs[0])
+        b.append(pairs[1])
+    roots = unionFind(counts[0] + 1, numpy.concatenate(a), numpy.concatenate(b))
+    isRoot = roots == numpy.arange(counts[0] + 1)
+    isRoot[0] = False
+    number = numpy.cumsum(isRoot)
+    lookup = number[roots].astype(numpy.int32)
+    corridorCount = int(number[-1])
+
+    # second pass: the final numbers
+    for row0, col0, tile in tiling.iterTiles(window, tileSize):
+        block = labels[row0:row0 + tile.nrows, col0:col0 + tile.ncols]
+        block[...] = lookup[block]
+    labelSink.close()
+
+    provisional = lookup[1:]
+    corridorCells = numpy.bincount(provisional, numpy.concatenate(cells + [numpy.zeros(0)]),
+                                   minlength=corridorCount + 1).astype(numpy.int64)
+    widthSum = numpy.bincount(provisional, numpy.concatenate(widthSums + [numpy.zeros(0)]),
+                              minlength=corridorCount + 1)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        meanWidth = widthSum / corridorCells
+    meanWidth[0] = numpy.nan
+    return labels, {"cells": corridorCells, "meanWidth": meanWidth}
@@ -0,0 +1,199 @@
+# ==================================================
+# engine.py
+# --------------------------------------------------
+# In-memory CCM factor calculations.
+# --------------------------------------------------
+#
+# Replaces the sa.Slope -> .save(slopeClip) -> sa.Con -> .save(reclassSlope)
+# -> F1 -> .save(f1.tif) chain of MountedCCM.py and DismountedCCMpy3.py with
+# a single pass over a NumPy array.  Nothing is written to env.scratchGDB;
+# the slope and reclassified slope are only kept when a dictionary is passed
+# in to collect them (the scripts do this when debug == True).
+#
+# ==================================================
+
+import numpy
+
+from . import terrain
+
+
+class CCMParameters(object):
+    # Scalars the raster stages need.  maxSlope and speedOverWeight come from
+    # the convoy statistics (mounted) or the foot march table (dismounted).
+    # edge is the 3x3 stencil's edge handling (terrain.EDGES).
+    def __init__(self, maxSlope, speedOverWeight, zFactor=1.0, focalRadius=3, edge="centre"):
+        self.maxSlope = float(maxSlope)
+        self.speedOverWeight = float(speedOverWeight)
+        self.zFactor = float(zFactor)
+        self.focalRadius = int(focalRadius)
+        self.edge = edge
+
+    @property
+    def halo(self):
+        # Cells needed around a window: one for the 3x3 curvature stencil
+        # plus the NbrCircle radius of the focal range.  The 3x3 slope
+        # stencil fits inside it.
+        return self.focalRadius + 1
+
+
+def mountedSpeedOverWeight(minVehicleKPH, maxVehicleWeight):
+    # Denominator of the vehicle F1 formula.  Weight is in short tons.
+    return float(minVehicleKPH) / float(maxVehicleWeight)
+
+
+def dismountedSpeedOverWeight(speed, weight):
+    # Denominator of the foot march F1 formula.  The vehicle formula takes
+    # short tons, so the soldier weight in pounds is divided by 2000.
+    return float(speed) / (float(weight) / 2000.0)
+
+
+def clampSlope(slope, maxSlope, out=None):
+    # Con(slope >= maxSlope, maxSlope, slope).  NoData stays NoData.
+    return numpy.minimum(slope, float(maxSlope), out=out)
+
+
+def f1FromSlope(clampedSlope, maxSlope, speedOverWeight, out=None):
+    # F1 = (max slope - slope) / (speed / weight)
+    out = numpy.subtract(float(maxSlope), clampedSlope, out=out)
+    out /= float(speedOverWeight)
+    return out
+
+
+def f2FromRange(focalRange, focalMax, out=None):
+    # F2 = (max - cell) / max, where max is the largest focal range in the AOI
+    out = numpy.subtract(float(focalMax), focalRange, out=out)
+    out /= float(focalMax)
+    return out
+
+
+def crop(array, halo):
+    # Removes a halo of cells read around a window
+    if halo == 0:
+        return array
+    return array[halo:-halo, halo:-halo]
+
+
+def fusedSlopeF1(dem, cellWidth, cellHeight, maxSlope, speedOverWeight,
+                 zFactor=1.0, halo=0, intermediates=None, dtype=numpy.float32):
+    # Slope, clamp and F1 in one pass over the DEM array.  The clamp and the
+    # F1 arithmetic are done in place on the slope buffer, so apart from the
+    # 3x3 stencil views no full-size temporaries are created.
+    #
+    # halo: cells read around the window; they feed the stencil and are
+    # cropped from the result.
+    # intermediates: optional dict that receives copies of "slope" and
+    # "reclassSlope" for debugging.
+    slope = terrain.slopePercent(dem, cellWidth, cellHeight, zFactor)
+    if intermediates is not None:
+        intermediates["slope"] = crop(slope, halo).astype(dtype)
+    clampSlope(slope, maxSlope, out=slope)
+    if intermediates is not None:
+        intermediates["reclassSlope"] = crop(slope, halo).astype(dtype)
+    f1 = f1FromSlope(slope, maxSlope, speedOverWeight, out=slope)
+    return crop(f1, halo).astype(dtype)
+
+
+def focalRangeBlock(dem, cellWidth, cellHeight, params, halo=0):
+    # Curvature followed by the NbrCircle focal range, cropped to the window
+    return focalRangeMaxBlock(dem, cellWidth, cellHeight, params, halo)[0]
+
+
+def focalRangeMaxBlock(dem, cellWidth, cellHeight, params, halo=0):
+    # focalRangeBlock and its largest value, taken in the same sweep
+    curv = terrain.curvature(dem, cellWidth, cellHeight, params.zFactor, params.edge)
+    return terrain.focalRangeMax(curv, params.focalRadius, halo)
+
+
+def f2Block(dem, cellWidth, cellHeight, params, halo=0, dtype=numpy.float32):
+    # F2 of a window held in memory: the focal range maximum comes out of
+    # the sweep that computes the range, so no statistics pass is needed
+    rng, focalMax = focalRangeMaxBlock(dem, cellWidth, cellHeight, params, halo)
+    return f2FromRange(rng, focalMax, out=rng).astype(dtype)
+
+
+def terrainFactorsBlock(dem, cellWidth, cellHeight, params, focalMax=None, halo=0,
+                        intermediates=None, dtype=numpy.float32):
+    # F1 and F2 for one window of the DEM read with params.halo cells around
+    # it, from one read of the 3x3 neighbourhood.  Without a focalMax the
+    # largest focal range of the window is used (the whole AOI in memory).
+    # intermediates receives "slope" and "reclassSlope" as in fusedSlopeF1.
+    slope, rng, windowMax = terrainDerivativesBlock(dem, cellWidth, cellHeight, params, halo)
+    if focalMax is None:
+        focalMax = windowMax
+    if intermediates is not None:
+        intermediates["slope"] = slope.astype(dtype)
+    clampSlope(slope, params.maxSlope, out=slope)
+    if intermediates is not None:
+        intermediates["reclassSlope"] = slope.astype(dtype)
+    f1 = f1FromSlope(slope, params.maxSlope, params.speedOverWeight, out=slope)
+    f2 = f2FromRange(rng, focalMax, out=rng)
+    return f1.astype(dtype), f2.astype(dtype)
+
+
+def terrainDerivativesBlock(dem, cellWidth, cellHeight, params, halo=0):
+    # The part of F1 and F2 that depends on the DEM alone: percent slope and
+    # the focal range of curvature, both float64 and cropped to the window,
+    # and the largest focal range (NaN if there is none).  Slope and
+    # curvature come from one read of the 3x3 neighbourhood.
+    surface = terrain.surfaceDerivatives(dem, cellWidth, cellHeight, params.zFactor,
+                                         ("slope", "curvature"), params.edge)
+    slope = crop(surface["slope"], halo)
+    rng, focalMax = terrain.focalRangeMax(surface["curvature"], params.focalRadius, halo)
+    return slope, rng, focalMax
+
+
+def factorsFromDerivatives(slope, rng, params, focalMax, dtype=numpy.float32):
+    # F1 and F2 from precomputed slope and focal range blocks.  The inputs
+    # are left untouched (they may be read-only cache maps) and the results
+    # equal those of terrainFactorsBlock bit for bit.
+    f1 = f1FromSlope(clampSlope(slope, params.maxSlope), params.maxSlope, params.speedOverWeight)
+    f2 = f2FromRange(rng, focalMax)
+    return f1.astype(dtype), f2.astype(dtype)
+
+
+def f1Bands(slope, maxSlopes, speedOverWeights, dtype=numpy.float32):
+    # F1 of several convoys from one slope block, broadcast into an array
+    # of shape (convoys,) + slope.shape.  Band k equals
+    # f1FromSlope(clampSlope(slope, maxSlopes[k]), ...) bit for bit.
+    maxSlopes = numpy.asarray(maxSlopes, dtype=numpy.float64).reshape(-1, 1, 1)
+    speedOverWeights = numpy.asarray(speedOverWeights, dtype=numpy.float64).reshape(-1, 1, 1)
+    f1 = numpy.minimum(slope, maxSlopes)
+    numpy.subtract(maxSlopes, f1, out=f1)
+    f1 /= speedOverWeights
+    return f1.astype(dtype)
+
+
+def ccmBands(slope, rng, paramsList, focalMax, factors=(), bandFactors=None, dtype=numpy.float32):
+    # F1 per band, the shared F2 and one CCM band per entry of paramsList
+    # for a window, from its slope and focal range blocks.  Every band is
+    # multiplied by all the factors, or with bandFactors by the factors
+    # listed for it (bandFactors[k] holds positions in factors).  Band k
+    # matches what ccmBlock gives for paramsList[k] and its factors.
+    f1 = f1Bands(slope, [p.maxSlope for p in paramsList], [p.speedOverWeight for p in paramsList], dtype)
+    f2 = f2FromRange(rng, focalMax).astype(dtype)
+    ccm = f1.astype(numpy.float64)
+    ccm *= f2
+    if bandFactors is None:
+        for factor in factors:
+            ccm *= factor
+    else:
+        for band, positions in enumerate(bandFactors):
+            for position in positions:
+                ccm[band] *= factors[position]
+    return {"f1": f1, "f2": f2, "ccm": ccm.astype(dtype)}
+
+
+def productBlock(factors, dtype=numpy.float32):
+    # Cell by cell product of the factor blocks
+    result = numpy.array(factors[0], dtype=numpy.float64)
+    for factor in factors[1:]:
+        result *= factor
+    return result.astype(dtype)
+
+
+def ccmBlock(dem, cellWidth, cellHeight, params, focalMax, factors=(), halo=0, dtype=numpy.float32):
+    # F1, F2 and the product of F1 x F2 x the other factor blocks for one
+    # window.  dem carries the halo; the factor blocks cover the window only.
+    f1, f2 = terrainFactorsBlock(dem, cellWidth, cellHeight, params, focalMax, halo, dtype=dtype)
+    ccm = productBlock([f1, f2] + list(factors), dtype)
+    return {"f1": f1, "f2": f2, "ccm": ccm}
@@ -0,0 +1,744 @@
+# ==================================================
+# filegdb.py
+# --------------------------------------------------
+# Memory-mapped reader for File Geodatabase (10.x) tables.
+# --------------------------------------------------
+#
+# Reads the .gdbtable/.gdbtablx pair of a table without arcpy, following
+# the published OpenFileGDB layout:
+#
+#   .gdbtablx  16 byte header, then one little-endian offset (4, 5 or 6
+#              bytes) per object id into the .gdbtable; 0 = deleted row.
+#   .gdbtable  40 byte header, the field descriptions, then the rows.  A
+#              row is an int32 size, a bitmap of NULL nullable fields and
+#              the values of the non-NULL fields in field order.
+#
+# Both files are opened with mmap, so a row costs nothing until it is
+# decoded and only the pages touched are read from disk.
+#
+#   .atx       attribute index: a B-tree of 4096 byte pages, keys sorted,
+#              leaves chained left to right, with a 22 byte trailer holding
+#              the key size and tree depth.  .gdbindexes names the field
+#              each index is built on.
+#
+# Table.read returns columns as NumPy arrays.  Only the requested columns
+# (and the ones the where clause tests) are decoded, = and IN predicates
+# on an indexed field are answered from the .atx, and the remaining
+# predicates are tested before the projected columns of a row are
+# decoded, so rows that do not match cost one small decode at most.
+#
+# ==================================================
+
+import mmap
+import os
+import struct
+
+import numpy
+
+from . import whereclause
+
+
+# Field types
+INT16 = 0
+INT32 = 1
+FLOAT32 = 2
+FLOAT64 = 3
+STRING = 4
+DATETIME = 5
+OBJECTID = 6
+GEOMETRY = 7
+BINARY = 8
+RASTER = 9
+GUID = 10
+GLOBALID = 11
+XML = 12
+INT64 = 13
+
+_FIXED = {INT16: ("<h", 2), INT32: ("<i", 4), FLOAT32: ("<f", 4), FLOAT64: ("<d", 8),
+          DATETIME: ("<d", 8), INT64: ("<q", 8)}
+
+
+class FileGDBError(Exception):
+    pass
+
+
+def _byte(buf, pos):
+    # The byte at pos as an int; indexing a map gives a str on Python 2
+    return struct.unpack_from("<B", buf, pos)[0]
+
+
+def readVarUInt(buf, pos):
+    # Unsigned LEB128 integer; returns (value, next position)
+    value = 0
+    shift = 0
+    while True:
+        byte = _byte(buf, pos)
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def readVarInt(buf, pos):
+    # Signed variant used by the geometry blobs: bit 6 of the first byte is
+    # the sign, the rest continues as LEB128
+    byte = _byte(buf, pos)
+    pos += 1
+    negative = byte & 0x40
+    value = byte & 0x3F
+    shift = 6
+    while byte & 0x80:
+        byte = _byte(buf, pos)
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+    return (-value if negative else value), pos
+
+
+def _bits(data, count):
+    # The first count bits of a uint8 array as booleans, the least
+    # significant bit of each byte first
+    return numpy.unpackbits(data).reshape(-1, 8)[:, ::-1].ravel()[:count].astype(bool)
+
+
+def _utf16(buf, pos, nchars):
+    end = pos + 2 * nchars
+    return bytes(buf[pos:end]).decode("utf-16-le"), end
+
+
+class Field(object):
+
+    def __init__(self, name, alias, type, nullable):
+        self.name = name
+        self.alias = alias
+        self.type = type
+        self.nullable = nullable
+        self.width = None
+        # geometry fields
+        self.wkt = None
+        self.hasZ = False
+        self.hasM = False
+        self.xOrigin = self.yOrigin = self.xyScale = None
+        self.zOrigin = self.zScale = self.mOrigin = self.mScale = None
+        self.extent = None
+        self.gridSizes = ()
+        # raster fields
+        self.rasterType = None
+
+    def __repr__(self):
+        return "Field(%r, type=%d)" % (self.name, self.type)
+
+
+def _openMap(path):
+    handle = open(path, "rb")
+    try:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        handle.close()
+
+
+class Table(object):
+    # One table of a File Geodatabase.  path is the file name without the
+    # .gdbtable extension, e.g. r"...\MaderaEnvironment.gdb\a00000029".
+
+    def __init__(self, path):
+        self.path = path
+        self.data = _openMap(path + ".gdbtable")
+        self.index = _openMap(path + ".gdbtablx")
+        (magic, self.validRows, self.largestRow) = struct.unpack_from("<iii", self.data, 0)
+        (self.fileSize, fieldOffset) = struct.unpack_from("<qq", self.data, 24)
+        self._readFields(fieldOffset)
+        self._readIndex()
+
+    def close(self):
+        for buf in (self.data, self.index):
+            if hasattr(buf, "close"):
+                buf.close()
+
+    # -- layout ------------------------------------------------------------
+
+    def _readIndex(self):
+        (magic, blocks, self.rowCount, self.offsetSize) = struct.unpack_from("<iiii", self.index, 0)
+        # The offsets are stored in pages of 1024 object ids
+        count = min(blocks * 1024, self.rowCount)
+        nbytes = count * self.offsetSize
+        raw = numpy.frombuffer(self.index, dtype=numpy.uint8, count=nbytes, offset=16)
+        raw = raw.reshape(count, self.offsetSize).astype(numpy.int64)
+        offsets = numpy.zeros(count, dtype=numpy.int64)
+        for i in range(self.offsetSize):
+            offsets |= raw[:, i] << (8 * i)
+        if count < self.rowCount:
+            # Sparse table: a trailing bitmap says which pages are present
+            trailer = 16 + blocks * 1024 * self.offsetSize
+            (bitmapWords, totalBlocks, presentBlocks, leading) = struct.unpack_from("<iiii", self.index, trailer)
+            bitmap = numpy.frombuffer(self.index, dtype=numpy.uint8, count=bitmapWords * 4, offset=trailer + 16)
+            present = _bits(bitmap, totalBlocks)
+            pages = numpy.zeros((totalBlocks, 1024), dtype=numpy.int64)
+            pages[present] = offsets.reshape(blocks, 1024)
+            offsets = pages.ravel()[:self.rowCount]
+        # offsets[oid - 1] is the position of the row; 0 marks a deleted row
+        self.offsets = offsets
+
+    def _readFields(self, pos):
+        buf = self.data
+        (headerSize, version, flags, nfields) = struct.unpack_from("<iiih", buf, pos)
+        self.version = version
+        self.geometryType = flags & 0xFF
+        self.hasZ = bool(flags & (1 << 31))
+        self.hasM = bool(flags & (1 << 30))
+        pos += 14
+        self.fields = []
+        for i in range(nfields):
+            nchars = _byte(buf, pos)
+            name, pos = _utf16(buf, pos + 1, nchars)
+            nchars = _byte(buf, pos)
+            alias, pos = _utf16(buf, pos + 1, nchars)
+            ftype = _byte(buf, pos)
+            pos += 1
+            field = Field(name, alias, ftype, False)
+            pos = self._readFieldDefinition(field, pos)
+            self.fields.append(field)
+        self.rowsOffset = pos
+        self.nullableCount = sum(1 for f in self.fields if f.nullable)
+        self.fieldIndex = dict((f.name.lower(), i) for i, f in enumerate(self.fields))
+        self.oidField = None
+        self.geometryField = None
+        for field in self.fields:
+            if field.type == OBJECTID:
+                self.oidField = field.name
+            elif field.type == GEOMETRY:
+                self.geometryField = field.name
+
+    def _readFieldDefinition(self, field, pos):
+        buf = self.data
+        ftype = field.type
+        if ftype == OBJECTID:
+            return pos + 2
+        if ftype == STRING:
+            field.width = struct.unpack_from("<i", buf, pos)[0]
+            field.nullable = bool(_byte(buf, pos + 4) & 1)
+            length, pos = readVarUInt(buf, pos + 5)
+            return pos + length
+        if ftype in _FIXED:
+            field.width = _byte(buf, pos)
+            field.nullable = bool(_byte(buf, pos + 1) & 1)
+            length = _byte(buf, pos + 2)
+            return pos + 3 + length
+        if ftype in (BINARY, XML, GUID, GLOBALID):
+            field.width = _byte(buf, pos)
+            field.nullable = bool(_byte(buf, pos + 1) & 1)
+            return pos + 2
+        if ftype == GEOMETRY:
+            field.nullable = bool(_byte(buf, pos + 1) & 1)
+            length = struct.unpack_from("<H", buf, pos + 2)[0]
+            field.wkt = bytes(buf[pos + 4:pos + 4 + length]).decode("utf-16-le")
+            pos += 4 + length
+            geomFlags = _byte(buf, pos)
+            pos += 1
+            field.hasM = bool(geomFlags & 2)
+            field.hasZ = bool(geomFlags & 4)
+            (field.xOrigin, field.yOrigin, field.xyScale) = struct.unpack_from("<3d", buf, pos)
+            pos += 24
+            if field.hasM:
+                (field.mOrigin, field.mScale) = struct.unpack_from("<2d", buf, pos)
+                pos += 16
+            if field.hasZ:
+                (field.zOrigin, field.zScale) = struct.unpack_from("<2d", buf, pos)
+                pos += 16
+            pos += 8 * (1 + field.hasM + field.hasZ)   # tolerances
+            field.extent = struct.unpack_from("<4d", buf, pos)
+            pos += 32
+            if self.version >= 4:
+                # Z and M ranges of the table, then the spatial index grid sizes
+                pos += 16 * (self.hasZ + self.hasM) + 1
+                ngrids = struct.unpack_from("<i", buf, pos)[0]
+                field.gridSizes = struct.unpack_from("<%dd" % ngrids, buf, pos + 4)
+                pos += 4 + 8 * ngrids
+            return pos
+        if ftype == RASTER:
+            field.nullable = bool(_byte(buf, pos + 1) & 1)
+            nchars = _byte(buf, pos + 2)
+            pos += 3 + 2 * nchars
+            length = struct.unpack_from("<H", buf, pos)[0]
+            field.wkt = bytes(buf[pos + 2:pos + 2 + length]).decode("utf-16-le")
+            pos += 2 + length
+            magic = _byte(buf, pos)
+            pos += 1
+            if magic > 0:
+                hasM = bool(magic & 2)
+                hasZ = bool(magic & 4)
+                pos += 8 * (3 + 2 * hasM + 2 * hasZ + 1 + hasM + hasZ)
+            field.rasterType = _byte(buf, pos)
+            return pos + 1
+        raise FileGDBError("Unsupported field type %d for %s in %s" % (ftype, field.name, self.path))
+
+    # -- rows --------------------------------------------------------------
+
+    def field(self, name):
+        return self.fields[self.fieldIndex[name.lower()]]
+
+    def objectIds(self):
+        # Object ids of the rows that have not been deleted
+        return numpy.nonzero(self.offsets)[0] + 1
+
+    def _valueEnd(self, field, pos):
+        # Position after the value of field starting at pos
+        ftype = field.type
+        if ftype in _FIXED:
+            return pos + _FIXED[ftype][1]
+        if ftype in (GUID, GLOBALID):
+            return pos + 16
+        if ftype == RASTER and field.rasterType == 1:
+            return pos + 4
+        length, pos = readVarUInt(self.data, pos)
+        return pos + length
+
+    def _decode(self, field, pos, end):
+        buf = self.data
+        ftype = field.type
+        if ftype in _FIXED:
+            return struct.unpack_from(_FIXED[ftype][0], buf, pos)[0]
+        if ftype in (GUID, GLOBALID):
+            return bytes(buf[pos:end])
+        if ftype == RASTER and field.rasterType == 1:
+            return struct.unpack_from("<i", buf, pos)[0]
+        length, start = readVarUInt(buf, pos)
+        value = buf[start:end]
+        if ftype in (STRING, XML) or (ftype == RASTER and field.rasterType == 0):
+            return bytes(value).decode("utf-8")
+        return value
+
+    def fieldPositions(self, oid, wanted):
+        # Yields (field index, start, end) of the non-NULL values of a row,
+        # stopping after the last wanted field index.
+        offset = int(self.offsets[oid - 1])
+        if offset == 0:
+            return
+        buf = self.data
+        pos = offset + 4
+        nullBytes = (self.nullableCount + 7) // 8
+        nulls = bytearray(buf[pos:pos + nullBytes])
+        pos += nullBytes
+        nullable = 0
+        last = max(wanted) if wanted else -1
+        for i, field in enumerate(self.fields):
+            if i > last:
+                return
+            if field.type == OBJECTID:
+                continue
+            if field.nullable:
+                isNull = nulls[nullable >> 3] & (1 << (nullable & 7))
+                nullable += 1
+                if isNull:
+                    continue
+            end = self._valueEnd(field, pos)
+            if i in wanted:
+                yield i, pos, end
+            pos = end
+
+    def readRow(self, oid, columns=None):
+        # dict of column name -> value for one row (None for NULL), or None
+        # for a deleted row.  Only the requested columns are decoded.
+        if self.offsets[oid - 1] == 0:
+            return None
+        if columns is None:
+            columns = [f.name for f in self.fields]
+        wanted = dict((self.fieldIndex[c.lower()], c) for c in columns)
+        row = dict((c, None) for c in columns)
+        for i, start, end in self.fieldPositions(oid, wanted):
+            row[wanted[i]] = self._decode(self.fields[i], start, end)
+        if self.oidField is not None:
+            for c in columns:
+                if c.lower() == self.oidField.lower():
+                    row[c] = oid
+        return row
+
+    def geometry(self, oid):
+        # Geometry of a row (see decodeGeometry), or None
+        if self.geometryField is None or self.offsets[oid - 1] == 0:
+            return None
+        blob = self.readRow(oid, [self.geometryField])[self.geometryField]
+        return decodeGeometry(self.field(self.geometryField), blob)
+
+    def rows(self, columns=None):
+        # Yields (oid, row dict) for every row that has not been deleted
+        for oid in self.objectIds():
+            yield int(oid), self.readRow(int(oid), columns)
+
+    # -- queries -----------------------------------------------------------
+
+    def indexes(self):
+        # Lower-case field name -> AttributeIndex for the fields with a
+        # readable .atx index
+        if getattr(self, "_indexes", None) is None:
+            self._indexes = {}
+            for name, expression in readIndexDefinitions(self.path + ".gdbindexes"):
+                fieldName = expression
+                lower = expression.upper().startswith("LOWER(")
+                if lower:
+                    fieldName = expression[6:].rstrip(")")
+                key = fieldName.lower()
+                atx = "%s.%s.atx" % (self.path, name)
+                if key not in self.fieldIndex or not os.path.exists(atx):
+                    continue
+                field = self.fields[self.fieldIndex[key]]
+                if field.type in AttributeIndex.KEY_FORMATS or field.type == STRING:
+                    self._indexes[key] = AttributeIndex(atx, field.type, lower)
+        return self._indexes
+
+    def select(self, where=None):
+        # Object ids (int64 array, ascending) of the rows matching where
+        predicates = whereclause.parse(where)
+        for predicate in predicates:
+            if predicate.field.lower() not in self.fieldIndex:
+                raise FileGDBError("%s has no field %s" % (self.path, predicate.field))
+        oids = self.objectIds()
+        remaining = []
+        for predicate in predicates:
+            key = predicate.field.lower()
+            if self.oidField is not None and key == self.oidField.lower():
+                keep = numpy.array([predicate.matches(int(oid)) for oid in oids], dtype=bool)
+                oids = oids[keep] if len(oids) else oids
+                continue
+            if predicate.op in ("=", "IN") and key in self.indexes():
+                values = predicate.value if predicate.op == "IN" else (predicate.value,)
+                indexed = self.indexes()[key].lookup(values)
+                oids = numpy.intersect1d(oids, indexed)
+            remaining.append(predicate)
+        if not remaining:
+            return oids
+        wanted = dict((self.fieldIndex[p.field.lower()], p.field.lower()) for p in remaining)
+        keep = []
+        for oid in oids:
+            values = dict((name, None) for name in wanted.values())
+            for i, start, end in self.fieldPositions(int(oid), wanted):
+                values[wanted[i]] = self._decode(self.fields[i], start, end)
+            for predicate in remaining:
+                if not predicate.matches(values[predicate.field.lower()]):
+                    break
+            else:
+                keep.append(oid)
+        return numpy.array(keep, dtype=numpy.int64)
+
+    def read(self, columns=None, where=None):
+        # dict of column name -> NumPy array over the rows matching where, in
+        # object id order.  Numeric columns are int or float arrays (float
+        # with NaN for NULL when the field is nullable); other columns are
+        # object arrays with None for NULL.
+        if columns is None:
+            columns = [f.name for f in self.fields if f.type not in (GEOMETRY, RASTER, BINARY)]
+        oids = self.select(where)
+        wanted = {}
+        arrays = {}
+        for column in columns:
+            i = self.fieldIndex[column.lower()]
+            field = self.fields[i]
+            if field.type == OBJECTID:
+                arrays[column] = oids.astype(numpy.int32)
+                continue
+            wanted[i] = column
+            arrays[column] = numpy.full(len(oids), None, dtype=object)
+        for n, oid in enumerate(oids):
+            for i, start, end in self.fieldPositions(int(oid), wanted):
+                arrays[wanted[i]][n] = self._decode(self.fields[i], start, end)
+        for i, column in wanted.items():
+            arrays[column] = _typed(self.fields[i], arrays[column])
+        return arrays
+
+
+def _typed(field, values):
+    # Object array of decoded values -> the NumPy type of the field
+    if field.type in (INT16, INT32, INT64) and not field.nullable:
+        return values.astype({INT16: numpy.int16, INT32: numpy.int32, INT64: numpy.int64}[field.type])
+    if field.type in _FIXED:
+        out = numpy.full(len(values), numpy.nan,
+                         dtype=numpy.float32 if field.type == FLOAT32 else numpy.float64)
+        present = numpy.array([v is not None for v in values], dtype=bool)
+        if present.any():
+            out[present] = values[present].astype(out.dtype)
+        return out
+    return values
+
+
+def readIndexDefinitions(path):
+    # (index name, field expression) pairs from a .gdbindexes file
+    if not os.path.exists(path):
+        return []
+    handle = open(path, "rb")
+    try:
+        buf = handle.read()
+    finally:
+        handle.close()
+    definitions = []
+    if len(buf) < 4:
+        return definitions
+    count = struct.unpack_from("<I", buf, 0)[0]
+    pos = 4
+    for i in range(count):
+        nchars = struct.unpack_from("<I", buf, pos)[0]
+        name, pos = _utf16(buf, pos + 4, nchars)
+        pos += 12
+        nchars = struct.unpack_from("<I", buf, pos)[0]
+        expression, pos = _utf16(buf, pos + 4, nchars)
+        pos += 2
+        definitions.append((name, expression))
+    return definitions
+
+
+class AttributeIndex(object):
+    # B-tree .atx (or .spx) index on one field.  Pages are 4096 bytes and
+    # numbered from 1.  A leaf page holds the next leaf page, the number of
+    # keys and a reserved int32, then the object ids; an inner page holds
+    # the number of keys as its second int32 and the child page numbers
+    # from byte 8.  The keys of both follow at a fixed offset, keySize
+    # bytes each.  The key of an inner page is the largest key of the
+    # child beside it.
+
+    PAGE = 4096
+    KEY_FORMATS = {INT16: "<h", INT32: "<i", FLOAT32: "<f", FLOAT64: "<d",
+                   DATETIME: "<d", INT64: "<q", OBJECTID: "<i"}
+
+    def __init__(self, path, fieldType, lower=False):
+        self.path = path
+        self.fieldType = fieldType
+        self.lower = lower
+        self.data = _openMap(path)
+        trailer = len(self.data) - 22
+        self.keySize = _byte(self.data, trailer)
+        self.depth = struct.unpack_from("<I", self.data, trailer + 6)[0]
+        self.perPage = (self.PAGE - 12) // (4 + self.keySize)
+        self.keyOffset = 12 + 4 * self.perPage
+
+    def close(self):
+        if hasattr(self.data, "close"):
+            self.data.close()
+
+    def _key(self, page, i):
+        pos = (page - 1) * self.PAGE + self.keyOffset + i * self.keySize
+        if self.fieldType == STRING:
+            return bytes(self.data[pos:pos + self.keySize]).decode("utf-16-le")
+        return struct.unpack_from(self.KEY_FORMATS[self.fieldType], self.data, pos)[0]
+
+    def _probe(self, value):
+        # value in the form the keys are stored in
+        if self.fieldType == STRING:
+            value = value.lower() if self.lower else value
+            nchars = self.keySize // 2
+            return value[:nchars].ljust(nchars)
+        return value
+
+    def _header(self, page, i):
+        return struct.unpack_from("<i", self.data, (page - 1) * self.PAGE + 4 * i)[0]
+
+    def lookup(self, values):
+        # Object ids (sorted int64 array) whose key equals one of values.
+        # String keys are truncated to the key width, so they may match a
+        # few more rows than the predicate; callers test the predicate.
+        oids = []
+        for value in set(self._probe(v) for v in values):
+            oids.extend(self.range(value, value))
+        return numpy.unique(numpy.array(oids, dtype=numpy.int64))
+
+    def range(self, low, high):
+        # Object ids whose key lies between low and high (inclusive), in key
+        # order.  Keys must be in stored form (see _probe).
+        if len(self.data) < self.PAGE + 22:
+            return []
+        page = 1
+        for level in range(self.depth - 1):
+            count = self._header(page, 1)
+            child = count
+            for i in range(count):
+                if self._key(page, i) >= low:
+                    child = i
+                    break
+            page = self._header(page, 2 + child)
+        oids = []
+        while page > 0:
+            count = self._header(page, 1)
+            for i in range(count):
+                key = self._key(page, i)
+                if key > high:
+                    return oids
+                if key >= low:
+                    oids.append(self._header(page, 3 + i))
+            page = self._header(page, 0)
+        return oids
+
+
+# Shape types of the geometry blobs, keyed by the low byte of the type
+_POINTS = (1, 9, 11, 21, 52)
+_MULTIPOINTS = (8, 18, 20, 28, 53)
+_POLYLINES = (3, 10, 13, 23, 50)
+_POLYGONS = (5, 15, 19, 25, 51)
+POINT = 1
+POLYLINE = 3
+POLYGON = 5
+MULTIPOINT = 8
+
+
+def readVarInts(buf, pos, count, signed=True):
+    # count consecutive variable length integers starting at pos, decoded
+    # with NumPy; returns (int64 array, next position)
+    if count == 0:
+        return numpy.zeros(0, dtype=numpy.int64), pos
+    data = numpy.frombuffer(buf, dtype=numpy.uint8, count=min(len(buf) - pos, 10 * count), offset=pos)
+    last = numpy.flatnonzero(data < 0x80)[:count]
+    if len(last) < count:
+        raise FileGDBError("Truncated geometry")
+    end = int(last[-1]) + 1
+    data = data[:end].astype(numpy.int64)
+    starts = numpy.concatenate(([0], last[:-1] + 1))
+    group = numpy.zeros(end, dtype=numpy.int64)
+    group[starts[1:]] = 1
+    k = numpy.arange(end) - starts[numpy.cumsum(group)]
+    if signed:
+        # first byte: 6 value bits and the sign in bit 6
+        shifts = numpy.where(k == 0, 0, 7 * k - 1)
+        payload = numpy.where(k == 0, data & 0x3F, data & 0x7F)
+    else:
+        shifts = 7 * k
+        payload = data & 0x7F
+    values = numpy.add.reduceat(payload << shifts, starts)
+    if signed:
+        values[(data[starts] & 0x40) != 0] *= -1
+    return values, pos + end
+
+
+class Geometry(object):
+    # shapeType is POINT, MULTIPOINT, POLYLINE or POLYGON, extent is
+    # (xmin, ymin, xmax, ymax) and parts holds one (n, 2) float64 array of
+    # x, y per part (ring, for polygons).  Z, M and curve segments are not
+    # decoded; curves are read as the chords between their end points.
+
+    def __init__(self, shapeType, extent, parts):
+        self.shapeType = shapeType
+        self.extent = extent
+        self.parts = parts
+
+
+def _shapeHeader(field, blob):
+    # (shape type, position after the type, has curves) of a geometry blob
+    geomType, pos = readVarUInt(blob, 0)
+    base = geomType & 0xFF
+    hasCurves = base in (50, 51) and bool(geomType & 0x20000000)
+    for shapeType, types in ((POINT, _POINTS), (MULTIPOINT, _MULTIPOINTS),
+                             (POLYLINE, _POLYLINES), (POLYGON, _POLYGONS)):
+        if base in types:
+            return shapeType, pos, hasCurves
+    raise FileGDBError("Unsupported geometry type %d" % geomType)
+
+
+def _readExtent(field, blob, pos):
+    (xmin, ymin, dx, dy), pos = readVarInts(blob, pos, 4, signed=False)
+    xmin = xmin / field.xyScale + field.xOrigin
+    ymin = ymin / field.xyScale + field.yOrigin
+    return (xmin, ymin, xmin + dx / field.xyScale, ymin + dy / field.xyScale), pos
+
+
+def geometryExtent(field, blob):
+    # Bounding box of a geometry blob without decoding its points
+    shapeType, pos, hasCurves = _shapeHeader(field, blob)
+    if shapeType == POINT:
+        geometry = decodeGeometry(field, blob)
+        return None if geometry is None else geometry.extent
+    npoints, pos = readVarUInt(blob, pos)
+    if npoints == 0:
+        return None
+    skip = 0 if shapeType == MULTIPOINT else 1 + hasCurves
+    values, pos = readVarInts(blob, pos, skip, signed=False)
+    return _readExtent(field, blob, pos)[0]
+
+
+def decodeGeometry(field, blob):
+    # Geometry of a blob from a geometry field, or None for an empty shape
+    if blob is None:
+        return None
+    shapeType, pos, hasCurves = _shapeHeader(field, blob)
+    if shapeType == POINT:
+        (x, y), pos = readVarInts(blob, pos, 2, signed=False)
+        if x == 0:
+            return None
+        x = (x - 1) / field.xyScale + field.xOrigin
+        y = (y - 1) / field.xyScale + field.yOrigin
+        return Geometry(POINT, (x, y, x, y), [numpy.array([[x, y]])])
+    npoints, pos = readVarUInt(blob, pos)
+    if npoints == 0:
+        return None
+    nparts = 1
+    if shapeType != MULTIPOINT:
+        nparts, pos = readVarUInt(blob, pos)
+        if hasCurves:
+            ncurves, pos = readVarUInt(blob, pos)
+    extent, pos = _readExtent(field, blob, pos)
+    counts, pos = readVarInts(blob, pos, nparts - 1, signed=False)
+    deltas, pos = readVarInts(blob, pos, 2 * npoints)
+    xy = numpy.cumsum(deltas.reshape(npoints, 2), axis=0).astype(numpy.float64)
+    xy /= field.xyScale
+    xy[:, 0] += field.xOrigin
+    xy[:, 1] += field.yOrigin
+    if shapeType == MULTIPOINT:
+        return Geometry(MULTIPOINT, extent, [xy])
+    bounds = numpy.concatenate(([0], numpy.cumsum(counts), [npoints]))
+    parts = [xy[bounds[i]:bounds[i + 1]] for i in range(nparts)]
+    return Geometry(shapeType, extent, parts)
+
+
+def splitPath(path):
+    # (gdb folder, dataset name) for a path like r"...\SupportingData.gdb\maotSoils",
+    # or None when the dataset is not stored in a File Geodatabase
+    normalized = path.replace("\\", "/").rstrip("/")
+    folder, _, name = normalized.rpartition("/")
+    if not folder.lower().endswith(".gdb") or not name:
+        return None
+    return path[:len(folder)], name
+
+
+def openTable(path):
+    # Table for a geodatabase table path, or None if the path is not a File
+    # Geodatabase table this reader can open
+    parts = splitPath(path)
+    if parts is None:
+        return None
+    try:
+        return Geodatabase(parts[0]).table(parts[1])
+    except (FileGDBError, IOError, OSError):
+        return None
+
+
+class Geodatabase(object):
+    # A .gdb folder.  Tables are found by name through the system catalog
+    # (a00000001), whose object ids give the aXXXXXXXX file names.
+
+    def __init__(self, path):
+        self.path = path
+        catalog = Table(os.path.join(path, "a00000001"))
+        self.tableIds = {}
+        for oid, row in catalog.rows(["Name"]):
+            self.tableIds[row["Name"].lower()] = oid
+        catalog.close()
+        self._tables = {}
+
+    def tableNames(self):
+        return sorted(self.tableIds)
+
+    def tablePath(self, name):
+        try:
+            oid = self.tableIds[name.lower()]
+        except KeyError:
+            raise FileGDBError("%s not found in %s" % (name, self.path))
+        return os.path.join(self.path, "a%08x" % oid)
+
+    def table(self, name):
+        key = name.lower()
+        if key not in self._tables:
+            self._tables[key] = Table(self.tablePath(name))
+        return self._tables[key]
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+        self._tables = {}
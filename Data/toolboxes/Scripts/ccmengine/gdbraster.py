@@ -0,0 +1,208 @@
+# ==================================================
+# gdbraster.py
+# --------------------------------------------------
+# Windowed reader for rasters stored in a File Geodatabase.
+# --------------------------------------------------
+#
+# A raster dataset NAME is kept in four tables of the .gdb:
+#
+#   fras_ras_NAME  one row per raster
+#   fras_bnd_NAME  one row per band: size, block size, block origin, extent
+#                  and band_types (pixel type and bit depth)
+#   fras_blk_NAME  one row per block: rasterband_id, rrd_factor (pyramid
+#                  level), row_nbr, col_nbr and block_data
+#   fras_aux_NAME  statistics, colour maps and the like
+#
+# block_data is a zlib (LZ77) stream holding the block_width x
+# block_height pixels in big-endian row order, optionally followed by a
+# validity mask of one bit per pixel (1 = valid).  Blocks that would be
+# all NoData are not stored.
+#
+# The tables are read through filegdb, so nothing but the blocks that
+# cover a requested window is decoded, and decoded blocks are kept in an
+# LRU cache.  RasterDataset has the grid/read(window) interface of the
+# tiling sources and can be handed to tiling.runTiled or
+# parallel.ccmParallel directly.
+#
+# ==================================================
+
+import collections
+import zlib
+
+import numpy
+
+from . import filegdb
+from .grid import Grid
+
+
+def pixelType(bandTypes):
+    # NumPy dtype of the stored pixels from fras_bnd.band_types: the bit
+    # depth is in bits 19-25 and the kind (0 unsigned, 1 signed, 2 float)
+    # in bits 16-17.  64 bit pixels are always doubles.
+    bits = (bandTypes >> 19) & 0x7F
+    kind = (bandTypes >> 16) & 0x3
+    if bits == 64:
+        return numpy.dtype(">f8"), bits
+    if kind == 2:
+        return numpy.dtype(">f%d" % (bits // 8)), bits
+    if bits < 8:
+        return numpy.dtype("u1"), bits
+    if kind == 1:
+        return numpy.dtype(">i%d" % (bits // 8)), bits
+    return numpy.dtype(">u%d" % (bits // 8)), bits
+
+
+class RasterDataset(object):
+
+    def __init__(self, gdbPath, name, band=1, level=0, cacheBlocks=256):
+        self.gdbPath = gdbPath
+        self.name = name
+        self.band = band
+        self.level = level
+        self.cacheBlocks = cacheBlocks
+        self._open()
+
+    def __getstate__(self):
+        # mmaps do not pickle; workers reopen the tables
+        return {"gdbPath": self.gdbPath, "name": self.name, "band": self.band,
+                "level": self.level, "cacheBlocks": self.cacheBlocks}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def _open(self):
+        self.gdb = filegdb.Geodatabase(self.gdbPath)
+        bands = self.gdb.table("fras_bnd_" + self.name)
+        info = None
+        for oid, row in bands.rows():
+            if row["sequence_nbr"] == self.band:
+                info = row
+        if info is None:
+            raise filegdb.FileGDBError("Band %d of %s not found" % (self.band, self.name))
+        self.bandId = info[bands.oidField]
+        self.dtype, self.bitDepth = pixelType(info["band_types"])
+        self.blockWidth = info["block_width"]
+        self.blockHeight = info["block_height"]
+        width = info["band_width"]
+        height = info["band_height"]
+        # eminx..emaxx and eminy..emaxy span the cell centres, and the block
+        # origin is the centre of the upper left cell
+        cellWidth = (info["emaxx"] - info["eminx"]) / max(width - 1, 1)
+        cellHeight = (info["emaxy"] - info["eminy"]) / max(height - 1, 1)
+        scale = 2 ** self.level
+        # the coordinate system is on the raster field of the dataset's own
+        # table; a GEOGCS has its cell size in degrees
+        self.wkt = self._wkt()
+        self.grid = Grid(info["block_origin_x"] - cellWidth / 2.0,
+                         info["block_origin_y"] + cellHeight / 2.0,
+                         cellWidth * scale, cellHeight * scale,
+                         -(-height // scale), -(-width // scale),
+                         self.wkt.lstrip().upper().startswith("GEOGCS"))
+        self._indexBlocks()
+        self._cache = collections.OrderedDict()
+
+    def _wkt(self):
+        # WKT of the raster's coordinate system, "" when it is not recorded
+        try:
+            table = self.gdb.table(self.name)
+        except (filegdb.FileGDBError, IOError, OSError):
+            return ""
+        for field in table.fields:
+            if field.type == filegdb.RASTER and field.wkt:
+                return field.wkt
+        return ""
+
+    def _indexBlocks(self):
+        # (row_nbr, col_nbr) -> object id of the blocks of this band and level
+        blocks = self.gdb.table("fras_blk_" + self.name)
+        self.blocks = blocks
+        columns = ["rasterband_id", "rrd_factor", "row_nbr", "col_nbr"]
+        self.blockIds = {}
+        for oid, row in blocks.rows(columns):
+            if row["rasterband_id"] == self.bandId and row["rrd_factor"] == self.level:
+                self.blockIds[(row["row_nbr"], row["col_nbr"])] = oid
+
+    def close(self):
+        self.gdb.close()
+        self._cache.clear()
+
+    # -- blocks ------------------------------------------------------------
+
+    def readBlock(self, blockRow, blockCol):
+        # One block as float64 with NaN for NoData, or None if not stored
+        key = (blockRow, blockCol)
+        if key in self._cache:
+            self._cache[key] = block = self._cache.pop(key)
+            return block
+        oid = self.blockIds.get(key)
+        block = None if oid is None else self._decode(oid)
+        self._cache[key] = block
+        while len(self._cache) > self.cacheBlocks:
+            self._cache.popitem(last=False)
+        return block
+
+    def _decode(self, oid):
+        raw = bytes(self.blocks.readRow(oid, ["block_data"])["block_data"])
+        if raw[:1] == b"\x78":
+            raw = zlib.decompress(raw)
+        npixels = self.blockWidth * self.blockHeight
+        if self.bitDepth < 8:
+            nbytes = (npixels * self.bitDepth + 7) // 8
+            packed = numpy.frombuffer(raw, dtype=numpy.uint8, count=nbytes)
+            bits = numpy.unpackbits(packed).reshape(-1, self.bitDepth)
+            weights = 1 << numpy.arange(self.bitDepth - 1, -1, -1)
+            values = (bits * weights).sum(axis=1)[:npixels]
+        else:
+            nbytes = npixels * self.dtype.itemsize
+            values = numpy.frombuffer(raw, dtype=self.dtype, count=npixels)
+        block = values.reshape(self.blockHeight, self.blockWidth).astype(numpy.float64)
+        if len(raw) >= nbytes + npixels // 8:
+            maskBytes = numpy.frombuffer(raw, dtype=numpy.uint8, count=npixels // 8, offset=nbytes)
+            valid = numpy.unpackbits(maskBytes).reshape(self.blockHeight, self.blockWidth)
+            block[valid == 0] = numpy.nan
+        return block
+
+    # -- windows -----------------------------------------------------------
+
+    def read(self, window):
+        # Window (a Grid aligned with this raster) as float64, NaN for
+        # NoData and for cells beyond the raster
+        out = numpy.full(window.shape, numpy.nan)
+        row0, col0 = self.grid.offset(window)
+        r0 = max(row0, 0)
+        c0 = max(col0, 0)
+        r1 = min(row0 + window.nrows, self.grid.nrows)
+        c1 = min(col0 + window.ncols, self.grid.ncols)
+        if r1 <= r0 or c1 <= c0:
+            return out
+        bh = self.blockHeight
+        bw = self.blockWidth
+        for blockRow in range(r0 // bh, (r1 - 1) // bh + 1):
+            for blockCol in range(c0 // bw, (c1 - 1) // bw + 1):
+                block = self.readBlock(blockRow, blockCol)
+                if block is None:
+                    continue
+                br0 = max(r0, blockRow * bh)
+                br1 = min(r1, (blockRow + 1) * bh)
+                bc0 = max(c0, blockCol * bw)
+                bc1 = min(c1, (blockCol + 1) * bw)
+                out[br0 - row0:br1 - row0, bc0 - col0:bc1 - col0] = \
+                    block[br0 - blockRow * bh:br1 - blockRow * bh, bc0 - blockCol * bw:bc1 - blockCol * bw]
+        return out
+
+    def readAll(self):
+        return self.read(self.grid)
+
+
+def openRaster(path, band=1, level=0):
+    # RasterDataset for a geodatabase raster path, or None if the path is not
+    # a File Geodatabase raster this reader can open
+    parts = filegdb.splitPath(path)
+    if parts is None:
+        return None
+    gdbPath, name = parts
+    try:
+        return RasterDataset(gdbPath, name, band, level)
+    except (filegdb.FileGDBError, IOError, OSError):
+        return None
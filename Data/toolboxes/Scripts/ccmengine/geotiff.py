@@ -0,0 +1,389 @@
+# ==================================================
+# geotiff.py
+# --------------------------------------------------
+# Streaming writer for tiled GeoTIFFs with internal overviews.
+# --------------------------------------------------
+#
+# The raster is written as a tiled (Big)TIFF, little-endian, one band:
+#
+#   header    "II", 42 (43 for BigTIFF) and the offset of the first IFD
+#   IFDs      one per level, full resolution first, then each overview at
+#             half the size of the one before (NewSubfileType 1) until a
+#             level fits in one tile.  The full resolution IFD carries the
+#             GeoTIFF tags (ModelPixelScale, ModelTiepoint, GeoKeyDirectory
+#             with the EPSG code) and every IFD GDAL_NODATA.
+#   tiles     tileSize x tileSize blocks, compressed (deflate, LZW or zstd,
+#             with the horizontal or floating point predictor)
+#
+# The IFDs are placed ahead of the tiles, so a viewer finds every level
+# with one read of the start of the file; their size only depends on the
+# number of tiles, so the space is kept when the file is opened and they
+# are filled in on close.
+#
+# Blocks are taken in the tile rows tiling.runTiled writes; as soon as a
+# band of rows is complete it is cut into tiles and halved into the next
+# level (the mean of each 2 x 2 cells that are not NoData, or the upper
+# left cell for class rasters), which is cut and halved in turn.  So the
+# overviews are built in the pass that writes the raster, without reading
+# it back, and only a band of rows per level is held in memory.
+#
+# The tiles are compressed on a pool of threads (zlib and zstd release the
+# GIL) and written in the order they were cut, so the file does not depend
+# on the thread timing.  LZW is pure Python and much slower than deflate.
+#
+# ==================================================
+
+import struct
+import zlib
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+
+COMPRESSION = {"none": 1, "lzw": 5, "deflate": 8, "zstd": 50000}
+NO_PREDICTOR = 1
+HORIZONTAL = 2
+FLOATING_POINT = 3
+
+# TIFF field types
+SHORT = 3
+LONG = 4
+DOUBLE = 12
+ASCII = 2
+LONG8 = 16
+TYPE_FORMATS = {SHORT: "H", LONG: "I", DOUBLE: "d", LONG8: "Q"}
+
+
+def _lzw(data):
+    # TIFF LZW (MSB first, 9 to 12 bit codes, early change) of a byte string
+    clear, end = 256, 257
+    codes = [(clear, 9)]
+    width = 9
+    table = {}
+    nextCode = 258
+    current = None
+    for byte in bytearray(data):
+        if current is None:
+            current = byte
+            continue
+        key = (current << 8) | byte
+        code = table.get(key)
+        if code is not None:
+            current = code
+            continue
+        codes.append((current, width))
+        table[key] = nextCode
+        nextCode += 1
+        if nextCode == 4094:
+            codes.append((clear, width))
+            table = {}
+            nextCode = 258
+            width = 9
+        elif nextCode > (1 << width) - 1:
+            width += 1
+        current = byte
+    if current is not None:
+        # the reader adds one more entry before the end code
+        codes.append((current, width))
+        nextCode += 1
+        if nextCode == 4094:
+            codes.append((clear, width))
+            width = 9
+        elif nextCode > (1 << width) - 1:
+            width += 1
+    codes.append((end, width))
+
+    out = bytearray()
+    buffer = 0
+    bits = 0
+    for code, width in codes:
+        buffer = (buffer << width) | code
+        bits += width
+        while bits >= 8:
+            bits -= 8
+            out.append((buffer >> bits) & 0xFF)
+        buffer &= (1 << bits) - 1
+    if bits:
+        out.append((buffer << (8 - bits)) & 0xFF)
+    return bytes(out)
+
+
+def encodeTile(tile, compression, predictor, level=6):
+    # Stored bytes of a 2D tile
+    if predictor == HORIZONTAL:
+        stored = tile.copy()
+        stored[:, 1:] -= tile[:, :-1]
+        data = stored.astype(stored.dtype.newbyteorder("<"), copy=False).tobytes()
+    elif predictor == FLOATING_POINT:
+        # bytes of each row regrouped most significant first, then differenced
+        size = tile.dtype.itemsize
+        planes = tile.astype(tile.dtype.newbyteorder(">")).view(numpy.uint8)
+        planes = planes.reshape(tile.shape[0], tile.shape[1], size).transpose(0, 2, 1).reshape(tile.shape[0], -1)
+        stored = planes.copy()
+        stored[:, 1:] -= planes[:, :-1]
+        data = stored.tobytes()
+    else:
+        data = tile.astype(tile.dtype.newbyteorder("<"), copy=False).tobytes()
+    if compression == "deflate":
+        return zlib.compress(data, level)
+    if compression == "lzw":
+        return _lzw(data)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+
+def halve(block, resampling="average"):
+    # The next overview level of a block with an even number of rows
+    # (columns are padded with NoData): the mean of the valid cells of each
+    # 2 x 2, or with "nearest" the upper left cell
+    if resampling == "nearest":
+        return block[::2, ::2]
+    if block.shape[1] % 2:
+        block = numpy.hstack((block, numpy.full((block.shape[0], 1), numpy.nan)))
+    quads = block.reshape(block.shape[0] // 2, 2, block.shape[1] // 2, 2)
+    valid = ~numpy.isnan(quads)
+    count = valid.sum(axis=(1, 3))
+    total = numpy.where(valid, quads, 0.0).sum(axis=(1, 3))
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return numpy.where(count > 0, total / numpy.maximum(count, 1), numpy.nan)
+
+
+class _Level(object):
+    # One image of the file: rows come in order, are cut into tiles and
+    # halved into the next level
+
+    def __init__(self, writer, index, nrows, ncols):
+        self.writer = writer
+        self.index = index
+        self.nrows = nrows
+        self.ncols = ncols
+        tileSize = writer.tileSize
+        self.tilesAcross = -(-ncols // tileSize)
+        self.tilesDown = -(-nrows // tileSize)
+        self.offsets = [0] * (self.tilesAcross * self.tilesDown)
+        self.counts = [0] * (self.tilesAcross * self.tilesDown)
+        self.pending = numpy.zeros((0, ncols))
+        self.unhalved = numpy.zeros((0, ncols))
+        self.rowsCut = 0
+        self.rowsHalved = 0
+        self.next = None
+
+    def push(self, rows):
+        tileSize = self.writer.tileSize
+        self.pending = numpy.vstack((self.pending, rows))
+        while len(self.pending) >= tileSize or (self.pending.size and
+                                                 self.rowsCut + len(self.pending) == self.nrows):
+            strip = self.pending[:tileSize]
+            self.pending = self.pending[tileSize:]
+            self.writer._cut(self, self.rowsCut // tileSize, strip)
+            self.rowsCut += len(strip)
+        if self.next is None:
+            return
+        self.unhalved = numpy.vstack((self.unhalved, rows))
+        self.rowsHalved += len(rows)
+        even = len(self.unhalved) - len(self.unhalved) % 2
+        if self.rowsHalved == self.nrows and even < len(self.unhalved):
+            self.unhalved = numpy.vstack((self.unhalved, numpy.full((1, self.ncols), numpy.nan)))
+            even = len(self.unhalved)
+        if even:
+            self.next.push(halve(self.unhalved[:even], self.writer.resampling))
+            self.unhalved = self.unhalved[even:]
+
+
+class GeoTiffWriter(object):
+    # Sink writing blocks of values (NaN as NoData) to a tiled GeoTIFF at
+    # path.  dtype is the stored type; a quantize.Quantization stores its
+    # codes instead.  noData is the stored NoData of integer types (NaN for
+    # floats).  epsg goes into the GeoKeyDirectory when given.  overviews
+    # is the number of overview levels (None: until one tile holds a
+    # level).  resampling is "average" or "nearest" (class rasters).
+    # workers is the number of compression threads.  bigTiff None picks
+    # BigTIFF when the uncompressed levels come near 4 GB.
+
+    def __init__(self, path, grid, dtype="float32", noData=None, quantization=None, epsg=None,
+                 compression="deflate", predictor=None, tileSize=256, overviews=None,
+                 resampling="average", workers=4, level=6, bigTiff=None):
+        if compression not in COMPRESSION:
+            raise ValueError("Unknown compression %r, not one of %s" % (compression, ", ".join(sorted(COMPRESSION))))
+        if tileSize % 16:
+            raise ValueError("TIFF tiles must be a multiple of 16 cells, not %d" % tileSize)
+        self.path = path
+        self.grid = grid
+        self.quantization = quantization
+        if quantization is not None:
+            dtype = quantization.dtype
+            noData = quantization.noData
+        self.dtype = numpy.dtype(dtype)
+        floating = self.dtype.kind == "f"
+        if noData is None:
+            noData = numpy.nan if floating else 0
+        self.noData = noData
+        if predictor is None:
+            predictor = NO_PREDICTOR if compression == "none" else (FLOATING_POINT if floating else HORIZONTAL)
+        self.compression = compression
+        self.predictor = predictor
+        self.level = level
+        self.tileSize = tileSize
+        self.resampling = resampling
+        self.epsg = epsg
+
+        self.levels = [_Level(self, 0, grid.nrows, grid.ncols)]
+        while overviews is None and max(self.levels[-1].nrows, self.levels[-1].ncols) > tileSize or \
+                overviews is not None and len(self.levels) <= overviews:
+            last = self.levels[-1]
+            if last.nrows == 1 and last.ncols == 1:
+                break
+            overview = _Level(self, len(self.levels), -(-last.nrows // 2), -(-last.ncols // 2))
+            last.next = overview
+            self.levels.append(overview)
+
+        raw = sum(lv.tilesAcross * lv.tilesDown for lv in self.levels) * tileSize * tileSize * self.dtype.itemsize
+        self.bigTiff = raw > 2 ** 32 - 2 ** 28 if bigTiff is None else bigTiff
+        self.handle = open(path, "wb")
+        self.handle.write(b"\0" * (self._headerSize() + sum(len(self._ifd(lv, 0, 0)) for lv in self.levels)))
+        self.pool = ThreadPool(max(1, workers))
+        self.queue = []
+        self.window = 2 * max(1, workers)
+        self.bands = {}
+        self.nextRow = 0
+
+    def _headerSize(self):
+        return 16 if self.bigTiff else 8
+
+    def write(self, row0, col0, block):
+        # blocks of a band of rows may come in any order; the bands are
+        # passed on in order once complete
+        block = numpy.asarray(block, dtype=numpy.float64)
+        band = self.bands.get(row0)
+        if band is None:
+            band = self.bands[row0] = [numpy.full((block.shape[0], self.grid.ncols), numpy.nan), 0]
+        band[0][:, col0:col0 + block.shape[1]] = block
+        band[1] += block.size
+        while self.nextRow in self.bands and self.bands[self.nextRow][1] == self.bands[self.nextRow][0].size:
+            rows = self.bands.pop(self.nextRow)[0]
+            self.nextRow += len(rows)
+            self.levels[0].push(rows)
+
+    def _encode(self, values):
+        if self.quantization is not None:
+            return self.quantization.encode(values)
+        if self.dtype.kind == "f":
+            return values.astype(self.dtype)
+        stored = numpy.where(numpy.isnan(values), self.noData, values)
+        if self.dtype.kind in "ui":
+            stored = numpy.rint(stored)
+        return stored.astype(self.dtype)
+
+    def _cut(self, level, tileRow, strip):
+        tileSize = self.tileSize
+        stored = self._encode(strip)
+        if stored.shape != (tileSize, tileSize * level.tilesAcross):
+            padded = numpy.empty((tileSize, tileSize * level.tilesAcross), dtype=self.dtype)
+            padded[...] = self.noData
+            padded[:stored.shape[0], :stored.shape[1]] = stored
+            stored = padded
+        for tileCol in range(level.tilesAcross):
+            tile = numpy.ascontiguousarray(stored[:, tileCol * tileSize:(tileCol + 1) * tileSize])
+            job = self.pool.apply_async(encodeTile, (tile, self.compression, self.predictor, self.level))
+            self.queue.append((level, tileRow * level.tilesAcross + tileCol, job))
+        while len(self.queue) > self.window:
+            self._drain()
+
+    def _drain(self):
+        level, index, job = self.queue.pop(0)
+        data = job.get()
+        level.offsets[index] = self.handle.tell()
+        level.counts[index] = len(data)
+        self.handle.write(data)
+
+    def _geoTags(self):
+        grid = self.grid
+        keys = [(1025, 1)]
+        if self.epsg:
+            keys.append((1024, 2 if grid.geographic else 1))
+            keys.append((2048 if grid.geographic else 3072, int(self.epsg)))
+        elif grid.geographic:
+            keys.append((1024, 2))
+        keys.sort()
+        directory = [1, 1, 0, len(keys)]
+        for key, value in keys:
+            directory.extend((key, 0, 1, value))
+        return [(33550, DOUBLE, [grid.cellWidth, grid.cellHeight, 0.0]),
+                (33922, DOUBLE, [0.0, 0.0, 0.0, grid.xMin, grid.yMax, 0.0]),
+                (34735, SHORT, directory)]
+
+    def _ifd(self, level, at, nextIFD):
+        # Bytes of the IFD of a level placed at offset at, its long values
+        # following it
+        offsetType = LONG8 if self.bigTiff else LONG
+        noData = "nan" if self.dtype.kind == "f" else "%d" % self.noData
+        sampleFormat = {"u": 1, "i": 2, "f": 3}[self.dtype.kind]
+        tags = [(254, LONG, [1 if level.index else 0]),
+                (256, LONG, [level.ncols]),
+                (257, LONG, [level.nrows]),
+                (258, SHORT, [self.dtype.itemsize * 8]),
+                (259, SHORT, [COMPRESSION[self.compression]]),
+                (262, SHORT, [1]),
+                (277, SHORT, [1]),
+                (284, SHORT, [1]),
+                (317, SHORT, [self.predictor]),
+                (322, SHORT, [self.tileSize]),
+                (323, SHORT, [self.tileSize]),
+                (324, offsetType, level.offsets),
+                (325, offsetType, level.counts),
+                (339, SHORT, [sampleFormat]),
+                (42113, ASCII, noData)]
+        if level.index == 0:
+            tags.extend(self._geoTags())
+        tags.sort(key=lambda tag: tag[0])
+
+        if self.bigTiff:
+            countFormat, entryFormat, inline, nextFormat = "<Q", "<HHQ", 8, "<Q"
+        else:
+            countFormat, entryFormat, inline, nextFormat = "<H", "<HHI", 4, "<I"
+        head = struct.pack(countFormat, len(tags))
+        entrySize = struct.calcsize(entryFormat) + inline
+        extra = at + len(head) + entrySize * len(tags) + struct.calcsize(nextFormat)
+        entries = []
+        values = []
+        for tag, kind, value in tags:
+            if kind == ASCII:
+                data = value.encode("ascii") + b"\0"
+                count = len(data)
+            else:
+                count = len(value)
+                data = struct.pack("<%d%s" % (count, TYPE_FORMATS[kind]), *value)
+            if len(data) <= inline:
+                entries.append(struct.pack(entryFormat, tag, kind, count) + data.ljust(inline, b"\0"))
+            else:
+                entries.append(struct.pack(entryFormat, tag, kind, count) +
+                               struct.pack(nextFormat, extra + sum(len(v) for v in values)))
+                values.append(data + (b"\0" if len(data) % 2 else b""))
+        return head + b"".join(entries) + struct.pack(nextFormat, nextIFD) + b"".join(values)
+
+    def close(self):
+        while self.queue:
+            self._drain()
+        self.pool.close()
+        self.pool.join()
+        if self.nextRow != self.grid.nrows:
+            self.handle.close()
+            raise ValueError("GeoTIFF %s closed with rows %d.. not written" % (self.path, self.nextRow))
+        at = self._headerSize()
+        ifds = []
+        for n, level in enumerate(self.levels):
+            size = len(self._ifd(level, at, 0))
+            following = at + size if n + 1 < len(self.levels) else 0
+            ifds.append(self._ifd(level, at, following))
+            at += size
+        self.handle.seek(0)
+        if self.bigTiff:
+            self.handle.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, self._headerSize()))
+        else:
+            self.handle.write(b"II" + struct.pack("<HI", 42, self._headerSize()))
+        self.handle.write(b"".join(ifds))
+        self.handle.close()
+        return self.path
+
@@ -0,0 +1,140 @@
+# ==================================================
+# grid.py
+# --------------------------------------------------
+# Raster grid geometry shared by the CCM engine.
+# --------------------------------------------------
+#
+# A Grid describes a north-up raster: the upper left corner, the cell size
+# and the number of rows and columns.  Row 0 is the northern-most row, the
+# same orientation arcpy.RasterToNumPyArray returns.
+#
+# A geographic Grid has its cell size in degrees of longitude and latitude
+# (GCS_WGS_1984).  metricCellSizes gives the size of its cells in metres
+# row by row on the WGS 1984 ellipsoid, so the terrain kernels can work on
+# geographic DEMs without projecting them first.  A window keeps the top
+# edge of the grid it was cut from and its row offset in it, and takes its
+# latitudes from those: computed from its own top edge they could differ
+# in the last bit, and tiled results would no longer match whole-window
+# ones.
+#
+# ==================================================
+
+import math
+
+import numpy
+
+
+# WGS 1984 semi-major axis (metres) and first eccentricity squared
+WGS84_A = 6378137.0
+WGS84_E2 = 0.00669437999014
+
+
+def metricCellSizes(latitudes, cellWidth, cellHeight):
+    # Width and height in metres of cells cellWidth x cellHeight degrees
+    # centred on the given latitudes, from the prime vertical and meridional
+    # radii of curvature of the WGS 1984 ellipsoid
+    phi = numpy.radians(numpy.asarray(latitudes, dtype=numpy.float64))
+    w = 1.0 - WGS84_E2 * numpy.sin(phi) ** 2
+    primeVertical = WGS84_A / numpy.sqrt(w)
+    meridional = WGS84_A * (1.0 - WGS84_E2) / (w * numpy.sqrt(w))
+    width = primeVertical * numpy.cos(phi) * math.radians(cellWidth)
+    height = meridional * math.radians(cellHeight)
+    return width, height
+
+
+class Grid(object):
+
+    def __init__(self, xMin, yMax, cellWidth, cellHeight, nrows, ncols, geographic=False):
+        self.xMin = float(xMin)
+        self.yMax = float(yMax)
+        self.cellWidth = float(cellWidth)
+        self.cellHeight = float(cellHeight)
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.geographic = bool(geographic)
+        # (top edge, row offset) the latitudes of the rows are taken from
+        self.rowOrigin = (self.yMax, 0)
+
+    def __repr__(self):
+        return "Grid(xMin=%r, yMax=%r, cellWidth=%r, cellHeight=%r, nrows=%r, ncols=%r, geographic=%r)" % (
+            self.xMin, self.yMax, self.cellWidth, self.cellHeight, self.nrows, self.ncols, self.geographic)
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        return (self.xMin, self.yMax, self.cellWidth, self.cellHeight, self.nrows, self.ncols,
+                self.geographic)
+
+    @property
+    def shape(self):
+        return (self.nrows, self.ncols)
+
+    @property
+    def xMax(self):
+        return self.xMin + self.ncols * self.cellWidth
+
+    @property
+    def yMin(self):
+        return self.yMax - self.nrows * self.cellHeight
+
+    @property
+    def extent(self):
+        # (xMin, yMin, xMax, yMax), the order arcpy.Extent takes
+        return (self.xMin, self.yMin, self.xMax, self.yMax)
+
+    def window(self, row0, col0, nrows, ncols):
+        # Sub-grid starting at (row0, col0).  The window may extend past the
+        # edges of this grid; readers fill those cells with NoData.
+        grid = Grid(self.xMin + col0 * self.cellWidth,
+                    self.yMax - row0 * self.cellHeight,
+                    self.cellWidth, self.cellHeight, nrows, ncols, self.geographic)
+        grid.rowOrigin = (self.rowOrigin[0], self.rowOrigin[1] + row0)
+        return grid
+
+    def metricCellSizes(self, halo=0):
+        # (cellWidth, cellHeight) in ground units for the terrain kernels,
+        # for this grid read with halo cells around it.  Projected grids
+        # return the cell size; geographic grids return one width and height
+        # in metres per row, as (rows, 1) columns that broadcast across the
+        # row.
+        if not self.geographic:
+            return self.cellWidth, self.cellHeight
+        yMax, row0 = self.rowOrigin
+        rows = numpy.arange(row0 - halo, row0 + self.nrows + halo, dtype=numpy.float64)
+        latitudes = yMax - (rows + 0.5) * self.cellHeight
+        width, height = metricCellSizes(numpy.clip(latitudes, -90.0, 90.0), self.cellWidth, self.cellHeight)
+        return width[:, None], height[:, None]
+
+    def offset(self, other):
+        # (row, col) of the upper left cell of an aligned grid in this grid
+        return (int(round((self.yMax - other.yMax) / self.cellHeight)),
+                int(round((other.xMin - self.xMin) / self.cellWidth)))
+
+    def cellCenter(self, row, col):
+        return (self.xMin + (col + 0.5) * self.cellWidth,
+                self.yMax - (row + 0.5) * self.cellHeight)
+
+    def cellOf(self, x, y):
+        # (row, col) of the cell containing the point; may lie outside the grid
+        return (int(math.floor((self.yMax - y) / self.cellHeight)),
+                int(math.floor((x - self.xMin) / self.cellWidth)))
+
+    def contains(self, row, col):
+        return 0 <= row < self.nrows and 0 <= col < self.ncols
+
+    def snap(self, xMin, yMin, xMax, yMax):
+        # Window of this grid's cells covering the extent, snapped outward to
+        # cell boundaries in the same way env.snapRaster aligns an analysis
+        # extent.  Returns (row0, col0, nrows, ncols).
+        col0 = int(math.floor((xMin - self.xMin) / self.cellWidth + 1e-9))
+        col1 = int(math.ceil((xMax - self.xMin) / self.cellWidth - 1e-9))
+        row0 = int(math.floor((self.yMax - yMax) / self.cellHeight + 1e-9))
+        row1 = int(math.ceil((self.yMax - yMin) / self.cellHeight - 1e-9))
+        return (row0, col0, max(row1 - row0, 0), max(col1 - col0, 0))
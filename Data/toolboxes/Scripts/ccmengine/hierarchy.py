@@ -0,0 +1,483 @@
+# ==================================================
+# hierarchy.py
+# --------------------------------------------------
+# A precomputed route index over a fixed CCM raster.
+# --------------------------------------------------
+#
+# The raster is cut into square blocks, and the graph is built over their
+# entrances (hierarchical path-finding, Botea et al.): along each side two
+# neighbouring blocks share, the runs of cells passable on both sides get
+# one entrance in the middle, or one at each end when the run is long.
+# An entrance is a pair of cells facing each other across the side, joined
+# by the straight move between them.  Within a block, every entrance is
+# joined to the others by the least time inside the block, from a
+# travel time tree (isochrones.travelTime) grown from the entrance over
+# the block.  The index keeps these edges and, once for each pair of
+# entrances, the moves of the route between them; a move costs the same
+# both ways, so the route back takes the same cells.  A query grows one
+# tree from each end over its block for the times to the block's
+# entrances, runs an A* over the entrances and rebuilds the route cell by
+# cell from the kept moves.
+#
+# A route through the entrances can take a long detour to reach one,
+# worst for short routes that cross into the next block.  So a route
+# between cells of one block or of two neighbouring blocks is also searched
+# directly over those blocks, and a route through the entrances is then
+# straightened piece by piece: each stretch spanning less than a block is
+# replaced by the least-time route inside its bounding box and a quarter
+# block around it.  Routes are still not least-time routes.  Against
+# routing.RoutingGrid, on a smoothed 200 x 200 CCM with 64 cell blocks
+# they took up to 1.25 times the least time (95th percentile 1.07, mean
+# 1.01), and on random CCMs with 32 cell blocks up to 1.13 times (95th
+# percentile 1.03, mean 1.005).  Without the two searches the worst was
+# 6.9 times on the smoothed CCM and 3.1 times on the random ones.
+#
+# On a 512 x 512 CCM with a tenth of it NO-GO, the index of 64 cell blocks
+# (2905 entrances) is 6.8 MB, six and a half times the CCM, and takes 40 s
+# to build.  A query takes 25 to 60 ms, most of it the two trees, and 45
+# to 165 ms when refined; a refined route across a 2000 x 2000 CCM takes
+# 0.7 s.
+#
+# The index is one file: a JSON header followed by the arrays, each
+# aligned so that it can be memory-mapped in place.  routeIndex keys the
+# file by the CCM values and the settings, so it is only rebuilt when the
+# CCM changes.
+#
+# ==================================================
+
+import hashlib
+import heapq
+import json
+import os
+import struct
+
+import numpy
+
+from . import isochrones
+from . import routing
+from .grid import Grid
+
+
+MAGIC = b"CCMROUTE"
+VERSION = 2
+ALIGNMENT = 64
+# runs of entrance cells longer than this get an entrance at each end
+LONG_RUN = 6
+
+
+def _runs(passable):
+    # (first, last) of each run of True in a 1D boolean array
+    edges = numpy.diff(numpy.concatenate(([0], passable.astype(numpy.int8), [0])))
+    return list(zip(numpy.nonzero(edges == 1)[0], numpy.nonzero(edges == -1)[0] - 1))
+
+
+class RouteIndex(object):
+
+    def __init__(self, path):
+        # Opens a saved index; the arrays are memory maps of the file
+        handle = open(path, "rb")
+        try:
+            magic, length = struct.unpack("<8sQ", handle.read(16))
+            if magic != MAGIC:
+                raise ValueError("%s is not a route index" % path)
+            header = json.loads(handle.read(length).decode("utf-8"))
+        finally:
+            handle.close()
+        if header["version"] != VERSION:
+            raise ValueError("%s is a version %r route index" % (path, header["version"]))
+        self.path = path
+        self.header = header
+        self.grid = Grid(*header["grid"])
+        self.blockSize = header["blockSize"]
+        self.connectivity = header["connectivity"]
+        self.speedScale = header["speedScale"]
+        self.minCost = header["minCost"]
+        for name, (dtype, shape, offset) in header["arrays"].items():
+            if numpy.prod(shape) == 0:
+                # an index without entrances; nothing to map
+                array = numpy.empty(tuple(shape), dtype=numpy.dtype(dtype))
+            else:
+                array = numpy.memmap(path, dtype=numpy.dtype(dtype), mode="r", offset=offset, shape=tuple(shape))
+            setattr(self, name, array)
+        self.moves = KING_AND_KNIGHT[:self.connectivity]
+        cellWidth, cellHeight = routing.rowCellSizes(self.grid, 0)
+        self.minWidth = float(cellWidth.min())
+        self.minHeight = float(cellHeight.min())
+        self.blocksAcross = -(-self.grid.ncols // self.blockSize)
+
+    # -- building ----------------------------------------------------------
+
+    @staticmethod
+    def build(path, ccm, grid, speedScale=1.0, connectivity=8, blockSize=64, key=""):
+        # Builds the index of a CCM on grid and saves it to path
+        ccm = numpy.asarray(ccm, dtype=numpy.float32)
+        cost = routing.secondsPerMetre(ccm, grid, speedScale, 0)
+        passable = numpy.isfinite(cost)
+        cellWidth, cellHeight = routing.rowCellSizes(grid, 0)
+        nrows, ncols = grid.shape
+        size = blockSize
+
+        # entrance pairs across the vertical and horizontal block sides
+        crossings = []
+        for col in range(size - 1, ncols - 1, size):
+            for row0 in range(0, nrows, size):
+                side = passable[row0:row0 + size, col] & passable[row0:row0 + size, col + 1]
+                for first, last in _runs(side):
+                    for row in _entrances(row0 + first, row0 + last):
+                        time = cellWidth[row] * (cost[row, col] + cost[row, col + 1]) / 2.0
+                        crossings.append((row * ncols + col, row * ncols + col + 1, time))
+        for row in range(size - 1, nrows - 1, size):
+            height = (cellHeight[row] + cellHeight[row + 1]) / 2.0
+            for col0 in range(0, ncols, size):
+                side = passable[row, col0:col0 + size] & passable[row + 1, col0:col0 + size]
+                for first, last in _runs(side):
+                    for col in _entrances(col0 + first, col0 + last):
+                        time = height * (cost[row, col] + cost[row + 1, col]) / 2.0
+                        crossings.append((row * ncols + col, (row + 1) * ncols + col, time))
+
+        # nodes ordered by block, so the nodes of a block are consecutive
+        cells = set()
+        for a, b, time in crossings:
+            cells.add(a)
+            cells.add(b)
+        blocksAcross = -(-ncols // size)
+        blocksDown = -(-nrows // size)
+
+        def blockOf(cell):
+            row, col = divmod(cell, ncols)
+            return (row // size) * blocksAcross + col // size
+
+        nodeCell = numpy.array(sorted(cells, key=lambda cell: (blockOf(cell), cell)), dtype=numpy.int64)
+        nodeOf = dict((int(cell), i) for i, cell in enumerate(nodeCell))
+        nodeBlock = numpy.array([blockOf(int(cell)) for cell in nodeCell], dtype=numpy.int32)
+        blockStart = numpy.searchsorted(nodeBlock, numpy.arange(blocksDown * blocksAcross + 1)).astype(numpy.int64)
+
+        # edges are (target, time, path): path is 0 for a crossing, i + 1
+        # for the route of pair i and -(i + 1) for that route backwards
+        edges = [[] for i in range(len(nodeCell))]
+        for a, b, time in crossings:
+            edges[nodeOf[a]].append((nodeOf[b], float(time), 0))
+            edges[nodeOf[b]].append((nodeOf[a], float(time), 0))
+
+        # a travel time tree from every node over its block; the moves of
+        # each pair's route come from the tree of its lower node
+        moves = KING_AND_KNIGHT[:connectivity]
+        paths = []
+        pairOf = {}
+        for block in range(blocksDown * blocksAcross):
+            first, last = blockStart[block], blockStart[block + 1]
+            if first == last:
+                continue
+            row0 = (block // blocksAcross) * size
+            col0 = (block % blocksAcross) * size
+            window = grid.window(row0, col0, min(size, nrows - row0), min(size, ncols - col0))
+            blockCCM = ccm[row0:row0 + window.nrows, col0:col0 + window.ncols]
+            for node in range(first, last):
+                row, col = divmod(int(nodeCell[node]), ncols)
+                sources = numpy.zeros(window.shape, dtype=bool)
+                sources[row - row0, col - col0] = True
+                times, parents = isochrones.travelTime(blockCCM, window, sources, speedScale, connectivity,
+                                                       parents=True)
+                for other in range(first, last):
+                    orow, ocol = divmod(int(nodeCell[other]), ncols)
+                    time = times[orow - row0, ocol - col0]
+                    if other == node or numpy.isnan(time):
+                        continue
+                    if node < other:
+                        pairOf[node, other] = len(paths)
+                        paths.append(_chase(parents, moves, orow - row0, ocol - col0))
+                        pair = len(paths)
+                    else:
+                        pair = -(pairOf[other, node] + 1)
+                    edges[node].append((other, float(time), pair))
+
+        edgeStart = numpy.zeros(len(nodeCell) + 1, dtype=numpy.int64)
+        edgeStart[1:] = numpy.cumsum([len(targets) for targets in edges])
+        edgeTarget = numpy.array([edge[0] for targets in edges for edge in targets], dtype=numpy.int32)
+        edgeTime = numpy.array([edge[1] for targets in edges for edge in targets], dtype=numpy.float64)
+        edgePath = numpy.array([edge[2] for targets in edges for edge in targets], dtype=numpy.int32)
+        pathStart = numpy.zeros(len(paths) + 1, dtype=numpy.int64)
+        pathStart[1:] = numpy.cumsum([len(route) for route in paths])
+        pathMoves = numpy.array([move for route in paths for move in route], dtype=numpy.uint8)
+
+        arrays = [("ccm", ccm), ("nodeCell", nodeCell), ("nodeBlock", nodeBlock),
+                  ("blockStart", blockStart), ("edgeStart", edgeStart), ("edgeTarget", edgeTarget),
+                  ("edgeTime", edgeTime), ("edgePath", edgePath), ("pathStart", pathStart),
+                  ("pathMoves", pathMoves)]
+        header = {"version": VERSION, "key": key, "grid": list(grid.key()), "blockSize": size,
+                  "connectivity": connectivity, "speedScale": float(speedScale),
+                  "minCost": float(cost[passable].min()) if passable.any() else 1.0}
+        _save(path, header, arrays)
+        return RouteIndex(path)
+
+    # -- queries -----------------------------------------------------------
+
+    def _block(self, row, col):
+        return (row // self.blockSize) * self.blocksAcross + col // self.blockSize
+
+    def _origin(self, block):
+        return ((block // self.blocksAcross) * self.blockSize, (block % self.blocksAcross) * self.blockSize)
+
+    def _tree(self, row, col):
+        # ({node: time between the cell and the node}, parents, origin) of
+        # a travel time tree grown from the cell over its block
+        block = self._block(row, col)
+        first, last = int(self.blockStart[block]), int(self.blockStart[block + 1])
+        if first == last:
+            return {}, None, None
+        row0, col0 = self._origin(block)
+        window = self.grid.window(row0, col0, min(self.blockSize, self.grid.nrows - row0),
+                                  min(self.blockSize, self.grid.ncols - col0))
+        sources = numpy.zeros(window.shape, dtype=bool)
+        sources[row - row0, col - col0] = True
+        times, parents = isochrones.travelTime(self.ccm[row0:row0 + window.nrows, col0:col0 + window.ncols],
+                                               window, sources, self.speedScale, self.connectivity,
+                                               parents=True)
+        nodeTimes = {}
+        for node in range(first, last):
+            nrow, ncol = divmod(int(self.nodeCell[node]), self.grid.ncols)
+            time = times[nrow - row0, ncol - col0]
+            if not numpy.isnan(time):
+                nodeTimes[node] = float(time)
+        return nodeTimes, parents, (row0, col0)
+
+    def _treeCells(self, cell, tree, node):
+        # The cells from cell, the source of tree, to node
+        nodeTimes, parents, (row0, col0) = tree
+        row, col = divmod(int(self.nodeCell[node]), self.grid.ncols)
+        return self._walk(cell, _chase(parents, self.moves, row - row0, col - col0))
+
+    def _edgeCells(self, a, b, path):
+        # The cells of the route of an edge from node a to node b, a left out
+        ncols = self.grid.ncols
+        if path == 0:
+            return [divmod(int(self.nodeCell[b]), ncols)]
+        pair = abs(path) - 1
+        moves = self.pathMoves[self.pathStart[pair]:self.pathStart[pair + 1]]
+        if path > 0:
+            return self._walk(divmod(int(self.nodeCell[a]), ncols), moves)[1:]
+        cells = self._walk(divmod(int(self.nodeCell[b]), ncols), moves)
+        cells.reverse()
+        return cells[1:]
+
+    def _walk(self, cell, moves):
+        # The cells from cell on along moves
+        row, col = cell
+        cells = [(row, col)]
+        for move in moves:
+            dr, dc = self.moves[move]
+            row += dr
+            col += dc
+            cells.append((row, col))
+        return cells
+
+    def passable(self, row, col):
+        return self.grid.contains(row, col) and self.ccm[row, col] > 0.0
+
+    def route(self, start, end, refine=True):
+        # Route between two (row, col) cells as a routing.Route, or None.
+        # With refine, a route through the entrances is straightened piece
+        # by piece (_refine), which takes a few small grid searches.
+        for row, col in (start, end):
+            if not self.passable(row, col):
+                raise ValueError("Cell (%d, %d) is outside the grid or impassable" % (row, col))
+        best = numpy.inf
+        direct = self._direct(start, end)
+        if direct is not None:
+            best = direct.time
+
+        # the heuristic of every node and the edge offsets as lists; reading
+        # the memory maps an element at a time is slow
+        rowT, colT = end
+        rows, cols = numpy.divmod(numpy.asarray(self.nodeCell), self.grid.ncols)
+        h = (self.minCost * numpy.hypot((cols - colT) * self.minWidth, (rows - rowT) * self.minHeight)).tolist()
+
+        startTree = self._tree(*start)
+        endTree = self._tree(*end)
+        endTimes = endTree[0]
+        g = {}
+        parents = {}
+        heap = []
+        for node, time in startTree[0].items():
+            g[node] = time
+            parents[node] = None
+            heapq.heappush(heap, (time + h[node], time, node))
+        edgeStart = self.edgeStart.tolist()
+        edgeTarget = self.edgeTarget
+        edgeTime = self.edgeTime
+        last = None
+        expanded = 0
+        while heap:
+            f, gu, u = heapq.heappop(heap)
+            if f >= best:
+                break
+            if gu > g[u]:
+                continue
+            expanded += 1
+            if u in endTimes and gu + endTimes[u] < best:
+                best = gu + endTimes[u]
+                last = u
+            first, stop = edgeStart[u], edgeStart[u + 1]
+            for i, v, time in zip(range(first, stop), edgeTarget[first:stop].tolist(),
+                                  edgeTime[first:stop].tolist()):
+                gv = gu + time
+                if gv < g.get(v, numpy.inf):
+                    g[v] = gv
+                    parents[v] = (u, i)
+                    heapq.heappush(heap, (gv + h[v], gv, v))
+        if last is None:
+            return direct
+
+        steps = []
+        node = last
+        while parents[node] is not None:
+            previous, i = parents[node]
+            steps.append((previous, node, int(self.edgePath[i])))
+            node = previous
+        steps.reverse()
+        cells = self._treeCells(start, startTree, node)
+        for a, b, path in steps:
+            cells.extend(self._edgeCells(a, b, path))
+        tail = self._treeCells(end, endTree, last)
+        tail.reverse()
+        cells.extend(tail[1:])
+        route = routing.Route(cells, best, expanded)
+        if refine:
+            route = self._refine(route)
+        return route
+
+    def _direct(self, start, end):
+        # Least-time route inside the blocks of two cells when they are the
+        # same block or neighbours, the diagonal ones included; otherwise
+        # None
+        size = self.blockSize
+        rows = sorted((start[0] // size, end[0] // size))
+        cols = sorted((start[1] // size, end[1] // size))
+        if rows[1] - rows[0] > 1 or cols[1] - cols[0] > 1:
+            return None
+        row0 = rows[0] * size
+        col0 = cols[0] * size
+        return self._search(start, end, row0, col0, min((rows[1] + 1) * size, self.grid.nrows),
+                            min((cols[1] + 1) * size, self.grid.ncols))
+
+    def _search(self, start, end, row0, col0, row1, col1):
+        # Least-time route inside rows row0:row1 and columns col0:col1
+        window = self.grid.window(row0, col0, row1 - row0, col1 - col0)
+        routingGrid = routing.RoutingGrid(self.ccm[row0:row1, col0:col1], window, self.speedScale, self.connectivity)
+        route = routingGrid.route((start[0] - row0, start[1] - col0), (end[0] - row0, end[1] - col0), "astar")
+        if route is not None:
+            route.cells = [(row + row0, col + col0) for row, col in route.cells]
+        return route
+
+    def _refine(self, route):
+        # The route with each piece spanning less than a block replaced by
+        # the least-time route inside the piece's bounding box widened by a
+        # quarter block; no piece gets slower, and the detours through the
+        # entrances straighten out
+        size = self.blockSize
+        margin = size // 4
+        cells = route.cells
+        breaks = [0]
+        while breaks[-1] < len(cells) - 1:
+            i = breaks[-1]
+            rowMin = rowMax = cells[i][0]
+            colMin = colMax = cells[i][1]
+            j = i + 1
+            while j < len(cells):
+                row, col = cells[j]
+                rowMin, rowMax = min(rowMin, row), max(rowMax, row)
+                colMin, colMax = min(colMin, col), max(colMax, col)
+                if rowMax - rowMin >= size or colMax - colMin >= size:
+                    break
+                j += 1
+            breaks.append(max(j - 1, i + 1))
+        refined = [cells[0]]
+        time = 0.0
+        expanded = route.expanded
+        for a, b in zip(breaks, breaks[1:]):
+            rows = [row for row, col in cells[a:b + 1]]
+            cols = [col for row, col in cells[a:b + 1]]
+            piece = self._search(cells[a], cells[b], max(min(rows) - margin, 0), max(min(cols) - margin, 0),
+                                 min(max(rows) + margin + 1, self.grid.nrows),
+                                 min(max(cols) + margin + 1, self.grid.ncols))
+            refined.extend(piece.cells[1:])
+            time += piece.time
+            expanded += piece.expanded
+        return routing.Route(refined, time, expanded)
+
+    def routeXY(self, startXY, endXY, refine=True):
+        return self.route(self.grid.cellOf(*startXY), self.grid.cellOf(*endXY), refine)
+
+
+KING_AND_KNIGHT = routing.KING_MOVES + routing.KNIGHT_MOVES
+
+
+def _chase(parents, moves, row, col):
+    # The moves of a travel time tree's route to (row, col), from the
+    # source on
+    path = []
+    move = parents[row, col]
+    while move != isochrones.NO_PARENT:
+        path.append(move)
+        dr, dc = moves[move]
+        row -= dr
+        col -= dc
+        move = parents[row, col]
+    path.reverse()
+    return path
+
+
+def _entrances(first, last):
+    # Entrance positions of a run of crossing cells
+    if last - first + 1 > LONG_RUN:
+        return [first, last]
+    return [(first + last) // 2]
+
+
+def _save(path, header, arrays):
+    # Writes the header and the arrays, each at an offset that is a
+    # multiple of ALIGNMENT, to a temporary file renamed into place
+    start = 0
+    while True:
+        layout = {}
+        offset = start
+        for name, array in arrays:
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout[name] = [array.dtype.str, list(array.shape), offset]
+            offset += array.nbytes
+        header["arrays"] = layout
+        text = json.dumps(header).encode("utf-8")
+        if 16 + len(text) <= start:
+            break
+        # the offsets grew the header past the first array; move them on
+        start = -(-(16 + len(text)) // ALIGNMENT) * ALIGNMENT
+    text += b" " * (start - 16 - len(text))
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    handle = open(temporary, "wb")
+    try:
+        handle.write(struct.pack("<8sQ", MAGIC, len(text)))
+        handle.write(text)
+        for name, array in arrays:
+            handle.seek(layout[name][2])
+            handle.write(numpy.ascontiguousarray(array).tobytes())
+    finally:
+        handle.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary, path)
+
+
+def routeIndex(folder, ccm, grid, speedScale=1.0, connectivity=8, blockSize=64):
+    # The RouteIndex of a CCM from folder, built and saved there first when
+    # no index of the same CCM values and settings exists
+    ccm = numpy.asarray(ccm, dtype=numpy.float32)
+    digest = hashlib.sha1()
+    digest.update(repr((VERSION, grid.key(), float(speedScale), connectivity, blockSize)).encode("ascii"))
+    digest.update(numpy.ascontiguousarray(ccm).tobytes())
+    key = digest.hexdigest()
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    path = os.path.join(folder, key + ".ccmroute")
+    if os.path.exists(path):
+        return RouteIndex(path)
+    return RouteIndex.build(path, ccm, grid, speedScale, connectivity, blockSize, key)
@@ -0,0 +1,139 @@
+# ==================================================
+# isochrones.py
+# --------------------------------------------------
+# Travel time over a CCM raster from many sources at once.
+# --------------------------------------------------
+#
+# The time to the nearest source is found for every cell with the moves
+# and move costs of routing.RoutingGrid, so a travel time raster and a
+# least-time route agree.  The search is delta stepping: a bucketed
+# priority queue whose buckets are bucketWidth seconds wide.  The cells of
+# the lowest bucket are relaxed together with NumPy, relaxing again the
+# ones improved into the same bucket until it empties; cells improved into
+# a later bucket wait in a pending list.  Only the frontier is touched, so
+# the work follows the area reached, and the search stops at the first
+# bucket past the time horizon.  The times are exact; the bucket width
+# only trades buckets against repeated relaxations.
+#
+# ==================================================
+
+import numpy
+
+from . import routing
+
+
+# parent move of the sources and of the cells not reached
+NO_PARENT = 255
+
+
+def travelTime(ccm, grid, sources, speedScale=1.0, connectivity=8, horizon=None, bucketWidth=None,
+               parents=False):
+    # Seconds from the nearest source cell (sources: boolean array on the
+    # grid) to every cell, NaN where no source can be reached within
+    # horizon seconds (or at all).  The CCM is read as in routing.  With
+    # parents, also returns the move (an index into routing.paddedMoves)
+    # of the last step of each cell's least-time route, NO_PARENT at the
+    # sources and the cells not reached.
+    pad = routing.padding(connectivity)
+    width = grid.ncols + 2 * pad
+    cost = routing.secondsPerMetre(ccm, grid, speedScale, pad).ravel()
+    moves = [(offset, crossed, lengths, 1.0 / (2 + len(crossed)))
+             for offset, crossed, lengths in routing.paddedMoves(grid, connectivity)]
+    if horizon is None:
+        horizon = numpy.inf
+
+    times = numpy.full(cost.shape, numpy.inf)
+    sources = numpy.asarray(sources, dtype=bool)
+    if sources.shape != grid.shape:
+        raise ValueError("sources of shape %r do not match the grid %r" % (sources.shape, grid.shape))
+    rows, cols = numpy.nonzero(sources)
+    pending = (rows + pad) * width + cols + pad
+    pending = pending[numpy.isfinite(cost[pending])]
+    times[pending] = 0.0
+
+    if bucketWidth is None:
+        # a few straight moves across a cell of median speed
+        finite = cost[numpy.isfinite(cost)]
+        cellWidth, cellHeight = routing.rowCellSizes(grid, pad)
+        step = min(cellWidth.min(), cellHeight.min())
+        bucketWidth = 4.0 * step * (numpy.median(finite) if finite.size else 1.0)
+
+    while pending.size:
+        pendingTimes = times[pending]
+        bucketEnd = (numpy.floor(pendingTimes.min() / bucketWidth) + 1.0) * bucketWidth
+        if bucketEnd - bucketWidth > horizon:
+            break
+        active = pending[pendingTimes < bucketEnd]
+        pending = pending[pendingTimes >= bucketEnd]
+        while active.size:
+            improved = _relax(active, times, cost, moves, width)
+            inBucket = times[improved] < bucketEnd
+            active = improved[inBucket]
+            pending = numpy.concatenate((pending, improved[~inBucket]))
+        # drop the entries settled in this bucket and the duplicates
+        pending = numpy.unique(pending)
+        pending = pending[times[pending] >= bucketEnd]
+
+    times[times > horizon] = numpy.inf
+    if parents:
+        moveOf = _parents(times, cost, moves, width)
+    times = times.reshape(grid.nrows + 2 * pad, width)[pad:grid.nrows + pad, pad:grid.ncols + pad]
+    times[numpy.isinf(times)] = numpy.nan
+    if parents:
+        return times, moveOf.reshape(grid.nrows + 2 * pad, width)[pad:grid.nrows + pad, pad:grid.ncols + pad]
+    return times
+
+
+def _parents(times, cost, moves, width):
+    # The move reaching each cell with its least time, found after the
+    # search as the move whose origin time plus move time is lowest
+    cells = numpy.nonzero(numpy.isfinite(times) & (times > 0.0))[0]
+    best = numpy.full(cells.size, numpy.inf)
+    moveOf = numpy.full(times.size, NO_PARENT, dtype=numpy.uint8)
+    chosen = numpy.full(cells.size, NO_PARENT, dtype=numpy.uint8)
+    for k, (offset, crossed, lengths, weight) in enumerate(moves):
+        origin = cells - offset
+        total = cost[origin] + cost[cells]
+        for c in crossed:
+            total = total + cost[origin + c]
+        candidate = times[origin] + lengths[origin // width] * total * weight
+        better = candidate < best
+        best[better] = candidate[better]
+        chosen[better] = k
+    moveOf[cells] = chosen
+    return moveOf
+
+
+def _relax(active, times, cost, moves, width):
+    # Relaxes every move out of the active cells; returns the cells whose
+    # time went down (unique)
+    rows = active // width
+    base = times[active]
+    costFrom = cost[active]
+    improved = []
+    for offset, crossed, lengths, weight in moves:
+        target = active + offset
+        total = costFrom + cost[target]
+        for c in crossed:
+            total = total + cost[active + c]
+        candidate = base + lengths[rows] * total * weight
+        better = candidate < times[target]
+        if better.any():
+            target = target[better]
+            numpy.minimum.at(times, target, candidate[better])
+            improved.append(target)
+    if not improved:
+        return numpy.zeros(0, dtype=active.dtype)
+    return numpy.unique(numpy.concatenate(improved))
+
+
+def bands(times, interval, count=None):
+    # Band number of every cell: 1 for times in [0, interval], 2 for
+    # (interval, 2 interval] and so on, 0 where the time is NaN or past
+    # count bands
+    codes = numpy.zeros(times.shape, dtype=numpy.int32)
+    reached = ~numpy.isnan(times)
+    codes[reached] = numpy.maximum(numpy.ceil(times[reached] / float(interval)), 1).astype(numpy.int32)
+    if count is not None:
+        codes[codes > count] = 0
+    return codes
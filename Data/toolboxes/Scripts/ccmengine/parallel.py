@@ -0,0 +1,186 @@
+# ==================================================
+# parallel.py
+# --------------------------------------------------
+# Multi-core tile execution of the CCM pipeline.
+# --------------------------------------------------
+#
+# The AOI window is split into tiles (tiling.iterTiles) and a process pool
+# computes F1, F2, the other factors and the final product of each tile.
+# Each worker reads its own tile plus halo straight from the sources, so
+# neighbouring tiles exchange halos through the overlapping reads and no
+# cell is computed from another worker's output.  Results come back with
+# Pool.imap in tile order, so the stitched output does not depend on which
+# worker finished first and matches a serial tiled run bit for bit.
+#
+# Sources are pickled into every worker once (through the pool
+# initializer).  Use file-backed sources (tiling.NpySource,
+# gdbraster.RasterDataset, arcpyio.RasterSource) rather than in-memory
+# arrays for large AOIs.
+#
+# ==================================================
+
+import multiprocessing
+import os
+import sys
+
+import numpy
+
+from . import engine
+from . import profiling
+from . import tiling
+
+
+class CCMJob(object):
+    # Everything a worker needs to compute one tile.  With derivatives (a
+    # cache.TerrainDerivatives) F1 and F2 come from the cached slope and
+    # focal range instead of the DEM.
+
+    def __init__(self, demSource, params, factorSources=(), derivatives=None):
+        self.demSource = demSource
+        self.params = params
+        self.factorSources = list(factorSources)
+        self.derivatives = derivatives
+
+    def focalMaxTile(self, tile):
+        halo = self.params.halo
+        dem = self.demSource.read(tiling.withHalo(tile, halo))
+        cellWidth, cellHeight = tile.metricCellSizes(halo)
+        return engine.focalRangeMaxBlock(dem, cellWidth, cellHeight, self.params, halo)[1]
+
+    def ccmTile(self, tile, focalMax):
+        factors = [source.read(tile) for source in self.factorSources]
+        if self.derivatives is not None:
+            f1, f2 = engine.factorsFromDerivatives(self.derivatives.slope.read(tile),
+                                                   self.derivatives.range.read(tile),
+                                                   self.params, focalMax)
+            return {"f1": f1, "f2": f2, "ccm": engine.productBlock([f1, f2] + factors)}
+        halo = self.params.halo
+        dem = self.demSource.read(tiling.withHalo(tile, halo))
+        cellWidth, cellHeight = tile.metricCellSizes(halo)
+        return engine.ccmBlock(dem, cellWidth, cellHeight, self.params, focalMax, factors, halo)
+
+
+class BatchJob(CCMJob):
+    # One CCM band per convoy (see engine.ccmBands): the slope, focal range,
+    # F2 and the other factors of a tile are computed once and shared by
+    # every convoy.  All the parameters must use the same zFactor,
+    # focalRadius and edge, the only settings the terrain stage depends on.
+    # bandFactors picks the factors of each band (see engine.ccmBands).
+
+    def __init__(self, demSource, paramsList, factorSources=(), derivatives=None, bandFactors=None):
+        paramsList = list(paramsList)
+        terrainSettings = set((p.zFactor, p.focalRadius, p.edge) for p in paramsList)
+        if len(terrainSettings) != 1:
+            raise ValueError("Every convoy of a batch needs the same zFactor, focalRadius and edge")
+        CCMJob.__init__(self, demSource, paramsList[0], factorSources, derivatives)
+        self.paramsList = paramsList
+        self.bandFactors = bandFactors
+        if bandFactors is not None and len(bandFactors) != len(paramsList):
+            raise ValueError("bandFactors needs one entry per band")
+
+    def ccmTile(self, tile, focalMax):
+        factors = [source.read(tile) for source in self.factorSources]
+        if self.derivatives is not None:
+            slope = self.derivatives.slope.read(tile)
+            rng = self.derivatives.range.read(tile)
+        else:
+            halo = self.params.halo
+            dem = self.demSource.read(tiling.withHalo(tile, halo))
+            cellWidth, cellHeight = tile.metricCellSizes(halo)
+            slope, rng, tileMax = engine.terrainDerivativesBlock(dem, cellWidth, cellHeight, self.params, halo)
+        return engine.ccmBands(slope, rng, self.paramsList, focalMax, factors, self.bandFactors)
+
+
+# Worker state, set once per process by the pool initializer
+_job = None
+
+
+def _initWorker(job):
+    global _job
+    _job = job
+
+
+def _focalMaxTask(task):
+    row0, col0, tile = task
+    return _job.focalMaxTile(tile)
+
+
+def _ccmTask(task):
+    row0, col0, tile, focalMax = task
+    return row0, col0, _job.ccmTile(tile, focalMax)
+
+
+def _configureExecutable():
+    # Inside ArcMap/ArcGIS Pro sys.executable is the application, not
+    # Python; Windows workers must be started with the interpreter instead.
+    if sys.platform == "win32" and not os.path.basename(sys.executable).lower().startswith("python"):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+
+
+def workerCount(workers=None):
+    if workers is None or workers <= 0:
+        return multiprocessing.cpu_count()
+    return int(workers)
+
+
+def ccmParallel(demSource, window, params, sinks, factorSources=(), tileSize=1024, workers=None,
+                derivatives=None):
+    # Runs the CCM over the window on a pool of workers.  sinks maps any of
+    # "f1", "f2" and "ccm" to a sink; factorSources are the F3..Fn rasters.
+    # workers=1 runs the same code in this process.  derivatives (see
+    # cache.DerivativeCache) skips the terrain stage and the focal maximum
+    # pass.
+    job = CCMJob(demSource, params, factorSources, derivatives)
+    return _run(job, window, sinks, tileSize, workers)
+
+
+def ccmBatchParallel(demSource, window, paramsList, sinks, factorSources=(), tileSize=1024,
+                     workers=None, derivatives=None, bandFactors=None):
+    # ccmParallel for several convoys or scenarios at once.  The "f1" and
+    # "ccm" sinks receive (bands, rows, cols) blocks, band k for
+    # paramsList[k]; "f2" is shared and stays single band.  Every factor
+    # source is read once per tile however many bands use it.
+    job = BatchJob(demSource, paramsList, factorSources, derivatives, bandFactors)
+    return _run(job, window, sinks, tileSize, workers)
+
+
+def _run(job, window, sinks, tileSize, workers):
+    workers = workerCount(workers)
+    tiles = list(tiling.iterTiles(window, tileSize))
+    derivatives = job.derivatives
+
+    if workers == 1 or len(tiles) == 1:
+        _initWorker(job)
+        if derivatives is not None:
+            focalMax = derivatives.focalMax
+        else:
+            with profiling.stage("focal maximum", window.nrows * window.ncols):
+                focalMax = float(numpy.nanmax([_focalMaxTask(task) for task in tiles]))
+        results = (_ccmTask(task + (focalMax,)) for task in tiles)
+        with profiling.stage("ccm tiles", window.nrows * window.ncols):
+            return _stitch(results, sinks)
+
+    _configureExecutable()
+    pool = multiprocessing.Pool(min(workers, len(tiles)), _initWorker, (job,))
+    try:
+        # First pass: the focal range maximum F2 is scaled by.  max() is
+        # exact, so the order the tiles are reduced in does not matter.
+        if derivatives is not None:
+            focalMax = derivatives.focalMax
+        else:
+            with profiling.stage("focal maximum", window.nrows * window.ncols):
+                focalMax = float(numpy.nanmax(pool.map(_focalMaxTask, tiles, chunksize=1)))
+        # Second pass: every factor and the product, stitched in tile order
+        tasks = [task + (focalMax,) for task in tiles]
+        with profiling.stage("ccm tiles", window.nrows * window.ncols):
+            return _stitch(pool.imap(_ccmTask, tasks, chunksize=1), sinks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _stitch(results, sinks):
+    for row0, col0, outputs in results:
+        for name, sink in sinks.items():
+            sink.write(row0, col0, outputs[name])
+    return dict((name, sink.close()) for name, sink in sinks.items())
@@ -0,0 +1,101 @@
+# ==================================================
+# params.py
+# --------------------------------------------------
+# CCM parameters read straight from SupportingData.gdb.
+# --------------------------------------------------
+#
+# Replaces the MakeTableView/Statistics/SearchCursor round trips the
+# scripts make for the vehicle and foot march parameters, and reads the
+# factor conversion tables (maotLandCover, maotSoils,
+# maotSurfaceRoughness) as lookup dicts.  Everything goes through
+# filegdb, so no ArcGIS session is needed.
+#
+# Each function returns None when the table is not in a File Geodatabase
+# or the where clause is beyond whereclause; the scripts then fall back to
+# arcpy.
+#
+# ==================================================
+
+import numpy
+
+from . import filegdb
+
+
+def _read(table, columns, where=None):
+    if not isinstance(table, filegdb.Table):
+        table = filegdb.openTable(table)
+        if table is None:
+            return None
+    try:
+        return table.read(columns, where)
+    except (ValueError, filegdb.FileGDBError):
+        return None
+
+
+def vehicleStatistics(table, whereClause):
+    # (minimum weight, maximum weight, minimum maxkph, minimum onslope,
+    # minimum offslope) over the vehicles of the convoy, as the
+    # Statistics_analysis call of MountedCCM.py
+    columns = _read(table, ["weight", "maxkph", "onslope", "offslope"], whereClause)
+    if columns is None or len(columns["weight"]) == 0:
+        return None
+    return (float(numpy.nanmin(columns["weight"])),
+            float(numpy.nanmax(columns["weight"])),
+            float(numpy.nanmin(columns["maxkph"])),
+            float(numpy.nanmin(columns["onslope"])),
+            float(numpy.nanmin(columns["offslope"])))
+
+
+VEHICLE_FIELDS = ["name", "weight", "maxkph", "onslope", "offslope"]
+
+
+def convoyEnvelopes(columns, convoys, log=None):
+    # vehicleStatistics for each convoy (a list of vehicle names) from the
+    # VEHICLE_FIELDS columns of the whole vehicle table, so a batch reads
+    # the table once however many convoys it has.  Vehicles missing from
+    # the table are left out and reported through log(message).
+    names = numpy.asarray(columns["name"], dtype=object)
+    known = set(names)
+    envelopes = []
+    for convoy in convoys:
+        # not numpy.isin, which the NumPy of ArcMap lacks (and in1d is gone
+        # from NumPy 2)
+        wanted = set(convoy)
+        members = numpy.array([name in wanted for name in names], dtype=bool)
+        if not members.any():
+            raise ValueError("None of the vehicles %s are in the vehicle table" % ", ".join(convoy))
+        unknown = [name for name in convoy if name not in known]
+        if unknown and log is not None:
+            log("Vehicles not in the vehicle table, left out of the convoy: %s" % ", ".join(unknown))
+        envelopes.append((float(numpy.nanmin(columns["weight"][members])),
+                          float(numpy.nanmax(columns["weight"][members])),
+                          float(numpy.nanmin(columns["maxkph"][members])),
+                          float(numpy.nanmin(columns["onslope"][members])),
+                          float(numpy.nanmin(columns["offslope"][members]))))
+    return envelopes
+
+
+def convoyStatistics(table, convoys, log=None):
+    # convoyEnvelopes straight from the vehicle table
+    columns = _read(table, VEHICLE_FIELDS)
+    if columns is None:
+        return None
+    return convoyEnvelopes(columns, convoys, log)
+
+
+def footMarchParameters(table, visibility):
+    # (speed in mph, maximum slope percent) for "Day" or "Night"
+    where = "visibility = '%s'" % visibility.replace("'", "''")
+    columns = _read(table, ["maxmph", "onslope"], where)
+    if columns is None or len(columns["maxmph"]) == 0:
+        return None
+    # The scripts keep the last row the cursor returns
+    return float(columns["maxmph"][-1]), float(columns["onslope"][-1])
+
+
+def lookupTable(table, keyField, valueField):
+    # dict of keyField -> valueField, e.g. lookupTable(maotSoils, "soilcode", "f4dry")
+    columns = _read(table, [keyField, valueField])
+    if columns is None:
+        return None
+    return dict(zip(columns[keyField].tolist(), columns[valueField].tolist()))
@@ -0,0 +1,236 @@
+# ==================================================
+# pipeline.py
+# --------------------------------------------------
+# The CCM stages as a dependency graph with incremental recomputation.
+# --------------------------------------------------
+#
+# Every stage of the scripts (slope, clamp, F1, curvature, focal range,
+# F2, F3, F4, F5 and the product) is a node of a Pipeline.  A node's
+# fingerprint is the SHA-1 of its name, its settings and the fingerprints
+# of its inputs; inputs of the graph (the DEM window, the AOI mask) are
+# fingerprinted by their content, the categorical factors by the bytes of
+# the feature class files and the lookup table values.  Node outputs are
+# stored in a folder as <name>-<fingerprint>.npy, so a later run only
+# recomputes the nodes whose fingerprint changed: switching wet_dry, or
+# editing maotSoils, rebuilds F4 and the product and loads everything else.
+# A categorical factor given as a code raster node (rasterize.codeRaster)
+# and a lookup array is rebuilt from the stored codes, without burning the
+# polygons again.
+#
+# Node outputs are whole-window arrays, read back as memory maps.  Stored
+# files are touched when used and the least recently used ones are deleted
+# once the folder grows past maxBytes.
+#
+# ==================================================
+
+import hashlib
+import os
+
+import numpy
+
+from . import cache
+from . import engine
+from . import profiling
+from . import terrain
+
+
+def arrayDigest(array):
+    digest = hashlib.sha1()
+    array = numpy.ascontiguousarray(array)
+    digest.update(repr((array.dtype.str, array.shape)).encode("ascii"))
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def fileDigest(paths):
+    # SHA-1 of the contents of the files that exist among paths
+    digest = hashlib.sha1()
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        digest.update(os.path.basename(path).encode("utf-8"))
+        handle = open(path, "rb")
+        try:
+            chunk = handle.read(1 << 20)
+            while chunk:
+                digest.update(chunk)
+                chunk = handle.read(1 << 20)
+        finally:
+            handle.close()
+    return digest.hexdigest()
+
+
+class Pipeline(object):
+
+    def __init__(self, folder, maxBytes=4 * 1024 ** 3):
+        self.folder = folder
+        self.maxBytes = maxBytes
+        self.nodes = {}
+        self.fingerprints = {}
+        self.values = {}
+        # names of the nodes computed (not loaded) by this run, in order
+        self.rebuilt = []
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def source(self, name, value, fingerprint=None):
+        # An input of the graph, fingerprinted by its content unless a
+        # fingerprint is given
+        if fingerprint is None:
+            fingerprint = arrayDigest(value)
+        self.fingerprints[name] = fingerprint
+        self.values[name] = value
+
+    def node(self, name, compute, inputs=(), settings=()):
+        # A stage: compute(*input arrays) returns the node's array.
+        # settings holds everything besides the inputs the result depends on.
+        self.nodes[name] = (compute, list(inputs), settings)
+
+    def fingerprint(self, name):
+        if name not in self.fingerprints:
+            compute, inputs, settings = self.nodes[name]
+            digest = hashlib.sha1()
+            digest.update(repr((name, settings)).encode("utf-8"))
+            for input in inputs:
+                digest.update(self.fingerprint(input).encode("ascii"))
+            self.fingerprints[name] = digest.hexdigest()
+        return self.fingerprints[name]
+
+    def _path(self, name):
+        return os.path.join(self.folder, "%s-%s.npy" % (name, self.fingerprint(name)))
+
+    def get(self, name):
+        # The node's array: from the store when its fingerprint is there,
+        # otherwise computed from its inputs and stored
+        if name in self.values:
+            return self.values[name]
+        path = self._path(name)
+        if os.path.exists(path):
+            os.utime(path, None)
+        else:
+            compute, inputs, settings = self.nodes[name]
+            arrays = [self.get(input) for input in inputs]
+            with profiling.stage(name) as timing:
+                value = compute(*arrays)
+                self._store(path, value)
+                timing.count(cells=numpy.size(value), bytesRead=sum(array.nbytes for array in arrays),
+                             bytesWritten=numpy.asarray(value).nbytes)
+            self.rebuilt.append(name)
+        self.values[name] = numpy.load(path, mmap_mode="r")
+        return self.values[name]
+
+    def _store(self, path, value):
+        temporary = "%s.%d.tmp.npy" % (path[:-4], os.getpid())
+        numpy.save(temporary, numpy.ascontiguousarray(value))
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # another run stored the same node first
+            os.remove(temporary)
+
+    def run(self, targets):
+        values = [self.get(target) for target in targets]
+        self.evict()
+        return values
+
+    def evict(self):
+        # Deletes least recently used stored nodes, except the ones this run
+        # used, until the folder fits maxBytes
+        inUse = set(os.path.basename(self._path(name)) for name in self.nodes if name in self.values)
+        files = []
+        for fileName in os.listdir(self.folder):
+            path = os.path.join(self.folder, fileName)
+            if fileName.endswith(".npy") and ".tmp" not in fileName:
+                files.append((os.path.getmtime(path), os.path.getsize(path), fileName))
+        total = sum(size for used, size, fileName in files)
+        for used, size, fileName in sorted(files):
+            if total <= self.maxBytes:
+                break
+            if fileName in inUse:
+                continue
+            try:
+                os.remove(os.path.join(self.folder, fileName))
+            except OSError:
+                # still mapped by another run (Windows)
+                continue
+            total -= size
+
+
+def _unitMask(mask):
+    # 0 * mask + 1: a factor of 1 inside the AOI and NoData outside
+    return mask * 0.0 + 1.0
+
+
+def codeFactorNodes(pipeline, name, fingerprint, computeCodes, lut, window):
+    # Adds a categorical factor as two nodes: name + "Codes", the code
+    # raster computeCodes() returns (burned once per fingerprint and
+    # window), and name, lut[codes] as float32
+    codesName = name + "Codes"
+    pipeline.node(codesName, computeCodes, (), (fingerprint, repr(window.key())))
+    lut = numpy.asarray(lut, dtype=numpy.float32)
+
+    def gather(codes):
+        return lut[codes]
+
+    pipeline.node(name, gather, [codesName], (arrayDigest(lut),))
+
+
+def ccmPipeline(pipeline, dem, window, params, factors=(), mask=None, codeFactors=()):
+    # Adds the CCM stages to pipeline and returns it.
+    #
+    # dem: the DEM window read with params.halo cells around it.
+    # factors: (name, fingerprint, compute) of the F3..Fn rasters on the
+    # window; compute() is only called when fingerprint is not stored.
+    # mask: optional AOI mask on the window (NoData outside the AOI).
+    # codeFactors: (name, fingerprint, computeCodes, lut) of categorical
+    # factors added with codeFactorNodes.
+    halo = params.halo
+    cellWidth, cellHeight = window.metricCellSizes(halo)
+    pipeline.source("dem", dem, arrayDigest(dem) + repr(window.key()))
+
+    def slope(dem):
+        slope = terrain.slopePercent(dem, cellWidth, cellHeight, params.zFactor, params.edge)
+        return engine.crop(slope, halo)
+
+    def clamp(slope):
+        return engine.clampSlope(slope, params.maxSlope)
+
+    def f1(clamped):
+        return engine.f1FromSlope(clamped, params.maxSlope, params.speedOverWeight).astype(numpy.float32)
+
+    def curvature(dem):
+        return terrain.curvature(dem, cellWidth, cellHeight, params.zFactor, params.edge)
+
+    def focalRange(curv):
+        return terrain.focalRangeMax(curv, params.focalRadius, halo)[0]
+
+    def f2(rng):
+        focalMax = numpy.nan
+        if not numpy.isnan(rng).all():
+            focalMax = numpy.nanmax(rng)
+        return engine.f2FromRange(rng, focalMax).astype(numpy.float32)
+
+    pipeline.node("slope", slope, ["dem"], (params.zFactor, params.edge, halo, cache.ALGORITHM))
+    pipeline.node("clamp", clamp, ["slope"], (params.maxSlope,))
+    pipeline.node("f1", f1, ["clamp"], (params.maxSlope, params.speedOverWeight))
+    pipeline.node("curvature", curvature, ["dem"], (params.zFactor, params.edge, cache.ALGORITHM))
+    pipeline.node("focalRange", focalRange, ["curvature"], (params.focalRadius, halo, cache.ALGORITHM))
+    pipeline.node("f2", f2, ["focalRange"])
+
+    names = ["f1", "f2"]
+    for name, fingerprint, compute in factors:
+        pipeline.node(name, compute, (), (fingerprint, repr(window.key())))
+        names.append(name)
+    for name, fingerprint, computeCodes, lut in codeFactors:
+        codeFactorNodes(pipeline, name, fingerprint, computeCodes, lut, window)
+        names.append(name)
+    if mask is not None:
+        pipeline.source("mask", mask)
+        pipeline.node("unitMask", _unitMask, ["mask"])
+        names.append("unitMask")
+
+    def product(*blocks):
+        return engine.productBlock(list(blocks))
+
+    pipeline.node("ccm", product, names)
+    return pipeline
@@ -0,0 +1,305 @@
+# ==================================================
+# profiling.py
+# --------------------------------------------------
+# Per-stage timing of the CCM runs.
+# --------------------------------------------------
+#
+# A Profiler records one entry per stage run: wall time, CPU time (of this
+# process and the worker processes it has waited for), cells processed,
+# bytes read and written (of the arrays moved in and out of the stage) and
+# the peak resident memory of the process when the stage ended.  Stages
+# are
+#
+#   begin(name) / end()     markers in a script: begin ends the stage the
+#                           previous begin opened
+#   with stage(name):       a block, inside the engine
+#   ProfiledSource / Sink   every read / write of a tiling source or sink
+#
+# and are given cells and bytes as they go (count).  summary() adds up
+# the entries by stage name into a table (the time of a stage includes the
+# stages run inside it); writeTrace() saves them as a Chrome trace
+# (chrome://tracing, ui.perfetto.dev), one slice per entry, nested by time,
+# with the totals under otherData.
+#
+# The engine reports to the profiler set with start(); without one every
+# call is a no-op, so the instrumentation costs nothing when it is off.
+#
+# ==================================================
+
+import json
+import os
+import sys
+import threading
+import time
+
+
+# wall clock: time.clock is the precise one on Windows under Python 2
+_clock = time.perf_counter if hasattr(time, "perf_counter") else (
+    time.clock if sys.platform == "win32" else time.time)
+
+
+def cpuTime():
+    # CPU seconds of this process and its waited-for children
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
+def peakRSS():
+    # Peak resident memory of the process in bytes, None when unknown
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t), ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Entry(object):
+    # One run of a stage
+
+    def __init__(self, name, start, cpu):
+        self.name = name
+        self.start = start
+        self.cpuStart = cpu
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.cells = 0
+        self.bytesRead = 0
+        self.bytesWritten = 0
+        self.peakRSS = None
+        self.thread = threading.current_thread().ident
+
+    def record(self):
+        return {"name": self.name, "start": self.start, "wall": self.wall, "cpu": self.cpu,
+                "cells": self.cells, "bytesRead": self.bytesRead, "bytesWritten": self.bytesWritten,
+                "peakRSS": self.peakRSS}
+
+
+class Profiler(object):
+
+    def __init__(self, name="CCM"):
+        self.name = name
+        self.origin = _clock()
+        self.entries = []
+        self.open = []
+        self.marker = None
+
+    def _open(self, name, cells=0):
+        entry = Entry(name, _clock() - self.origin, cpuTime())
+        entry.cells = cells
+        self.open.append(entry)
+        return entry
+
+    def _close(self, entry):
+        entry.wall = _clock() - self.origin - entry.start
+        entry.cpu = cpuTime() - entry.cpuStart
+        entry.peakRSS = peakRSS()
+        if entry in self.open:
+            self.open.remove(entry)
+        self.entries.append(entry)
+        return entry
+
+    def begin(self, name, cells=0):
+        # Starts a script stage, ending the one the previous begin started
+        self.end()
+        self.marker = self._open(name, cells)
+        return self.marker
+
+    def end(self):
+        if self.marker is not None:
+            self._close(self.marker)
+            self.marker = None
+
+    def stage(self, name, cells=0):
+        return _Stage(self, name, cells)
+
+    def count(self, cells=0, bytesRead=0, bytesWritten=0):
+        # Adds to the innermost open stage
+        if self.open:
+            entry = self.open[-1]
+            entry.cells += cells
+            entry.bytesRead += bytesRead
+            entry.bytesWritten += bytesWritten
+
+    def totals(self):
+        # {name: record with calls} adding up the entries of each stage, in
+        # the order the stages first ran
+        totals = {}
+        order = []
+        for entry in sorted(self.entries, key=lambda e: e.start):
+            total = totals.get(entry.name)
+            if total is None:
+                total = totals[entry.name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "cells": 0,
+                                              "bytesRead": 0, "bytesWritten": 0, "peakRSS": None}
+                order.append(entry.name)
+            total["calls"] += 1
+            for key in ("wall", "cpu", "cells", "bytesRead", "bytesWritten"):
+                total[key] += getattr(entry, key)
+            if entry.peakRSS is not None:
+                total["peakRSS"] = max(total["peakRSS"] or 0, entry.peakRSS)
+        return [(name, totals[name]) for name in order]
+
+    def summary(self):
+        # Lines of a table of the stage totals
+        lines = ["%-28s %6s %10s %10s %12s %10s %10s %10s %10s" % (
+            "stage", "calls", "wall s", "cpu s", "cells", "Mcells/s", "MB read", "MB written", "peak MB")]
+        for name, total in self.totals():
+            rate = total["cells"] / total["wall"] / 1e6 if total["wall"] > 0 and total["cells"] else 0.0
+            peak = "%10.1f" % (total["peakRSS"] / 1048576.0) if total["peakRSS"] is not None else "%10s" % "-"
+            lines.append("%-28s %6d %10.3f %10.3f %12d %10.2f %10.1f %10.1f %s" % (
+                name[:28], total["calls"], total["wall"], total["cpu"], total["cells"], rate,
+                total["bytesRead"] / 1048576.0, total["bytesWritten"] / 1048576.0, peak))
+        return lines
+
+    def trace(self):
+        # Chrome trace events ("X" slices in microseconds)
+        pid = os.getpid()
+        threads = {}
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.name}}]
+        for entry in sorted(self.entries, key=lambda e: (e.start, -e.wall)):
+            tid = threads.setdefault(entry.thread, len(threads))
+            args = entry.record()
+            del args["name"], args["start"], args["wall"]
+            events.append({"name": entry.name, "cat": "ccm", "ph": "X", "pid": pid, "tid": tid,
+                           "ts": round(entry.start * 1e6, 3), "dur": round(entry.wall * 1e6, 3), "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"profiler": self.name, "stages": [dict(t, name=n) for n, t in self.totals()]}}
+
+    def writeTrace(self, path):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, "w") as handle:
+            json.dump(self.trace(), handle)
+        return path
+
+
+class _Stage(object):
+
+    def __init__(self, profiler, name, cells):
+        self.profiler = profiler
+        self.name = name
+        self.cells = cells
+        self.entry = None
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.entry = self.profiler._open(self.name, self.cells)
+        return self
+
+    def count(self, cells=0, bytesRead=0, bytesWritten=0):
+        if self.entry is not None:
+            self.entry.cells += cells
+            self.entry.bytesRead += bytesRead
+            self.entry.bytesWritten += bytesWritten
+
+    def __exit__(self, kind, value, tb):
+        if self.entry is not None:
+            self.profiler._close(self.entry)
+        return False
+
+
+# The profiler the engine reports to
+_current = None
+
+
+def start(name="CCM"):
+    # Makes a new Profiler the current one and returns it
+    global _current
+    _current = Profiler(name)
+    return _current
+
+
+def stop():
+    # Ends the open script stage and detaches the current profiler
+    global _current
+    profiler = _current
+    if profiler is not None:
+        profiler.end()
+    _current = None
+    return profiler
+
+
+def current():
+    return _current
+
+
+def stage(name, cells=0):
+    # with stage(name) as s: ... s.count(cells=...) on the current profiler
+    return _Stage(_current, name, cells)
+
+
+class ProfiledSource(object):
+    # Times the reads of a tiling source as stage name
+
+    def __init__(self, source, name, profiler):
+        self.source = source
+        self.name = name
+        self.profiler = profiler
+        self.grid = getattr(source, "grid", None)
+
+    def __getstate__(self):
+        # reads in worker processes are not recorded
+        state = self.__dict__.copy()
+        state["profiler"] = None
+        return state
+
+    def read(self, window):
+        with _Stage(self.profiler, self.name, 0) as timing:
+            block = self.source.read(window)
+            timing.count(cells=block.size, bytesRead=block.nbytes)
+        return block
+
+
+class ProfiledSink(object):
+    # Times the writes (and the close) of a tiling sink as stage name
+
+    def __init__(self, sink, name, profiler):
+        self.sink = sink
+        self.name = name
+        self.profiler = profiler
+
+    def write(self, row0, col0, block):
+        with _Stage(self.profiler, self.name, 0) as timing:
+            self.sink.write(row0, col0, block)
+            timing.count(cells=block.size, bytesWritten=block.nbytes)
+
+    def close(self):
+        with _Stage(self.profiler, self.name, 0):
+            return self.sink.close()
+
+    def __getattr__(self, name):
+        # statistics() and the like of the wrapped sink
+        return getattr(self.sink, name)
+
+
+def source(source, name):
+    # source timed on the current profiler, or source itself without one
+    if _current is None:
+        return source
+    return ProfiledSource(source, name, _current)
+
+
+def sink(sink, name):
+    if _current is None:
+        return sink
+    return ProfiledSink(sink, name, _current)
@@ -0,0 +1,200 @@
+# ==================================================
+# quantize.py
+# --------------------------------------------------
+# Compact storage of the CCM factors and product.
+# --------------------------------------------------
+#
+# A float raster v is stored as
+#
+#   uint8 / uint16  code = round((v - offset) / scale), codes 0..254 or
+#                   0..65534, the top code (255 or 65535) being NoData
+#   float16         (v - offset) / scale, NaN being NoData
+#
+# and read back as offset + code * scale.  forRange picks the scale that
+# spans [lower, upper] with all the codes, which bounds the error of any
+# value in the range:
+#
+#   uint8    scale / 2 = (upper - lower) / 508
+#   uint16   scale / 2 = (upper - lower) / 131068
+#   float16  scale * 2**-12 = (upper - lower) / 4096 (half a unit in the
+#            last place of a value in [0.5, 1]; less further down)
+#
+# (maxError).  Values beyond the range are clipped to it.  The CCM factors
+# are ratios of a few significant digits, so uint16 keeps them well inside
+# the precision of their inputs, at half the size of float32; uint8 is a
+# quarter of the size and keeps 1/254 of the range.
+#
+# The scale and offset of a raster written by the toolbox are kept in a
+# JSON file next to it (sidecarPath), which the arcpyio readers apply, so
+# the engine always sees the decoded values.
+#
+# ==================================================
+
+import json
+import os
+
+import numpy
+
+
+TYPES = ("uint8", "uint16", "float16")
+
+
+class Quantization(object):
+
+    def __init__(self, dtype, scale=1.0, offset=0.0):
+        if dtype not in TYPES:
+            raise ValueError("Unknown quantized type %r, not one of %s" % (dtype, ", ".join(TYPES)))
+        self.dtype = dtype
+        self.scale = float(scale)
+        self.offset = float(offset)
+
+    def __repr__(self):
+        return "Quantization(%r, scale=%r, offset=%r)" % (self.dtype, self.scale, self.offset)
+
+    @property
+    def integer(self):
+        return self.dtype != "float16"
+
+    @property
+    def noData(self):
+        # the stored NoData value
+        if self.integer:
+            return numpy.iinfo(self.dtype).max
+        return numpy.nan
+
+    @property
+    def levels(self):
+        # largest data code (integer types); 1.0 for float16
+        if self.integer:
+            return numpy.iinfo(self.dtype).max - 1
+        return 1.0
+
+    @property
+    def upper(self):
+        # largest value the codes hold, the upper of forRange
+        return self.offset + self.levels * self.scale
+
+    @classmethod
+    def forRange(cls, dtype, lower, upper):
+        # Quantization spanning [lower, upper]
+        lower = float(lower)
+        upper = float(upper)
+        if not upper > lower:
+            upper = lower + 1.0
+        quantization = cls(dtype, offset=lower)
+        quantization.scale = (upper - lower) / quantization.levels
+        return quantization
+
+    @classmethod
+    def fit(cls, dtype, values):
+        # Quantization spanning the finite values of an array
+        values = numpy.asarray(values)
+        finite = values[numpy.isfinite(values)]
+        if finite.size == 0:
+            return cls(dtype)
+        return cls.forRange(dtype, finite.min(), finite.max())
+
+    @property
+    def maxError(self):
+        # Largest difference between a value in the range and its decoding
+        if self.integer:
+            return self.scale / 2.0
+        return self.scale * 2.0 ** -12
+
+    def encode(self, values):
+        # Stored array of values (NaN as NoData)
+        values = numpy.asarray(values, dtype=numpy.float64)
+        missing = numpy.isnan(values)
+        scaled = numpy.clip((values - self.offset) / self.scale, 0.0, self.levels)
+        if self.integer:
+            codes = numpy.rint(numpy.where(missing, 0.0, scaled)).astype(self.dtype)
+            codes[missing] = self.noData
+            return codes
+        scaled[missing] = numpy.nan
+        return scaled.astype(numpy.float16)
+
+    def decode(self, codes, out=None):
+        # float64 values of a stored array, NaN for NoData
+        codes = numpy.asarray(codes)
+        values = codes.astype(numpy.float64)
+        if self.integer:
+            values[codes == self.noData] = numpy.nan
+        values *= self.scale
+        values += self.offset
+        if out is not None:
+            out[...] = values
+            return out
+        return values
+
+    def metadata(self):
+        return {"dtype": self.dtype, "scale": self.scale, "offset": self.offset,
+                "noData": None if not self.integer else int(self.noData), "maxError": self.maxError}
+
+
+def sidecarPath(rasterPath):
+    # JSON file holding the quantization of a raster: beside a file raster,
+    # beside the geodatabase for a raster stored in one
+    folder, name = os.path.split(rasterPath)
+    if folder.lower().endswith(".gdb"):
+        return os.path.join(os.path.dirname(folder), "%s.%s.quantization.json" % (os.path.basename(folder), name))
+    return rasterPath + ".quantization.json"
+
+
+def writeSidecar(rasterPath, quantization):
+    path = sidecarPath(rasterPath)
+    if quantization is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    handle = open(path, "w")
+    try:
+        json.dump(quantization.metadata(), handle)
+    finally:
+        handle.close()
+    return path
+
+
+def readSidecar(rasterPath):
+    # Quantization of a raster, or None when it holds plain values
+    if not rasterPath:
+        return None
+    path = sidecarPath(rasterPath)
+    if not os.path.exists(path):
+        return None
+    handle = open(path)
+    try:
+        info = json.load(handle)
+    finally:
+        handle.close()
+    return Quantization(info["dtype"], info["scale"], info["offset"])
+
+
+class QuantizedSink(object):
+    # Passes blocks on to sink encoded with quantization
+
+    def __init__(self, sink, quantization):
+        self.sink = sink
+        self.quantization = quantization
+
+    def write(self, row0, col0, block):
+        self.sink.write(row0, col0, self.quantization.encode(block))
+
+    def close(self):
+        return self.sink.close()
+
+
+class QuantizedSource(object):
+    # Decodes the blocks a source of stored codes reads.  The source must
+    # read its codes as they are stored, e.g. a tiling.NpySource.
+
+    def __init__(self, source, quantization):
+        self.source = source
+        self.quantization = quantization
+        self.grid = getattr(source, "grid", None)
+
+    def read(self, window):
+        block = self.source.read(window)
+        missing = numpy.isnan(block)
+        values = self.quantization.decode(numpy.where(missing, 0, block).astype(self.quantization.dtype))
+        values[missing] = numpy.nan
+        return values
@@ -0,0 +1,199 @@
+# ==================================================
+# rasterize.py
+# --------------------------------------------------
+# Scanline polygon burner for the categorical CCM factors.
+# --------------------------------------------------
+#
+# Replaces Clip_analysis -> JoinField_management -> PolygonToRaster_conversion
+# -> Con(IsNull(...), constNoEffect, ...) for F3 (vegetation), F4 (soils) and
+# F5 (surface roughness).  Polygons are burned onto the DEM window as small
+# integer code indexes, and the parameter table is applied afterwards as a
+# NumPy lookup array (lut[index]), so neither a clipped nor a joined copy of
+# the features is ever written.
+#
+# A cell takes a polygon's value when its centre lies inside the polygon
+# (even-odd rule over all rings, so holes stay empty), as PolygonToRaster
+# with CELL_CENTER.  Where polygons overlap the later object id wins.
+# Cells no polygon covers, codes missing from the table and NULL factors
+# take the fill value, which is 1.0 (no effect) for the CCM factors.
+#
+# codeRaster keeps the burn itself: a uint8 (uint16 past 255 codes) raster
+# of positions in the sorted codes of the parameter table, 0 where no code
+# of the table applies.  It depends on the features, the code field and
+# the table's codes only, so MIN/MAX, WET/DRY or an edited factor value is
+# one lut[codes] gather over a stored code raster (see
+# arcpyio.factorRasters and pipeline.ccmPipeline) with no vector work.
+#
+# ==================================================
+
+import math
+
+import numpy
+
+from . import filegdb
+from . import spatialindex
+
+
+def _crossings(parts, grid):
+    # (row, x) of every crossing of a row of cell centres by a ring edge
+    rows = []
+    xs = []
+    for ring in parts:
+        if len(ring) < 2:
+            continue
+        x0 = ring[:-1, 0]
+        y0 = ring[:-1, 1]
+        x1 = ring[1:, 0]
+        y1 = ring[1:, 1]
+        # Rows whose centre y (yMax - (row + 0.5) * cellHeight) lies in
+        # [min(y0, y1), max(y0, y1)): the half-open span counts a vertex on
+        # a centre line exactly once
+        low = numpy.minimum(y0, y1)
+        high = numpy.maximum(y0, y1)
+        first = numpy.floor((grid.yMax - high) / grid.cellHeight - 0.5).astype(numpy.int64) + 1
+        last = numpy.floor((grid.yMax - low) / grid.cellHeight - 0.5).astype(numpy.int64)
+        first = numpy.maximum(first, 0)
+        last = numpy.minimum(last, grid.nrows - 1)
+        counts = numpy.maximum(last - first + 1, 0)
+        if counts.sum() == 0:
+            continue
+        edge = numpy.repeat(numpy.arange(len(counts)), counts)
+        starts = numpy.cumsum(counts) - counts
+        row = first[edge] + numpy.arange(counts.sum()) - starts[edge]
+        yc = grid.yMax - (row + 0.5) * grid.cellHeight
+        t = (yc - y0[edge]) / (y1[edge] - y0[edge])
+        rows.append(row)
+        xs.append(x0[edge] + t * (x1[edge] - x0[edge]))
+    if not rows:
+        return None, None
+    return numpy.concatenate(rows), numpy.concatenate(xs)
+
+
+def polygonMask(parts, grid):
+    # (row0, row1, col0, col1, mask) of the cells of grid whose centres fall
+    # inside the polygon, or None when it covers no cell centre
+    rows, xs = _crossings(parts, grid)
+    if rows is None:
+        return None
+    order = numpy.lexsort((xs, rows))
+    rows = rows[order].reshape(-1, 2)
+    xs = xs[order].reshape(-1, 2)
+    row = rows[:, 0]
+    # cells whose centre x satisfies xa <= x < xb
+    col0 = numpy.ceil((xs[:, 0] - grid.xMin) / grid.cellWidth - 0.5).astype(numpy.int64)
+    col1 = numpy.ceil((xs[:, 1] - grid.xMin) / grid.cellWidth - 0.5).astype(numpy.int64)
+    col0 = numpy.clip(col0, 0, grid.ncols)
+    col1 = numpy.clip(col1, 0, grid.ncols)
+    keep = col1 > col0
+    if not keep.any():
+        return None
+    row, col0, col1 = row[keep], col0[keep], col1[keep]
+    r0 = int(row.min())
+    r1 = int(row.max()) + 1
+    c0 = int(col0.min())
+    c1 = int(col1.max())
+    diff = numpy.zeros((r1 - r0, c1 - c0 + 1), dtype=numpy.int32)
+    numpy.add.at(diff, (row - r0, col0 - c0), 1)
+    numpy.add.at(diff, (row - r0, col1 - c0), -1)
+    mask = numpy.cumsum(diff, axis=1)[:, :-1] > 0
+    return r0, r1, c0, c1, mask
+
+
+def burn(out, grid, parts, value):
+    # Sets the cells of out (on grid) whose centres fall inside the polygon
+    window = polygonMask(parts, grid)
+    if window is not None:
+        r0, r1, c0, c1, mask = window
+        out[r0:r1, c0:c1][mask] = value
+    return out
+
+
+def rasterizeCodes(polygons, grid):
+    # Burns (parts, code) pairs in order.  Returns (index, codes): an int32
+    # array of positions in codes, -1 where no polygon covers the cell.
+    index = numpy.full(grid.shape, -1, dtype=numpy.int32)
+    codes = []
+    positions = {}
+    for parts, code in polygons:
+        if code not in positions:
+            positions[code] = len(codes)
+            codes.append(code)
+        burn(index, grid, parts, positions[code])
+    return index, codes
+
+
+def lookupArray(codes, lookup, fill=1.0):
+    # Lookup array for rasterizeCodes output: lut[i] is the table value of
+    # codes[i] and lut[-1] (where index is -1) the fill value.  Codes
+    # missing from the table and NULL values take the fill value, as the
+    # Con(IsNull(...)) after JoinField/PolygonToRaster did.
+    lut = numpy.full(len(codes) + 1, fill, dtype=numpy.float64)
+    for i, code in enumerate(codes):
+        value = lookup.get(code)
+        if value is not None and not (isinstance(value, float) and math.isnan(value)):
+            lut[i] = value
+    return lut
+
+
+def codeType(count):
+    # Smallest unsigned type holding positions 0..count
+    for dtype in (numpy.uint8, numpy.uint16, numpy.uint32):
+        if count <= numpy.iinfo(dtype).max:
+            return dtype
+    raise ValueError("Too many codes: %d" % count)
+
+
+def tableCodes(lookups):
+    # Sorted codes of one or more lookup dicts (code -> factor)
+    codes = set()
+    for lookup in lookups:
+        codes.update(code for code in lookup if code is not None)
+    return sorted(codes)
+
+
+def codeRaster(polygons, grid, tableCodes):
+    # Burns (parts, code) pairs in order into positions 1..n of tableCodes,
+    # 0 where no polygon covers the cell or its code is not in tableCodes
+    index, codes = rasterizeCodes(polygons, grid)
+    positions = dict((code, i + 1) for i, code in enumerate(tableCodes))
+    dtype = codeType(len(tableCodes))
+    remap = numpy.array([positions.get(code, 0) for code in codes] + [0], dtype=dtype)
+    return remap[index]
+
+
+def codeLookup(tableCodes, lookup, fill=1.0):
+    # Lookup array for codeRaster output: lut[i + 1] is the factor of
+    # tableCodes[i] and lut[0] the fill value, which NULL factors take too
+    lut = numpy.full(len(tableCodes) + 1, fill, dtype=numpy.float64)
+    for i, code in enumerate(tableCodes):
+        value = lookup.get(code)
+        if value is not None and not (isinstance(value, float) and math.isnan(value)):
+            lut[i + 1] = value
+    return lut
+
+
+def tablePolygons(table, codeField, extent):
+    # (parts, code) of the polygons of a feature class whose bounding boxes
+    # meet extent, in object id order
+    field = table.field(table.geometryField)
+    for oid in spatialindex.query(table, extent):
+        row = table.readRow(int(oid), [codeField, table.geometryField])
+        geometry = filegdb.decodeGeometry(field, row[table.geometryField])
+        if geometry is None or geometry.shapeType != filegdb.POLYGON:
+            continue
+        if spatialindex.intersects(geometry.extent, extent):
+            yield geometry.parts, row[codeField]
+
+
+def rasterizeFactor(table, codeField, lookup, grid, fill=1.0, dtype=numpy.float32):
+    # Factor raster on grid: the polygons of table burned by codeField, with
+    # the codes looked up in lookup (code -> factor, see params.lookupTable)
+    return rasterizeFactors(table, codeField, [lookup], grid, fill, dtype)[0]
+
+
+def rasterizeFactors(table, codeField, lookups, grid, fill=1.0, dtype=numpy.float32):
+    # rasterizeFactor for several lookups (e.g. f3max and f3min) from one
+    # burn of the polygons
+    codes = tableCodes(lookups)
+    burned = codeRaster(tablePolygons(table, codeField, grid.extent), grid, codes)
+    return [codeLookup(codes, lookup, fill).astype(dtype)[burned] for lookup in lookups]
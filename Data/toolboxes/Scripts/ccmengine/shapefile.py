@@ -0,0 +1,122 @@
+# ==================================================
+# shapefile.py
+# --------------------------------------------------
+# Streaming writer for polygon shapefiles.
+# --------------------------------------------------
+#
+# A shapefile NAME is written as three files (and a fourth for the
+# coordinate system):
+#
+#   NAME.shp  100 byte header, then one record per feature: a big-endian
+#             record number and length (16 bit words), then shape type 5,
+#             the bounding box, the part and point counts, the index of the
+#             first point of every part and the points as little-endian
+#             doubles
+#   NAME.shx  the same header, then the offset and length of every record
+#   NAME.dbf  dBASE III table of the attributes, one fixed-width text
+#             record per feature
+#   NAME.prj  the coordinate system as ESRI WKT, when given
+#
+# Features are written as they come; only the counts and the bounding box
+# are kept, and the headers are filled in on close.  Polygon rings are
+# clockwise, holes counter-clockwise, each closed by repeating its first
+# point.
+#
+# ==================================================
+
+import os
+import struct
+import time
+
+import numpy
+
+
+POLYGON = 5
+
+
+class ShapefileWriter(object):
+    # fields: (name, type, width, decimals) with type "N" (number), "F"
+    # (float) or "C" (text); names are cut to 10 characters
+
+    def __init__(self, path, fields, projection=None):
+        base = os.path.splitext(path)[0]
+        self.path = base + ".shp"
+        self.fields = [(name[:10], kind, width, decimals) for name, kind, width, decimals in fields]
+        self.shp = open(base + ".shp", "wb")
+        self.shx = open(base + ".shx", "wb")
+        self.dbf = open(base + ".dbf", "wb")
+        self.shp.write(b"\0" * 100)
+        self.shx.write(b"\0" * 100)
+        self.dbf.write(b"\0" * self._dbfHeaderSize())
+        if projection:
+            with open(base + ".prj", "w") as prj:
+                prj.write(projection)
+        self.count = 0
+        self.offset = 50
+        self.box = [numpy.inf, numpy.inf, -numpy.inf, -numpy.inf]
+
+    def _dbfHeaderSize(self):
+        return 32 + 32 * len(self.fields) + 1
+
+    def write(self, parts, record):
+        # parts: sequence of (n, 2) arrays of x, y, each closed; record: the
+        # field values in order
+        parts = [numpy.asarray(part, dtype="<f8") for part in parts]
+        points = numpy.concatenate(parts) if parts else numpy.zeros((0, 2), dtype="<f8")
+        if points.size:
+            box = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+        else:
+            box = (0.0, 0.0, 0.0, 0.0)
+        starts = numpy.cumsum([0] + [len(part) for part in parts[:-1]]).astype("<i4")
+        content = struct.pack("<i4d2i", POLYGON, box[0], box[1], box[2], box[3], len(parts), len(points))
+        content += starts.tobytes() + points.tobytes()
+        self.count += 1
+        length = len(content) // 2
+        self.shp.write(struct.pack(">2i", self.count, length))
+        self.shp.write(content)
+        self.shx.write(struct.pack(">2i", self.offset, length))
+        self.offset += 4 + length
+        if points.size:
+            self.box = [min(self.box[0], box[0]), min(self.box[1], box[1]),
+                        max(self.box[2], box[2]), max(self.box[3], box[3])]
+
+        row = [b" "]
+        for (name, kind, width, decimals), value in zip(self.fields, record):
+            if kind == "C":
+                text = (u"%s" % ("" if value is None else value)).encode("latin-1", "replace")[:width]
+                row.append(text.ljust(width))
+            else:
+                if value is None or (isinstance(value, float) and numpy.isnan(value)):
+                    text = b""
+                elif decimals:
+                    text = (u"%.*f" % (decimals, value)).encode("ascii")
+                else:
+                    text = (u"%d" % int(value)).encode("ascii")
+                row.append(text[:width].rjust(width))
+        self.dbf.write(b"".join(row))
+
+    def _header(self, length):
+        box = self.box if self.count and numpy.isfinite(self.box[0]) else [0.0, 0.0, 0.0, 0.0]
+        return (struct.pack(">7i", 9994, 0, 0, 0, 0, 0, length) +
+                struct.pack("<2i", 1000, POLYGON) + struct.pack("<8d", box[0], box[1], box[2], box[3], 0, 0, 0, 0))
+
+    def close(self):
+        self.shp.seek(0)
+        self.shp.write(self._header(self.offset))
+        self.shx.seek(0)
+        self.shx.write(self._header(50 + 4 * self.count))
+        self.shp.close()
+        self.shx.close()
+
+        recordSize = 1 + sum(width for name, kind, width, decimals in self.fields)
+        today = time.localtime()
+        header = struct.pack("<4BIHH20x", 3, today.tm_year - 1900, today.tm_mon, today.tm_mday, self.count,
+                             self._dbfHeaderSize(), recordSize)
+        for name, kind, width, decimals in self.fields:
+            header += struct.pack("<11sc4xBB14x", name.encode("ascii"), kind.encode("ascii"), width, decimals)
+        header += b"\r"
+        self.dbf.write(b"\x1a")
+        self.dbf.seek(0)
+        self.dbf.write(header)
+        self.dbf.close()
+        return self.path
@@ -0,0 +1,102 @@
+# ==================================================
+# spatialindex.py
+# --------------------------------------------------
+# Bounding box queries on feature classes through their .spx files.
+# --------------------------------------------------
+#
+# The .spx of a File Geodatabase feature class is a B-tree with the same
+# page layout as an .atx attribute index (filegdb.AttributeIndex).  Each
+# feature is entered once for every cell of the spatial index grid its
+# bounding box covers, keyed by the int64
+#
+#   ((floor(x / gridSize) + 2**29) << 31) | (floor(y / gridSize) + 2**29)
+#
+# so the cells of one grid column form a contiguous run of keys.  A query
+# reads one key range per grid column of the box, then drops the
+# candidates whose own bounding box misses it.  The work is proportional
+# to the features near the box, not to the size of the layer.
+#
+# Only single-level grids with a positive size are read from the index
+# (most CCM layers use one; zonesofentry and mobilitycorridors store a size
+# of 0); other feature classes fall back to testing every bounding box.
+#
+# ==================================================
+
+import math
+import os
+
+import numpy
+
+from . import filegdb
+
+
+_OFFSET = 1 << 29
+
+
+class SpatialIndex(object):
+
+    def __init__(self, table):
+        self.table = table
+        field = table.field(table.geometryField)
+        self.gridSize = field.gridSizes[0]
+        self.index = filegdb.AttributeIndex(table.path + ".spx", filegdb.INT64)
+
+    def close(self):
+        self.index.close()
+
+    def _cell(self, value):
+        return int(math.floor(value / self.gridSize)) + _OFFSET
+
+    def query(self, extent):
+        # Object ids (sorted int64 array) of the features entered in the
+        # grid cells that overlap extent (xmin, ymin, xmax, ymax)
+        xmin, ymin, xmax, ymax = extent
+        row0 = self._cell(ymin)
+        row1 = self._cell(ymax)
+        oids = []
+        for col in range(self._cell(xmin), self._cell(xmax) + 1):
+            oids.extend(self.index.range((col << 31) | row0, (col << 31) | row1))
+        return numpy.unique(numpy.array(oids, dtype=numpy.int64))
+
+
+def openIndex(table):
+    # SpatialIndex of a feature class, or None if it has no usable .spx
+    if table.geometryField is None or not os.path.exists(table.path + ".spx"):
+        return None
+    gridSizes = table.field(table.geometryField).gridSizes
+    if len(gridSizes) != 1 or gridSizes[0] <= 0:
+        # several levels, or no grid at all (some layers store a size of 0)
+        return None
+    return SpatialIndex(table)
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def query(table, extent):
+    # Object ids (sorted int64 array) of the features the spatial index puts
+    # near extent, or of every feature when there is no usable index.  The
+    # bounding boxes of the features still have to be tested.
+    index = openIndex(table)
+    if index is None:
+        return table.objectIds()
+    try:
+        return index.query(extent)
+    finally:
+        index.close()
+
+
+def candidates(table, extent):
+    # Object ids (sorted int64 array) of the features whose bounding box
+    # meets extent (xmin, ymin, xmax, ymax)
+    field = table.field(table.geometryField)
+    keep = []
+    for oid in query(table, extent):
+        blob = table.readRow(int(oid), [table.geometryField])[table.geometryField]
+        if blob is None:
+            continue
+        box = filegdb.geometryExtent(field, blob)
+        if box is not None and intersects(box, extent):
+            keep.append(oid)
+    return numpy.array(keep, dtype=numpy.int64)
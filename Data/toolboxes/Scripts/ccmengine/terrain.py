@@ -0,0 +1,237 @@
+# ==================================================
+# terrain.py
+# --------------------------------------------------
+# NumPy terrain kernels for the CCM engine.
+# --------------------------------------------------
+#
+# The kernels reproduce the Spatial Analyst tools the CCM scripts used to
+# call (sa.Slope with PERCENT_RISE, sa.Curvature, FocalStatistics RANGE),
+# working on in-memory arrays.  NoData is carried as NaN.  As in Spatial
+# Analyst, a cell whose centre is NoData is NoData in the output, and by
+# default a NoData neighbour (including the cells beyond the edge of the
+# array) takes the value of the centre cell; see EDGES for the other
+# choices.  surfaceDerivatives gives slope and the curvatures from one
+# read of the 3x3 neighbourhood, so the terrain stage reads the DEM once.
+#
+# The cell width and height may be numbers or (rows, 1) columns with one
+# value per row of the DEM (Grid.metricCellSizes), which gives metric
+# slope and curvature on geographic DEMs, where the ground width of a cell
+# shrinks with latitude.
+#
+# ==================================================
+
+import numpy
+
+
+# Edge handling of the 3x3 stencil:
+#   "centre"  NoData neighbours and cells beyond the edge take the centre
+#             value (Spatial Analyst)
+#   "nearest" NoData neighbours and cells beyond the edge take the nearest
+#             neighbour with data: a corner falls back on the side
+#             neighbour in its row, then the one in its column, then the
+#             centre; a side neighbour on the centre
+#   "nodata"  a cell with any NoData neighbour, or on the edge, is NoData
+EDGES = ("centre", "nearest", "nodata")
+
+
+def neighbourhood(dem, edge="centre"):
+    # Returns the nine shifted views z1..z9 of the 3x3 neighbourhood of every
+    # cell, numbered row by row from the upper left:
+    #
+    #     z1 z2 z3
+    #     z4 z5 z6
+    #     z7 z8 z9
+    #
+    # Missing neighbours are filled as edge (see EDGES) says.
+    if edge not in EDGES:
+        raise ValueError("edge must be one of %s, not %r" % (", ".join(EDGES), edge))
+    dem = numpy.asarray(dem, dtype=numpy.float64)
+    nrows, ncols = dem.shape
+    # cells beyond the edge are NoData like the rest, so a tile read with a
+    # NoData halo past the raster gives the same values as the whole array
+    padded = numpy.pad(dem, 1, mode="constant", constant_values=numpy.nan)
+    z5 = dem
+    views = []
+    for dr in (0, 1, 2):
+        for dc in (0, 1, 2):
+            view = padded[dr:dr + nrows, dc:dc + ncols]
+            if dr == 1 and dc == 1:
+                views.append(z5)
+                continue
+            if edge != "nodata":
+                fills = [z5]
+                if edge == "nearest" and dr != 1 and dc != 1:
+                    fills = [padded[1:1 + nrows, dc:dc + ncols], padded[dr:dr + nrows, 1:1 + ncols], z5]
+                for fill in fills:
+                    missing = numpy.isnan(view)
+                    if not missing.any():
+                        break
+                    view = numpy.where(missing, fill, view)
+            views.append(view)
+    return views
+
+
+SURFACES = ("slope", "curvature", "profile", "planform")
+
+
+def surfaceDerivatives(dem, cellWidth, cellHeight=None, zFactor=1.0, outputs=("slope", "curvature"),
+                       edge="centre"):
+    # Any of the SURFACES from one read of the 3x3 neighbourhood, as a dict:
+    #
+    #   slope      percent rise, Horn's method (sa.Slope "PERCENT_RISE")
+    #   curvature  total curvature of the Zevenbergen and Thorne surface
+    #              (sa.Curvature), -200 (D + E)
+    #   profile    curvature along the slope, -200 (D G^2 + E H^2 + F G H) / (G^2 + H^2)
+    #   planform   curvature across the slope, 200 (D H^2 + E G^2 - F G H) / (G^2 + H^2)
+    #
+    # Profile and planform are 0 on flat cells, as in sa.Curvature.
+    # cellWidth and cellHeight are numbers or per-row (rows, 1) columns.
+    if cellHeight is None:
+        cellHeight = cellWidth
+    for name in outputs:
+        if name not in SURFACES:
+            raise ValueError("Unknown surface %r" % name)
+    z1, z2, z3, z4, z5, z6, z7, z8, z9 = neighbourhood(dem, edge)
+    results = {}
+    if "slope" in outputs:
+        dzdx = ((z3 + 2.0 * z6 + z9) - (z1 + 2.0 * z4 + z7)) / (8.0 * cellWidth)
+        dzdy = ((z7 + 2.0 * z8 + z9) - (z1 + 2.0 * z2 + z3)) / (8.0 * cellHeight)
+        slope = numpy.hypot(dzdx, dzdy)
+        slope *= 100.0 * zFactor
+        slope[numpy.isnan(z5)] = numpy.nan
+        results["slope"] = slope
+    if "curvature" in outputs or "profile" in outputs or "planform" in outputs:
+        d = ((z4 + z6) / 2.0 - z5) / (cellWidth * cellWidth)
+        e = ((z2 + z8) / 2.0 - z5) / (cellHeight * cellHeight)
+    if "curvature" in outputs:
+        curv = d + e
+        curv *= -200.0 * zFactor
+        results["curvature"] = curv
+    if "profile" in outputs or "planform" in outputs:
+        f = (-z1 + z3 + z7 - z9) / (4.0 * cellWidth * cellHeight)
+        g = (-z4 + z6) / (2.0 * cellWidth)
+        h = (z2 - z8) / (2.0 * cellHeight)
+        gg = g * g
+        hh = h * h
+        fgh = f * g * h
+        norm = gg + hh
+        flat = norm == 0.0
+        norm[flat] = 1.0
+        if "profile" in outputs:
+            profile = d * gg + e * hh + fgh
+            profile *= -200.0 * zFactor
+            profile /= norm
+            profile[flat] = 0.0
+            results["profile"] = profile
+        if "planform" in outputs:
+            planform = d * hh + e * gg - fgh
+            planform *= 200.0 * zFactor
+            planform /= norm
+            planform[flat] = 0.0
+            results["planform"] = planform
+    return results
+
+
+def slopePercent(dem, cellWidth, cellHeight=None, zFactor=1.0, edge="centre"):
+    # Percent rise slope using Horn's 3x3 method, as sa.Slope(dem, "PERCENT_RISE").
+    return surfaceDerivatives(dem, cellWidth, cellHeight, zFactor, ("slope",), edge)["slope"]
+
+
+def curvature(dem, cellWidth, cellHeight=None, zFactor=1.0, edge="centre"):
+    # Total curvature of the fourth-order surface fitted to the 3x3
+    # neighbourhood (Zevenbergen and Thorne), as sa.Curvature(dem).
+    return surfaceDerivatives(dem, cellWidth, cellHeight, zFactor, ("curvature",), edge)["curvature"]
+
+
+def circleOffsets(radius):
+    # (dr, dc) offsets of the cells whose centres fall inside a circle of
+    # radius cells, as sa.NbrCircle(radius, "CELL")
+    offsets = []
+    for dr in range(-radius, radius + 1):
+        for dc in range(-radius, radius + 1):
+            if dr * dr + dc * dc <= radius * radius:
+                offsets.append((dr, dc))
+    return offsets
+
+
+def circleSpans(radius):
+    # The circle of circleOffsets as one run of cells per row: (dr, w)
+    # where the row dr covers the columns -w..w
+    widths = {}
+    for dr, dc in circleOffsets(radius):
+        widths[dr] = max(widths.get(dr, 0), dc)
+    return sorted(widths.items())
+
+
+def runExtrema(rows, lengths, function):
+    # function (numpy.fmax or numpy.fmin) over every run of each length in
+    # lengths along the rows: {length: array whose column s covers the
+    # columns s .. s + length - 1}.  Runs of 2**k cells are built by
+    # doubling, and a run of any other length is the overlap of the two
+    # power-of-two runs at its ends, so every length costs one more pass
+    # however long it is.
+    levels = [rows]
+    while 2 ** len(levels) <= max(lengths):
+        step = 2 ** (len(levels) - 1)
+        previous = levels[-1]
+        levels.append(function(previous[:, :-step], previous[:, step:]))
+    extrema = {}
+    for length in lengths:
+        k = len(levels) - 1
+        while 2 ** k > length:
+            k -= 1
+        count = rows.shape[1] - length + 1
+        level = levels[k]
+        shift = length - 2 ** k
+        if shift == 0:
+            extrema[length] = level[:, :count]
+        else:
+            extrema[length] = function(level[:, :count], level[:, shift:shift + count])
+    return extrema
+
+
+def focalRangeMax(values, radius=3, halo=0, chunkRows=256):
+    # sa.FocalStatistics(values, NbrCircle(radius, "CELL"), "RANGE") with
+    # NoData ignored, cropped by halo cells on every side, and the largest
+    # range in it (NaN if there is none).  Cells beyond the edge of the
+    # array do not take part.
+    #
+    # The circle is split into row spans (circleSpans).  The extrema of
+    # every span width along the rows come from runExtrema, and the spans
+    # are combined down the columns, so the work per cell grows with the
+    # radius rather than with its square.  Rows are swept in chunks and the
+    # maximum is taken while each chunk of the range is still in cache,
+    # which spares F2 a separate statistics pass.
+    values = numpy.asarray(values, dtype=numpy.float64)
+    nrows, ncols = values.shape
+    spans = circleSpans(radius)
+    lengths = sorted(set(2 * w + 1 for dr, w in spans))
+    outRows = max(nrows - 2 * halo, 0)
+    outCols = max(ncols - 2 * halo, 0)
+    result = numpy.empty((outRows, outCols))
+    maximum = numpy.nan
+    padded = numpy.pad(values, radius, mode="constant", constant_values=numpy.nan)
+    for row0 in range(0, outRows, chunkRows):
+        row1 = min(row0 + chunkRows, outRows)
+        # the padded rows of the chunk and the radius rows above and below it
+        rows = padded[halo + row0:halo + row1 + 2 * radius]
+        high = runExtrema(rows, lengths, numpy.fmax)
+        low = runExtrema(rows, lengths, numpy.fmin)
+        chunkHigh = numpy.full((row1 - row0, outCols), numpy.nan)
+        chunkLow = numpy.full((row1 - row0, outCols), numpy.nan)
+        for dr, w in spans:
+            # the run of 2w+1 cells centred on column c starts at padded column c + radius - w
+            col0 = halo + radius - w
+            r0 = radius + dr
+            numpy.fmax(chunkHigh, high[2 * w + 1][r0:r0 + row1 - row0, col0:col0 + outCols], out=chunkHigh)
+            numpy.fmin(chunkLow, low[2 * w + 1][r0:r0 + row1 - row0, col0:col0 + outCols], out=chunkLow)
+        chunk = numpy.subtract(chunkHigh, chunkLow, out=result[row0:row1])
+        if not numpy.isnan(chunk).all():
+            maximum = numpy.fmax(maximum, numpy.nanmax(chunk))
+    return result, float(maximum)
+
+
+def focalRange(values, radius=3):
+    # sa.FocalStatistics(values, NbrCircle(radius, "CELL"), "RANGE") with
+    # NoData ignored.  Cells beyond the edge of the array do not take part.
+    return focalRangeMax(values, radius)[0]
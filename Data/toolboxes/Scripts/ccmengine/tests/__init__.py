@@ -0,0 +1,2 @@
+# Tests of the CCM engine; they need NumPy but not arcpy.  From the Scripts
+# folder:  python -m unittest discover -s ccmengine/tests -t .
@@ -0,0 +1,98 @@
+import collections
+import unittest
+
+import numpy
+
+from ccmengine import corridors, tiling
+from ccmengine.grid import Grid
+
+
+def floodFill(mask):
+    # 8-connected labels by breadth-first search, numbered in row-major
+    # order of the first cell of each region
+    nrows, ncols = mask.shape
+    labels = numpy.zeros(mask.shape, dtype=numpy.int64)
+    count = 0
+    for row in range(nrows):
+        for col in range(ncols):
+            if not mask[row, col] or labels[row, col]:
+                continue
+            count += 1
+            labels[row, col] = count
+            queue = collections.deque([(row, col)])
+            while queue:
+                r, c = queue.popleft()
+                for dr in (-1, 0, 1):
+                    for dc in (-1, 0, 1):
+                        rr, cc = r + dr, c + dc
+                        if 0 <= rr < nrows and 0 <= cc < ncols and mask[rr, cc] and not labels[rr, cc]:
+                            labels[rr, cc] = count
+                            queue.append((rr, cc))
+    return labels, count
+
+
+class LabelTest(unittest.TestCase):
+
+    def test_matches_a_flood_fill(self):
+        rng = numpy.random.RandomState(1)
+        for fraction in (0.3, 0.5, 0.6, 0.8):
+            mask = rng.rand(60, 70) < fraction
+            labels, count = corridors.label(mask)
+            expected, expectedCount = floodFill(mask)
+            self.assertEqual(count, expectedCount)
+            numpy.testing.assert_array_equal(labels, expected)
+
+
+class DistanceTest(unittest.TestCase):
+
+    def test_matches_brute_force_up_to_the_cap(self):
+        rng = numpy.random.RandomState(2)
+        blocked = rng.rand(30, 40) < 0.05
+        rows, cols = numpy.nonzero(blocked)
+        r, c = numpy.mgrid[0:30, 0:40]
+        expected = numpy.sqrt(((r[..., None] - rows) * 12.0) ** 2 + ((c[..., None] - cols) * 10.0) ** 2).min(-1)
+        result = corridors.distanceToBlocked(blocked, 10.0, 12.0, 6)
+        numpy.testing.assert_allclose(result, numpy.minimum(expected, 60.0))
+
+
+class CorridorsTiledTest(unittest.TestCase):
+
+    def check(self, grid):
+        rng = numpy.random.RandomState(3)
+        ccm = rng.rand(*grid.shape)
+        ccm[rng.rand(*grid.shape) < 0.01] = numpy.nan
+        source = tiling.ArraySource(ccm, grid)
+        results = []
+        for tileSize in (0, 32, 50):
+            classes = tiling.ArraySink(grid, numpy.uint8)
+            widths = tiling.ArraySink(grid)
+            labels, stats = corridors.corridorsTiled(source, grid, 0.6, 0.3, minWidth=25.0, maxWidth=200.0,
+                                                     tileSize=tileSize, classSink=classes, widthSink=widths)
+            results.append((numpy.array(labels), stats, classes.array, widths.array))
+        labels, stats, classes, widths = results[0]
+        expected, count = floodFill(widths >= 25.0)
+        numpy.testing.assert_array_equal(labels, expected)
+        self.assertEqual(len(stats["cells"]) - 1, count)
+        for tiledLabels, tiledStats, tiledClasses, tiledWidths in results[1:]:
+            # tiled runs number the corridors in tile order: the same
+            # corridors, one to one, under other labels
+            pairs = set(zip(tiledLabels.ravel().tolist(), labels.ravel().tolist()))
+            self.assertEqual(len(pairs), count + 1)
+            self.assertEqual(len(set(tiled for tiled, whole in pairs)), count + 1)
+            self.assertIn((0, 0), pairs)
+            for tiled, whole in pairs:
+                self.assertEqual(tiledStats["cells"][tiled], stats["cells"][whole])
+                if tiled:
+                    self.assertAlmostEqual(tiledStats["meanWidth"][tiled], stats["meanWidth"][whole])
+            numpy.testing.assert_array_equal(tiledClasses, classes)
+            numpy.testing.assert_allclose(tiledWidths, widths)
+
+    def test_projected(self):
+        self.check(Grid(0.0, 45.0, 10.0, 10.0, 100, 120))
+
+    def test_geographic(self):
+        self.check(Grid(10.0, 45.0, 0.0001, 0.0001, 100, 120, geographic=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
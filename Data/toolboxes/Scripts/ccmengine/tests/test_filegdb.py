@@ -0,0 +1,66 @@
+import os
+import unittest
+
+import numpy
+
+from ccmengine import filegdb, params, spatialindex
+
+
+DATA = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", ".."))
+SUPPORTING = os.path.join(DATA, "SupportingData.gdb")
+MADERA = os.path.join(DATA, "MaderaEnvironment.gdb")
+
+
+class VarIntTest(unittest.TestCase):
+
+    def test_unsigned(self):
+        self.assertEqual(filegdb.readVarUInt(b"\x96\x01", 0), (150, 2))
+        self.assertEqual(filegdb.readVarUInt(b"\x00\x7f", 1), (127, 2))
+
+    def test_signed(self):
+        self.assertEqual(filegdb.readVarInt(b"\x41", 0), (-1, 1))
+        self.assertEqual(filegdb.readVarInt(b"\x85\x01", 0), (69, 2))
+        values, pos = filegdb.readVarInts(b"\x41\x85\x01", 0, 2)
+        self.assertEqual((values.tolist(), pos), ([-1, 69], 3))
+
+    def test_bits_least_significant_first(self):
+        bits = filegdb._bits(numpy.array([0x05, 0x01], dtype=numpy.uint8), 10)
+        self.assertEqual(bits.tolist(), [True, False, True, False, False, False, False, False, True, False])
+
+
+class TableTest(unittest.TestCase):
+
+    def test_vehicle_table(self):
+        table = filegdb.openTable(os.path.join(SUPPORTING, "maotVehicleParameters"))
+        self.assertIsNotNone(table)
+        columns = table.read(["name", "weight"], "classname = 'ATV'")
+        self.assertEqual(list(columns["name"]), [u"Generic ATV"])
+        self.assertEqual(columns["weight"].tolist(), [0.25])
+        self.assertEqual(len(table.objectIds()), 13)
+        table.close()
+
+    def test_convoy_statistics(self):
+        envelopes = params.convoyStatistics(os.path.join(SUPPORTING, "maotVehicleParameters"), [["HEMTT", "HMMWV"]])
+        self.assertEqual(envelopes[0][:2], (2.6, 32.0))
+
+    def test_polygons_and_spatial_index(self):
+        database = filegdb.Geodatabase(MADERA)
+        try:
+            aoi = database.table("madera_aoi").geometry(1)
+            self.assertEqual(aoi.shapeType, filegdb.POLYGON)
+            xmin, ymin, xmax, ymax = aoi.extent
+            for part in aoi.parts:
+                self.assertTrue((part[:, 0] >= xmin - 1e-6).all() and (part[:, 0] <= xmax + 1e-6).all())
+                self.assertTrue((part[:, 1] >= ymin - 1e-6).all() and (part[:, 1] <= ymax + 1e-6).all())
+            soils = database.table("soils")
+            field = soils.field(soils.geometryField)
+            box = (xmin, ymin, (xmin + xmax) / 2.0, (ymin + ymax) / 2.0)
+            expected = [oid for oid in soils.objectIds()
+                        if spatialindex.intersects(filegdb.geometryExtent(field, soils.readRow(int(oid))[soils.geometryField]), box)]
+            self.assertEqual(spatialindex.candidates(soils, box).tolist(), [int(oid) for oid in expected])
+        finally:
+            database.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import unittest
+
+import numpy
+
+from ccmengine import gdbraster
+
+
+MADERA = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..",
+                                       "MaderaEnvironment.gdb"))
+
+
+class RasterDatasetTest(unittest.TestCase):
+
+    def test_geographic_rasters(self):
+        for name, geographic in (("ccm_area", False), ("hillshade_clip", True), ("mad_roughness_clip", True)):
+            dataset = gdbraster.RasterDataset(MADERA, name)
+            try:
+                self.assertEqual(dataset.grid.geographic, geographic, name)
+            finally:
+                dataset.close()
+
+    def test_window_matches_whole_raster(self):
+        dataset = gdbraster.RasterDataset(MADERA, "ccm_area")
+        try:
+            whole = dataset.readAll()
+            window = dataset.grid.window(100, 37, 150, 200)
+            numpy.testing.assert_array_equal(dataset.read(window), whole[100:250, 37:237])
+        finally:
+            dataset.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
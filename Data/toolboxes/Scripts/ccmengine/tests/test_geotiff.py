@@ -0,0 +1,202 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy
+
+from ccmengine import geotiff, quantize, tiling
+from ccmengine.grid import Grid
+
+
+def lzwDecode(data):
+    # TIFF LZW: MSB first, 9 to 12 bit codes, early change
+    out = bytearray()
+    table = None
+    previous = None
+    width = 9
+    buffer = 0
+    bits = 0
+    for byte in bytearray(data):
+        buffer = (buffer << 8) | byte
+        bits += 8
+        while bits >= width:
+            bits -= width
+            code = buffer >> bits
+            buffer &= (1 << bits) - 1
+            if code == 257:
+                return bytes(out)
+            if code == 256:
+                table = [bytearray([i]) for i in range(256)] + [None, None]
+                previous = None
+                width = 9
+                continue
+            if previous is None:
+                entry = table[code]
+            elif code < len(table):
+                entry = table[code]
+                table.append(previous + entry[:1])
+            else:
+                entry = previous + previous[:1]
+                table.append(entry)
+            out += entry
+            previous = entry
+            if len(table) + 1 >= (1 << width) and width < 12:
+                width += 1
+    return bytes(out)
+
+
+def readTiff(path):
+    # [(tags, image)] for every IFD of a tiled, little-endian (Big)TIFF,
+    # read without the writer's code
+    handle = open(path, "rb")
+    try:
+        data = handle.read()
+    finally:
+        handle.close()
+    assert data[:2] == b"II"
+    big = struct.unpack("<H", data[2:4])[0] == 43
+    offset = struct.unpack("<Q", data[8:16])[0] if big else struct.unpack("<I", data[4:8])[0]
+    formats = {2: "s", 3: "H", 4: "I", 12: "d", 16: "Q"}
+    sizes = {2: 1, 3: 2, 4: 4, 12: 8, 16: 8}
+    levels = []
+    while offset:
+        if big:
+            count = struct.unpack("<Q", data[offset:offset + 8])[0]
+            entries, entrySize, inline = offset + 8, 20, 8
+        else:
+            count = struct.unpack("<H", data[offset:offset + 2])[0]
+            entries, entrySize, inline = offset + 2, 12, 4
+        tags = {}
+        for i in range(count):
+            entry = data[entries + i * entrySize:entries + (i + 1) * entrySize]
+            if big:
+                tag, kind, length = struct.unpack("<HHQ", entry[:12])
+                value = entry[12:]
+            else:
+                tag, kind, length = struct.unpack("<HHI", entry[:8])
+                value = entry[8:]
+            size = sizes[kind] * length
+            if size > inline:
+                at = struct.unpack("<Q" if big else "<I", value)[0]
+                value = data[at:at + size]
+            if kind == 2:
+                tags[tag] = value[:size].rstrip(b"\0").decode("ascii")
+            else:
+                tags[tag] = list(struct.unpack("<%d%s" % (length, formats[kind]), value[:size]))
+        end = entries + count * entrySize
+        offset = struct.unpack("<Q" if big else "<I", data[end:end + (8 if big else 4)])[0]
+        levels.append((tags, _image(data, tags)))
+    return levels
+
+
+def _image(data, tags):
+    width, height = tags[256][0], tags[257][0]
+    tileWidth, tileHeight = tags[322][0], tags[323][0]
+    dtype = numpy.dtype("%s%d" % ({1: "u", 2: "i", 3: "f"}[tags[339][0]], tags[258][0] // 8))
+    across = -(-width // tileWidth)
+    down = -(-height // tileHeight)
+    image = numpy.zeros((down * tileHeight, across * tileWidth), dtype=dtype)
+    for k, (at, length) in enumerate(zip(tags[324], tags[325])):
+        raw = data[at:at + length]
+        if tags[259][0] == 8:
+            raw = zlib.decompress(raw)
+        elif tags[259][0] == 5:
+            raw = lzwDecode(raw)
+        if tags[317][0] == 3:
+            planes = numpy.frombuffer(raw, dtype=numpy.uint8).reshape(tileHeight, -1)
+            planes = numpy.cumsum(planes, axis=1, dtype=numpy.uint8)
+            planes = planes.reshape(tileHeight, dtype.itemsize, tileWidth).transpose(0, 2, 1).copy()
+            tile = planes.view(dtype.newbyteorder(">")).reshape(tileHeight, tileWidth).astype(dtype)
+        else:
+            tile = numpy.frombuffer(raw, dtype=dtype.newbyteorder("<")).reshape(tileHeight, tileWidth).astype(dtype)
+            if tags[317][0] == 2:
+                tile = numpy.cumsum(tile, axis=1, dtype=dtype)
+        row, col = divmod(k, across)
+        image[row * tileHeight:(row + 1) * tileHeight, col * tileWidth:(col + 1) * tileWidth] = tile
+    return image[:height, :width]
+
+
+def overviews(values, count, resampling):
+    # The full resolution values and count overviews, halved as the
+    # writer documents
+    levels = [values]
+    for i in range(count):
+        block = levels[-1]
+        if block.shape[0] % 2:
+            block = numpy.vstack((block, numpy.full((1, block.shape[1]), numpy.nan)))
+        levels.append(geotiff.halve(block, resampling))
+    return levels
+
+
+class GeoTiffWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lzw_round_trip(self):
+        rng = numpy.random.RandomState(0)
+        for data in (b"", b"a", rng.randint(0, 4, 100000).astype(numpy.uint8).tobytes(),
+                     rng.randint(0, 256, 20000).astype(numpy.uint8).tobytes(), b"ab" * 50000):
+            self.assertEqual(lzwDecode(geotiff._lzw(data)), data)
+
+    def test_levels_read_back(self):
+        rng = numpy.random.RandomState(1)
+        cases = [(130, 97, 32, "float32", "deflate", "average", None),
+                 (70, 50, 16, "float32", "lzw", "average", None),
+                 (90, 91, 32, "uint8", "deflate", "nearest", None),
+                 (80, 60, 32, None, "deflate", "average", "uint16"),
+                 (50, 50, 16, "int16", "none", "nearest", None),
+                 (40, 33, 16, "float64", "deflate", "average", None)]
+        for nrows, ncols, tileSize, dtype, compression, resampling, quantized in cases:
+            grid = Grid(500000.0, 4200000.0, 30.0, 30.0, nrows, ncols)
+            values = rng.uniform(0.0, 5.0, (nrows, ncols))
+            values[rng.rand(nrows, ncols) < 0.05] = numpy.nan
+            if dtype in ("uint8", "int16"):
+                values = numpy.floor(values)
+            quantization = quantize.Quantization.forRange(quantized, 0.0, 5.0) if quantized else None
+            noData = {"uint8": 255, "int16": -1}.get(dtype)
+            path = os.path.join(self.folder, "levels.tif")
+            writer = geotiff.GeoTiffWriter(path, grid, dtype=dtype or "float32", noData=noData,
+                                           quantization=quantization, epsg=26911, compression=compression,
+                                           tileSize=tileSize, resampling=resampling, workers=2)
+            tiling.runTiled(grid, 40, 0, {"values": tiling.ArraySource(values, grid)},
+                            lambda blocks, tile, halo: blocks, {"values": writer})
+            levels = readTiff(path)
+            self.assertLessEqual(max(levels[-1][1].shape), tileSize)
+            for (tags, image), expected in zip(levels, overviews(values, len(levels) - 1, resampling)):
+                self.assertEqual(image.shape, expected.shape)
+                if quantization is not None:
+                    got = quantization.decode(image)
+                    expected = quantization.decode(quantization.encode(expected))
+                elif image.dtype.kind == "f":
+                    got = image.astype(numpy.float64)
+                    expected = expected.astype(image.dtype).astype(numpy.float64)
+                else:
+                    got = numpy.where(image == int(tags[42113]), numpy.nan, image.astype(numpy.float64))
+                    expected = numpy.rint(expected)
+                numpy.testing.assert_array_equal(got, expected)
+            tags = levels[0][0]
+            self.assertEqual(tags[33550][:2], [30.0, 30.0])
+            self.assertEqual(tags[33922][3:5], [500000.0, 4200000.0])
+            self.assertIn(26911, tags[34735])
+
+    def test_big_tiff(self):
+        grid = Grid(0.0, 10.0, 1.0, 1.0, 100, 100)
+        values = numpy.random.RandomState(2).uniform(size=(100, 100))
+        path = os.path.join(self.folder, "big.tif")
+        writer = geotiff.GeoTiffWriter(path, grid, bigTiff=True, tileSize=32)
+        writer.write(0, 0, values)
+        writer.close()
+        levels = readTiff(path)
+        numpy.testing.assert_array_equal(levels[0][1], values.astype(numpy.float32))
+        self.assertEqual(len(levels), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy
+
+from ccmengine import isochrones, routing
+from ccmengine.grid import Grid
+
+
+GRIDS = [Grid(0.0, 1000.0, 30.0, 25.0, 30, 30),
+         Grid(0.0, 45.0, 1.0 / 3600, 1.0 / 3600, 30, 30, geographic=True)]
+
+
+class TravelTimeTest(unittest.TestCase):
+
+    def test_matches_dijkstra_from_the_nearest_source(self):
+        for seed, grid in enumerate(GRIDS):
+            rng = numpy.random.RandomState(seed)
+            ccm = rng.uniform(0.1, 5.0, grid.shape)
+            ccm[rng.rand(*grid.shape) < 0.15] = numpy.nan
+            sources = numpy.zeros(grid.shape, dtype=bool)
+            sources[4, 5] = sources[22, 17] = sources[0, 29] = True
+            ccm[sources] = 1.0
+            for connectivity in (8, 16):
+                routingGrid = routing.RoutingGrid(ccm, grid, 1.0, connectivity)
+                cells = [(row, col) for row in range(0, 30, 3) for col in range(1, 30, 4)]
+                expected = []
+                for cell in cells:
+                    best = numpy.nan
+                    if routingGrid.passable(*cell):
+                        for source in zip(*numpy.nonzero(sources)):
+                            route = routingGrid.route(source, cell, "dijkstra")
+                            if route is not None:
+                                best = numpy.fmin(best, route.time)
+                    expected.append(best)
+                for bucketWidth in (None, 0.5, 1e6):
+                    times = isochrones.travelTime(ccm, grid, sources, 1.0, connectivity, bucketWidth=bucketWidth)
+                    numpy.testing.assert_allclose([times[cell] for cell in cells], expected, rtol=1e-9)
+
+    def test_horizon_cuts_the_field(self):
+        grid = GRIDS[0]
+        rng = numpy.random.RandomState(3)
+        ccm = rng.uniform(0.1, 5.0, grid.shape)
+        sources = numpy.zeros(grid.shape, dtype=bool)
+        sources[10, 10] = True
+        times = isochrones.travelTime(ccm, grid, sources)
+        horizon = numpy.nanmedian(times)
+        cut = isochrones.travelTime(ccm, grid, sources, horizon=horizon)
+        inside = times <= horizon
+        numpy.testing.assert_array_equal(cut[inside], times[inside])
+        self.assertTrue(numpy.isnan(cut[~inside]).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from ccmengine import cache, engine, parallel, tiling
+from ccmengine.grid import Grid
+
+
+def sources(seed, count):
+    # A DEM and count factor rasters on one grid, and a window inside it
+    rng = numpy.random.RandomState(seed)
+    grid = Grid(0.0, 3000.0, 10.0, 10.0, 90, 80)
+    dem = numpy.cumsum(numpy.cumsum(rng.randn(90, 80), 0), 1)
+    dem[rng.rand(90, 80) < 0.01] = numpy.nan
+    factors = [tiling.ArraySource(rng.rand(90, 80), grid) for i in range(count)]
+    return tiling.ArraySource(dem, grid), factors, grid.window(5, 7, 80, 66)
+
+
+def single(dem, window, params, factors):
+    sinks = {"ccm": tiling.ArraySink(window), "f1": tiling.ArraySink(window), "f2": tiling.ArraySink(window)}
+    return parallel.ccmParallel(dem, window, params, sinks, factors, 32, 1)
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_bands_match_single_runs(self):
+        dem, factors, window = sources(0, 1)
+        paramsList = [engine.CCMParameters(30, 2.0), engine.CCMParameters(15, 0.7), engine.CCMParameters(60, 5.5)]
+        expected = [single(dem, window, params, factors) for params in paramsList]
+        folder = tempfile.mkdtemp()
+        try:
+            for workers in (1, 2):
+                for derivatives in (None, cache.DerivativeCache(folder).derivatives(dem, window, paramsList[0], 32)):
+                    sinks = {"ccm": tiling.ArraySink(window, bands=3), "f1": tiling.ArraySink(window, bands=3),
+                             "f2": tiling.ArraySink(window)}
+                    batch = parallel.ccmBatchParallel(dem, window, paramsList, sinks, factors, 32, workers,
+                                                      derivatives)
+                    for band, outputs in enumerate(expected):
+                        numpy.testing.assert_array_equal(batch["ccm"][band], outputs["ccm"])
+                        numpy.testing.assert_array_equal(batch["f1"][band], outputs["f1"])
+                        numpy.testing.assert_array_equal(batch["f2"], outputs["f2"])
+        finally:
+            shutil.rmtree(folder)
+
+
+class SweepTest(unittest.TestCase):
+
+    def test_bands_multiply_only_their_factors(self):
+        # as DismountedCCMSweep: two vegetation and two soil variants and
+        # one roughness factor, each band taking one of each
+        dem, factors, window = sources(1, 5)
+        paramsList = []
+        bandFactors = []
+        for maxSlope, speedOverWeight in ((30, 1.0), (45, 2.5)):
+            for vegetation in (0, 1):
+                for soil in (2, 3):
+                    paramsList.append(engine.CCMParameters(maxSlope, speedOverWeight))
+                    bandFactors.append([vegetation, soil, 4])
+        for workers in (1, 2):
+            sinks = {"ccm": tiling.BandSplitSink([tiling.ArraySink(window) for params in paramsList])}
+            bands = parallel.ccmBatchParallel(dem, window, paramsList, sinks, factors, 32, workers,
+                                              bandFactors=bandFactors)["ccm"]
+            for band, (params, used) in enumerate(zip(paramsList, bandFactors)):
+                expected = single(dem, window, params, [factors[i] for i in used])
+                numpy.testing.assert_array_equal(bands[band], expected["ccm"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+import numpy
+
+from ccmengine import params
+
+
+COLUMNS = {"name": numpy.array([u"HEMTT", u"HMMWV", u"M1 Abrams"], dtype=object),
+           "weight": numpy.array([32.0, 2.6, 69.5]),
+           "maxkph": numpy.array([100.0, 144.0, 72.0]),
+           "onslope": numpy.array([60.0, 60.0, 60.0]),
+           "offslope": numpy.array([60.0, 45.0, 60.0])}
+
+
+class ConvoyEnvelopeTest(unittest.TestCase):
+
+    def test_envelopes(self):
+        envelopes = params.convoyEnvelopes(COLUMNS, [["HEMTT", "HMMWV"], ["M1 Abrams"]])
+        self.assertEqual(envelopes, [(2.6, 32.0, 100.0, 60.0, 45.0), (69.5, 69.5, 72.0, 60.0, 60.0)])
+
+    def test_unknown_vehicles_are_reported(self):
+        messages = []
+        envelopes = params.convoyEnvelopes(COLUMNS, [["HEMTT", "Tank X", "Jeep"]], messages.append)
+        self.assertEqual(envelopes, [(32.0, 32.0, 100.0, 60.0, 60.0)])
+        self.assertEqual(len(messages), 1)
+        self.assertIn("Tank X, Jeep", messages[0])
+
+    def test_no_known_vehicle(self):
+        self.assertRaises(ValueError, params.convoyEnvelopes, COLUMNS, [["Tank X"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy
+
+from ccmengine import quantize
+
+
+class RoundTripTest(unittest.TestCase):
+
+    def check(self, dtype, lower, upper, seed):
+        rng = numpy.random.RandomState(seed)
+        values = rng.uniform(lower, upper, 10000)
+        values[rng.rand(values.size) < 0.05] = numpy.nan
+        values[:3] = [lower, upper, numpy.nan]
+        quantization = quantize.Quantization.forRange(dtype, lower, upper)
+        codes = quantization.encode(values)
+        self.assertEqual(codes.dtype, numpy.dtype(dtype))
+        decoded = quantization.decode(codes)
+        missing = numpy.isnan(values)
+        numpy.testing.assert_array_equal(numpy.isnan(decoded), missing)
+        if quantization.integer:
+            self.assertTrue((codes[missing] == quantization.noData).all())
+        error = numpy.abs(decoded[~missing] - values[~missing])
+        self.assertLessEqual(error.max(), quantization.maxError, (dtype, lower, upper))
+        self.assertEqual(decoded[0], lower)
+        self.assertAlmostEqual(decoded[1], upper, delta=quantization.maxError)
+
+    def test_round_trip(self):
+        for dtype in quantize.TYPES:
+            for seed, (lower, upper) in enumerate([(0.0, 1.0), (0.0, 57.9), (-3.0, 2.25), (0.0, 1.2e-3)]):
+                self.check(dtype, lower, upper, seed)
+
+    def test_values_beyond_the_range_are_clipped(self):
+        for dtype in quantize.TYPES:
+            quantization = quantize.Quantization.forRange(dtype, 0.0, 2.0)
+            decoded = quantization.decode(quantization.encode([-1.0, 3.0]))
+            numpy.testing.assert_allclose(decoded, [0.0, 2.0], atol=quantization.maxError)
+
+    def test_upper_is_the_top_of_the_range(self):
+        for dtype in quantize.TYPES:
+            self.assertAlmostEqual(quantize.Quantization.forRange(dtype, -1.0, 4.5).upper, 4.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy
+
+from ccmengine import routing
+from ccmengine.grid import Grid
+
+
+def randomCCM(n, seed):
+    rng = numpy.random.RandomState(seed)
+    ccm = rng.uniform(0.1, 5.0, (n, n))
+    ccm[rng.rand(n, n) < 0.15] = numpy.nan
+    return ccm, rng
+
+
+GRIDS = [Grid(0.0, 1000.0, 30.0, 25.0, 40, 40),
+         Grid(0.0, 45.0, 1.0 / 3600, 1.0 / 3600, 40, 40, geographic=True)]
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_searches_agree_with_dijkstra(self):
+        for seed, grid in enumerate(GRIDS):
+            for connectivity in (8, 16):
+                ccm, rng = randomCCM(40, seed)
+                routingGrid = routing.RoutingGrid(ccm, grid, 1.0, connectivity)
+                moves = set(routing.KING_MOVES + (routing.KNIGHT_MOVES if connectivity == 16 else []))
+                found = 0
+                for k in range(40):
+                    start = (rng.randint(40), rng.randint(40))
+                    end = (rng.randint(40), rng.randint(40))
+                    if not (routingGrid.passable(*start) and routingGrid.passable(*end)):
+                        continue
+                    expected = routingGrid.route(start, end, "dijkstra")
+                    for method in ("astar", "bidirectional"):
+                        route = routingGrid.route(start, end, method)
+                        if expected is None:
+                            self.assertIsNone(route)
+                            continue
+                        found += 1
+                        self.assertAlmostEqual(route.time, expected.time, delta=1e-9 * expected.time)
+                        self.assertEqual(route.cells[0], start)
+                        self.assertEqual(route.cells[-1], end)
+                        for a, b in zip(route.cells, route.cells[1:]):
+                            self.assertIn((b[0] - a[0], b[1] - a[1]), moves)
+                            self.assertTrue(routingGrid.passable(*b))
+                self.assertGreater(found, 0)
+
+    def test_moves_cost_the_same_both_ways(self):
+        ccm, rng = randomCCM(40, 7)
+        start, end = (2, 3), (35, 31)
+        ccm[start] = ccm[end] = 1.0
+        routingGrid = routing.RoutingGrid(ccm, GRIDS[1], 1.0, 16)
+        there = routingGrid.route(start, end, "dijkstra")
+        back = routingGrid.route(end, start, "dijkstra")
+        self.assertAlmostEqual(there.time, back.time, delta=1e-9 * there.time)
+
+
+if __name__ == "__main__":
+    unittest.main()
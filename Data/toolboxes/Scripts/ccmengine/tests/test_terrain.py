@@ -0,0 +1,40 @@
+import unittest
+
+import numpy
+
+from ccmengine import terrain
+
+
+def plane(nrows, ncols):
+    rows, cols = numpy.mgrid[0:nrows, 0:ncols]
+    return 3.0 * cols + 5.0 * rows + 0.25 * cols * cols
+
+
+class NeighbourhoodEdgeTest(unittest.TestCase):
+
+    def test_nearest_differs_from_centre_on_the_edge(self):
+        dem = plane(6, 7)
+        centre = terrain.slopePercent(dem, 10.0, edge="centre")
+        nearest = terrain.slopePercent(dem, 10.0, edge="nearest")
+        self.assertNotAlmostEqual(centre[0, 3], nearest[0, 3])
+        self.assertNotAlmostEqual(centre[3, 0], nearest[3, 0])
+        numpy.testing.assert_allclose(centre[1:-1, 1:-1], nearest[1:-1, 1:-1])
+
+    def test_nearest_replicates_the_edge_cells(self):
+        dem = plane(6, 7)
+        expected = terrain.slopePercent(numpy.pad(dem, 1, mode="edge"), 10.0)[1:-1, 1:-1]
+        numpy.testing.assert_allclose(terrain.slopePercent(dem, 10.0, edge="nearest"), expected)
+
+    def test_nearest_is_the_same_with_a_nodata_halo(self):
+        # a tile read past the raster has NoData around it
+        dem = plane(6, 7)
+        halo = numpy.pad(dem, 2, mode="constant", constant_values=numpy.nan)
+        for name in ("slope", "curvature"):
+            expected = terrain.surfaceDerivatives(dem, 10.0, outputs=(name,), edge="nearest")[name]
+            result = terrain.surfaceDerivatives(halo, 10.0, outputs=(name,), edge="nearest")[name]
+            numpy.testing.assert_allclose(result[2:-2, 2:-2], expected)
+            self.assertTrue(numpy.isnan(result[:2]).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy
+
+from ccmengine import engine, tiling
+from ccmengine.grid import Grid
+
+
+def randomDEM(nrows, ncols, seed):
+    rng = numpy.random.RandomState(seed)
+    dem = numpy.cumsum(numpy.cumsum(rng.randn(nrows, ncols), 0), 1)
+    dem[rng.rand(nrows, ncols) < 0.01] = numpy.nan
+    return dem
+
+
+class TerrainFactorsTiledTest(unittest.TestCase):
+
+    def check(self, grid, edge):
+        source = tiling.ArraySource(randomDEM(grid.nrows, grid.ncols, 4), grid)
+        params = engine.CCMParameters(30.0, 2.5, edge=edge)
+        # a window inside the raster, so halos read real cells on two
+        # sides and NoData past the raster on the others
+        window = grid.window(5, 0, grid.nrows - 5, grid.ncols - 9)
+        whole = tiling.terrainFactorsTiled(source, window, params,
+                                           {"f1": tiling.ArraySink(window), "f2": tiling.ArraySink(window)}, 0)
+        for tileSize in (3, 16, 50):
+            tiled = tiling.terrainFactorsTiled(source, window, params,
+                                               {"f1": tiling.ArraySink(window), "f2": tiling.ArraySink(window)},
+                                               tileSize)
+            for name in ("f1", "f2"):
+                numpy.testing.assert_array_equal(tiled[name], whole[name], "%s, tiles of %d" % (name, tileSize))
+        self.assertTrue(numpy.isfinite(whole["f1"]).any() and numpy.isfinite(whole["f2"]).any())
+
+    def test_projected(self):
+        for edge in ("centre", "nearest"):
+            self.check(Grid(500000.0, 4200000.0, 30.0, 30.0, 70, 83), edge)
+
+    def test_geographic(self):
+        for edge in ("centre", "nearest"):
+            self.check(Grid(-120.0, 37.5, 1.0 / 3600, 1.0 / 3600, 70, 83, geographic=True), edge)
+
+    def test_product(self):
+        grid = Grid(0.0, 1000.0, 10.0, 10.0, 40, 45)
+        rng = numpy.random.RandomState(2)
+        factors = [tiling.ArraySource(rng.rand(40, 45), grid) for i in range(3)]
+        whole = tiling.productTiled(factors, grid, tiling.ArraySink(grid), 0)
+        for tileSize in (1, 7, 16):
+            numpy.testing.assert_array_equal(tiling.productTiled(factors, grid, tiling.ArraySink(grid), tileSize),
+                                             whole)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+import numpy
+
+from ccmengine import tiling, vectorize
+from ccmengine.grid import Grid
+
+
+class Features(object):
+    # A sink keeping the rings of each code
+
+    def __init__(self):
+        self.rings = {}
+
+    def write(self, code, rings):
+        self.rings[code] = rings
+
+    def close(self):
+        return self.rings
+
+
+def signedArea(ring):
+    # Shoelace area, negative for clockwise rings
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * numpy.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def burn(rings, grid):
+    # Cells whose centres the rings enclose, even-odd
+    rows, cols = numpy.mgrid[0:grid.nrows, 0:grid.ncols]
+    x = grid.xMin + (cols + 0.5) * grid.cellWidth
+    y = grid.yMax - (rows + 0.5) * grid.cellHeight
+    inside = numpy.zeros(grid.shape, dtype=bool)
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            if y0 != y1:
+                crosses = (y0 > y) != (y1 > y)
+                inside ^= crosses & (x < x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    return inside
+
+
+def codeRaster(nrows, ncols, seed, blocky):
+    rng = numpy.random.RandomState(seed)
+    if blocky:
+        codes = numpy.kron(rng.randint(0, 4, (nrows // 3 + 1, ncols // 3 + 1)), numpy.ones((3, 3)))[:nrows, :ncols]
+    else:
+        codes = rng.randint(0, 4, (nrows, ncols))
+    codes = codes.astype(numpy.float64)
+    codes[codes == 0] = numpy.nan
+    return codes
+
+
+class PolygonsTiledTest(unittest.TestCase):
+
+    def test_rings_cover_their_cells(self):
+        grid = Grid(100.0, 500.0, 2.0, 3.0, 23, 31)
+        for seed in range(4):
+            codes = codeRaster(grid.nrows, grid.ncols, seed, seed % 2)
+            for tileSize in (0, 7, 16):
+                features = Features()
+                vectorize.polygonsTiled(tiling.ArraySource(codes, grid), grid, features, tileSize)
+                self.assertEqual(sorted(features.rings), [1, 2, 3])
+                for code, rings in features.rings.items():
+                    numpy.testing.assert_array_equal(burn(rings, grid), codes == code)
+                    # clockwise outer rings: the area is minus the cells'
+                    area = sum(signedArea(ring) for ring in rings)
+                    self.assertAlmostEqual(-area, (codes == code).sum() * 6.0)
+
+    def test_simplified_areas_add_up(self):
+        grid = Grid(0.0, 100.0, 1.0, 1.0, 40, 50)
+        rng = numpy.random.RandomState(5)
+        field = rng.rand(48, 58)
+        for i in range(4):
+            field = field[1:, 1:] + field[:-1, :-1]
+        field = field[:40, :50]
+        codes = (numpy.digitize(field, numpy.percentile(field, [30, 60])) + 1).astype(numpy.float64)
+        tiled = Features()
+        whole = Features()
+        vectorize.polygonsTiled(tiling.ArraySource(codes, grid), grid, tiled, 16, tolerance=1.0)
+        vectorize.polygonsTiled(tiling.ArraySource(codes, grid), grid, whole, 0, tolerance=1.0)
+        # the arcs are shared, so the simplified polygons still tile the grid
+        total = sum(-signedArea(ring) for rings in tiled.rings.values() for ring in rings)
+        self.assertAlmostEqual(total, 40 * 50)
+        for code in whole.rings:
+            self.assertAlmostEqual(sum(signedArea(ring) for ring in tiled.rings[code]),
+                                   sum(signedArea(ring) for ring in whole.rings[code]))
+
+
+if __name__ == "__main__":
+    unittest.main()
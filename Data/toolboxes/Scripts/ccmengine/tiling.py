@@ -0,0 +1,225 @@
+# ==================================================
+# tiling.py
+# --------------------------------------------------
+# Windowed, halo-aware execution of the CCM engine.
+# --------------------------------------------------
+#
+# The AOI window is walked in fixed-size tiles.  Each tile is read with a
+# halo of extra cells on every side so the 3x3 slope/curvature stencils and
+# the NbrCircle focal range see the same neighbours they would in a
+# whole-raster run; the halo is cropped before the tile is written.  Every
+# output cell therefore depends on exactly the same inputs as in a single
+# window run, and the results match it bit for bit.  Peak memory is bounded
+# by the tile size, not by the size of the AOI.
+#
+# Sources read a Grid-aligned window as float64 with NoData (and anything
+# beyond the source) as NaN.  Sinks take blocks relative to the AOI window.
+#
+# ==================================================
+
+import numpy
+
+from . import engine
+
+
+class ArraySource(object):
+    # A raster held in a NumPy array, or a numpy.memmap / numpy.load(...,
+    # mmap_mode="r") array so that only the tiles read are paged in.
+
+    def __init__(self, array, grid, noData=None):
+        self.array = array
+        self.grid = grid
+        self.noData = noData
+
+    def read(self, window):
+        block = numpy.full(window.shape, numpy.nan)
+        row0, col0 = self.grid.offset(window)
+        r0 = max(row0, 0)
+        c0 = max(col0, 0)
+        r1 = min(row0 + window.nrows, self.grid.nrows)
+        c1 = min(col0 + window.ncols, self.grid.ncols)
+        if r1 > r0 and c1 > c0:
+            data = numpy.asarray(self.array[r0:r1, c0:c1], dtype=numpy.float64)
+            if self.noData is not None:
+                data = numpy.where(data == self.noData, numpy.nan, data)
+            block[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = data
+        return block
+
+
+class NpySource(ArraySource):
+    # ArraySource over a .npy file, memory-mapped when first read.  Only the
+    # path is pickled, so the source can be handed to worker processes.
+
+    def __init__(self, path, grid, noData=None):
+        ArraySource.__init__(self, None, grid, noData)
+        self.path = path
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["array"] = None
+        return state
+
+    def read(self, window):
+        if self.array is None:
+            self.array = numpy.load(self.path, mmap_mode="r")
+        return ArraySource.read(self, window)
+
+
+class ArraySink(object):
+    # Collects tiles into an array.  With a path the array is a .npy file
+    # opened as a memory map, so the output never has to fit in memory.
+    # With bands the array is (bands, rows, cols) and blocks carry the band
+    # axis first.  Cells not written are NaN (0 for integer types).
+
+    def __init__(self, grid, dtype=numpy.float32, path=None, bands=None):
+        self.grid = grid
+        self.path = path
+        shape = grid.shape if bands is None else (bands,) + grid.shape
+        if path is None:
+            fill = numpy.nan if numpy.issubdtype(dtype, numpy.floating) else 0
+            self.array = numpy.full(shape, fill, dtype=dtype)
+        else:
+            self.array = numpy.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    def write(self, row0, col0, block):
+        self.array[..., row0:row0 + block.shape[-2], col0:col0 + block.shape[-1]] = block
+
+    def close(self):
+        if self.path is not None:
+            self.array.flush()
+        return self.array
+
+
+class BandSplitSink(object):
+    # Sends band k of (bands, rows, cols) blocks to sinks[k], for writing a
+    # multiband result as one dataset per band
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, row0, col0, block):
+        for band, sink in enumerate(self.sinks):
+            sink.write(row0, col0, block[band])
+
+    def close(self):
+        return [sink.close() for sink in self.sinks]
+
+
+class StatisticsSink(object):
+    # Passes blocks on to sink while keeping the minimum, maximum, mean and
+    # standard deviation of their cells (NoData ignored), so the statistics
+    # of an output come out of the pass that writes it.  Means and squared
+    # deviations of the blocks are merged pairwise (Chan et al.), which
+    # stays accurate over many blocks.
+
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.count = 0
+        self.minimum = numpy.nan
+        self.maximum = numpy.nan
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def write(self, row0, col0, block):
+        values = numpy.asarray(block, dtype=numpy.float64)
+        values = values[~numpy.isnan(values)]
+        if values.size > 0:
+            count = values.size
+            mean = float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            total = self.count + count
+            delta = mean - self.mean
+            self.mean += delta * count / total
+            self.m2 += m2 + delta * delta * self.count * count / total
+            self.count = total
+            self.minimum = numpy.fmin(self.minimum, values.min())
+            self.maximum = numpy.fmax(self.maximum, values.max())
+        if self.sink is not None:
+            self.sink.write(row0, col0, block)
+
+    @property
+    def std(self):
+        # population standard deviation, as ArcGIS reports it
+        if self.count == 0:
+            return numpy.nan
+        return (self.m2 / self.count) ** 0.5
+
+    def statistics(self):
+        # (minimum, maximum, mean, standard deviation)
+        if self.count == 0:
+            return (numpy.nan, numpy.nan, numpy.nan, numpy.nan)
+        return (float(self.minimum), float(self.maximum), self.mean, self.std)
+
+    def close(self):
+        if self.sink is not None:
+            return self.sink.close()
+        return self.statistics()
+
+
+def iterTiles(window, tileSize):
+    # (row0, col0, tile) for each tile of the window in row-major order.
+    # tile is a Grid; the tiles along the right and bottom edges are clipped.
+    if tileSize is None or tileSize <= 0:
+        tileSize = max(window.nrows, window.ncols, 1)
+    for row0 in range(0, window.nrows, tileSize):
+        for col0 in range(0, window.ncols, tileSize):
+            nrows = min(tileSize, window.nrows - row0)
+            ncols = min(tileSize, window.ncols - col0)
+            yield row0, col0, window.window(row0, col0, nrows, ncols)
+
+
+def withHalo(tile, halo):
+    return tile.window(-halo, -halo, tile.nrows + 2 * halo, tile.ncols + 2 * halo)
+
+
+def runTiled(window, tileSize, halo, sources, kernel, sinks):
+    # Generic block loop.  For every tile, each source is read with the halo
+    # and kernel(blocks, tile, halo) returns a dict of output blocks already
+    # cropped to the tile, which are handed to the sink of the same name.
+    for row0, col0, tile in iterTiles(window, tileSize):
+        readGrid = withHalo(tile, halo)
+        blocks = dict((name, source.read(readGrid)) for name, source in sources.items())
+        results = kernel(blocks, tile, halo)
+        for name, sink in sinks.items():
+            sink.write(row0, col0, results[name])
+    return dict((name, sink.close()) for name, sink in sinks.items())
+
+
+def focalRangeMaximum(demSource, window, params, tileSize):
+    # First pass for F2: the largest focal range in the window
+    halo = params.halo
+    focalMax = numpy.nan
+    for row0, col0, tile in iterTiles(window, tileSize):
+        dem = demSource.read(withHalo(tile, halo))
+        cellWidth, cellHeight = tile.metricCellSizes(halo)
+        rng, tileMax = engine.focalRangeMaxBlock(dem, cellWidth, cellHeight, params, halo)
+        focalMax = numpy.fmax(focalMax, tileMax)
+    return float(focalMax)
+
+
+def terrainFactorsTiled(demSource, window, params, sinks, tileSize=1024, focalMax=None):
+    # F1 and F2 over the window, tile by tile.  sinks: {"f1": sink, "f2": sink}
+    # (either may be left out).  Two passes are made over the DEM, the first
+    # for the focal range maximum F2 is scaled by; the focal range is
+    # recomputed in the second pass rather than stored.
+    if focalMax is None:
+        focalMax = focalRangeMaximum(demSource, window, params, tileSize)
+
+    def kernel(blocks, tile, halo):
+        cellWidth, cellHeight = tile.metricCellSizes(halo)
+        f1, f2 = engine.terrainFactorsBlock(blocks["dem"], cellWidth, cellHeight, params, focalMax, halo)
+        return {"f1": f1, "f2": f2}
+
+    return runTiled(window, tileSize, params.halo, {"dem": demSource}, kernel, sinks)
+
+
+def productTiled(factorSources, window, sink, tileSize=1024):
+    # Multiplies any number of factor rasters tile by tile into the sink,
+    # in one pass and without an intermediate raster
+    names = ["f%d" % i for i in range(len(factorSources))]
+    sources = dict(zip(names, factorSources))
+
+    def kernel(blocks, tile, halo):
+        return {"ccm": engine.productBlock([blocks[name] for name in names])}
+
+    return runTiled(window, tileSize, 0, sources, kernel, {"ccm": sink})["ccm"]
@@ -0,0 +1,255 @@
+# ==================================================
+# vectorize.py
+# --------------------------------------------------
+# Raster to polygon conversion of integer code rasters.
+# --------------------------------------------------
+#
+# The boundaries of the codes (classes, bands, corridor numbers; 0 and
+# NoData are left out) are collected as runs: along every horizontal and
+# vertical line of the cell grid, the stretches where the cells on the two
+# sides hold different codes.  Each run is kept once for each coded side,
+# directed so that its code lies on the right, which makes the rings of a
+# code clockwise around it and counter-clockwise around its holes, the
+# order shapefiles want.  The runs are linked end to start into rings; at
+# a vertex where two cells of a code touch only diagonally the ring turns
+# right, so cells meet through their sides as with RasterToPolygon.  All
+# rings of a code make one multipart feature, as Dissolve on gridcode.
+#
+# The runs are found tile by tile from tiles read with a 1 cell halo;
+# every grid line belongs to one tile, so the runs cut at tile seams link
+# up with their continuations and the straight vertices left at the seams
+# are dropped.  Only the runs are kept, and the features are handed to the
+# sink one code at a time.
+#
+# Simplification (Douglas-Peucker, tolerance in map units) works on arcs:
+# the stretches of ring between the same two codes, split at the vertices
+# where the code across the ring changes and at the diagonal touches.  An
+# arc is simplified the same way from both sides, so neighbouring polygons
+# stay free of gaps and overlaps, and keeps at least its farthest vertex,
+# so no ring collapses.  The corners of cell staircases lie 0.7 cells off
+# their diagonal; a tolerance of about one cell smooths them.
+#
+# ==================================================
+
+import numpy
+
+from . import shapefile
+from . import tiling
+
+
+# run directions, clockwise: a turn to the right is (d + 1) % 4
+EAST = 0
+SOUTH = 1
+WEST = 2
+NORTH = 3
+
+
+def _runs(code, other):
+    # Runs of each line (row of the arrays) where code > 0 differs from
+    # other, split where either changes: (line, first, last + 1, code, other)
+    boundary = (code != other) & (code > 0)
+    joined = boundary[:, 1:] & boundary[:, :-1] & (code[:, 1:] == code[:, :-1]) & \
+        (other[:, 1:] == other[:, :-1])
+    starts = boundary.copy()
+    starts[:, 1:] &= ~joined
+    ends = boundary.copy()
+    ends[:, :-1] &= ~joined
+    lines, first = numpy.nonzero(starts)
+    last = numpy.nonzero(ends)[1]
+    return lines, first, last + 1, code[lines, first], other[lines, first]
+
+
+def tileRuns(block, row0, col0, nrows, ncols, lastRow, lastCol):
+    # Directed runs of a tile from its codes read with a 1 cell halo (0
+    # beyond the window): the horizontal lines row0 .. row0 + nrows - 1 and
+    # the vertical lines col0 .. col0 + ncols - 1, plus the closing line of
+    # the window for the last tile row / column.  Returns arrays of code,
+    # other code, start and end vertex (row, col) and direction.
+    hLines = nrows + (1 if lastRow else 0)
+    vLines = ncols + (1 if lastCol else 0)
+    result = []
+
+    above = block[:hLines, 1:-1]
+    below = block[1:hLines + 1, 1:-1]
+    # the code below an east run, above a west run
+    line, first, end, code, other = _runs(below, above)
+    result.append((code, other, line + row0, first + col0, line + row0, end + col0, EAST))
+    line, first, end, code, other = _runs(above, below)
+    result.append((code, other, line + row0, end + col0, line + row0, first + col0, WEST))
+
+    left = block[1:-1, :vLines].T
+    right = block[1:-1, 1:vLines + 1].T
+    # the code right of a north run, left of a south run
+    line, first, end, code, other = _runs(right, left)
+    result.append((code, other, end + row0, line + col0, first + row0, line + col0, NORTH))
+    line, first, end, code, other = _runs(left, right)
+    result.append((code, other, first + row0, line + col0, end + row0, line + col0, SOUTH))
+
+    columns = []
+    for k in range(7):
+        if k == 6:
+            columns.append(numpy.concatenate([numpy.full(r[0].size, r[6], dtype=numpy.int8) for r in result]))
+        else:
+            columns.append(numpy.concatenate([numpy.asarray(r[k], dtype=numpy.int64) for r in result]))
+    return columns
+
+
+def _link(code, start, end, direction):
+    # Index of the run following each run on its ring (the runs sorted by
+    # code, then start vertex), and whether its end is a diagonal touch
+    ranks = numpy.concatenate(([0], numpy.cumsum(code[1:] != code[:-1])))
+    vertices = int(max(start.max(), end.max())) + 1
+    keys = ranks * vertices + start
+    targets = ranks * vertices + end
+    first = numpy.searchsorted(keys, targets, "left")
+    last = numpy.searchsorted(keys, targets, "right")
+    if (last == first).any():
+        raise ValueError("Open boundary: the runs do not close into rings")
+    following = first.copy()
+    touch = last - first == 2
+    second = first[touch] + 1
+    right = (direction[touch] + 1) % 4
+    following[touch] = numpy.where(direction[second] == right, second, first[touch])
+    return following, touch
+
+
+def _douglasPeucker(points, tolerance):
+    # Mask of the points of an open line kept by Douglas-Peucker.  The
+    # farthest point is always kept, so no ring collapses to a line.
+    keep = numpy.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a = points[i]
+        b = points[j]
+        inner = points[i + 1:j]
+        dx, dy = b - a
+        length = numpy.hypot(dx, dy)
+        if length == 0.0:
+            distance = numpy.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            distance = numpy.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        k = int(numpy.argmax(distance))
+        if distance[k] > tolerance or (i == 0 and j == len(points) - 1):
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return keep
+
+
+def _simplify(points, keys, nodes, code, others, tolerance):
+    # Simplifies a closed ring arc by arc.  nodes marks the arc ends; a
+    # ring without any is split at its lowest and highest vertex keys.
+    # Arcs are simplified in the direction the lower of their two codes
+    # runs them, so both sides agree.
+    count = len(points)
+    nodes = numpy.nonzero(nodes)[0]
+    if nodes.size == 0:
+        nodes = numpy.unique([int(numpy.argmin(keys)), int(numpy.argmax(keys))])
+    keep = numpy.zeros(count, dtype=bool)
+    keep[nodes] = True
+    for n, i in enumerate(nodes):
+        j = nodes[(n + 1) % len(nodes)]
+        span = numpy.arange(i, (j if j > i else j + count) + 1) % count
+        forward = others[i] == 0 or code <= others[i]
+        arc = points[span] if forward else points[span[::-1]]
+        kept = _douglasPeucker(arc, tolerance)
+        if not forward:
+            kept = kept[::-1]
+        keep[span[kept]] = True
+    return points[keep]
+
+
+def polygonsTiled(codeSource, window, sink, tileSize=1024, tolerance=None):
+    # Polygons of the integer codes read from codeSource over the window,
+    # one sink.write(code, rings) per code in increasing order, each ring
+    # an (n, 2) array of x, y closed by its first point.  Returns the
+    # number of codes written.
+    nrows, ncols = window.shape
+    columns = [[] for k in range(7)]
+    for row0, col0, tile in tiling.iterTiles(window, tileSize):
+        block = codeSource.read(tiling.withHalo(tile, 1))
+        block = numpy.where(numpy.isnan(block), 0, block).astype(numpy.int64)
+        if row0 == 0:
+            block[0, :] = 0
+        if col0 == 0:
+            block[:, 0] = 0
+        lastRow = row0 + tile.nrows == nrows
+        lastCol = col0 + tile.ncols == ncols
+        if lastRow:
+            block[-1, :] = 0
+        if lastCol:
+            block[:, -1] = 0
+        for k, column in enumerate(tileRuns(block, row0, col0, tile.nrows, tile.ncols, lastRow, lastCol)):
+            columns[k].append(column)
+    code, other, startRow, startCol, endRow, endCol, direction = [numpy.concatenate(c) for c in columns]
+    if code.size == 0:
+        sink.close()
+        return 0
+    start = startRow * (ncols + 1) + startCol
+    end = endRow * (ncols + 1) + endCol
+    order = numpy.lexsort((start, code))
+    code, other, start, end, direction = code[order], other[order], start[order], end[order], direction[order]
+    following, touch = _link(code, start, end, direction)
+    previous = numpy.empty_like(following)
+    previous[following] = numpy.arange(following.size)
+    # arc ends: the vertices where the code across any ring changes, and
+    # the diagonal touches; a vertex is kept where the ring turns or at an
+    # arc end
+    node = (other != other[previous]) | touch[previous]
+    windowCorners = [0, ncols, nrows * (ncols + 1), nrows * (ncols + 1) + ncols]
+    node = numpy.isin(start, numpy.concatenate((numpy.unique(start[node]), windowCorners)))
+    corner = (direction != direction[previous]) | node
+    following = following.tolist()
+
+    seen = numpy.zeros(code.size, dtype=bool)
+    written = 0
+    rings = []
+    current = code[0]
+    for i in range(code.size):
+        if seen[i]:
+            continue
+        if code[i] != current:
+            sink.write(int(current), rings)
+            written += 1
+            rings = []
+            current = code[i]
+        ring = [i]
+        j = following[i]
+        while j != i:
+            ring.append(j)
+            j = following[j]
+        ring = numpy.array(ring)
+        seen[ring] = True
+        ring = ring[corner[ring]]
+        keys = start[ring]
+        points = numpy.empty((ring.size, 2))
+        points[:, 0] = window.xMin + (keys % (ncols + 1)) * window.cellWidth
+        points[:, 1] = window.yMax - (keys // (ncols + 1)) * window.cellHeight
+        if tolerance:
+            points = _simplify(points, keys, node[ring], current, other[ring], tolerance)
+        rings.append(numpy.vstack((points, points[:1])))
+    sink.write(int(current), rings)
+    sink.close()
+    return written + 1
+
+
+class ShapefileSink(object):
+    # Polygon sink writing one shapefile feature per code: the code in
+    # "gridcode" and, for each (name, type, width, decimals) of fields, the
+    # value attributes[name][code]
+
+    def __init__(self, path, fields=(), attributes=None, projection=None):
+        self.fields = [field[0] for field in fields]
+        self.attributes = attributes or {}
+        self.writer = shapefile.ShapefileWriter(path, [("gridcode", "N", 11, 0)] + list(fields), projection)
+
+    def write(self, code, rings):
+        self.writer.write(rings, [code] + [self.attributes[name][code] for name in self.fields])
+
+    def close(self):
+        return self.writer.close()
@@ -0,0 +1,159 @@
+# ==================================================
+# whereclause.py
+# --------------------------------------------------
+# Parser for the simple where clauses the CCM scripts build.
+# --------------------------------------------------
+#
+# Only conjunctions of single-field predicates are understood:
+#
+#   "name" = 'HMMWV'
+#   "name" IN ('HMMWV', 'M1A2')
+#   weight > 10 AND [onslope] <= 60
+#   f_code IS NOT NULL
+#
+# which is enough for the parameter tables and lets filegdb evaluate the
+# predicates row by row (and answer = / IN from an attribute index) without
+# a database engine.  Anything else (OR, functions, expressions) raises
+# ValueError so the caller can fall back to arcpy.
+#
+# ==================================================
+
+import re
+
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+      (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"[^"]*"|\[[^\]]*\])
+    | (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<op><>|!=|<=|>=|=|<|>)
+    | (?P<punct>[(),])
+    | (?P<word>[A-Za-z_][A-Za-z0-9_.]*)
+    )""", re.VERBOSE)
+
+
+class Predicate(object):
+    # field op value, with op one of = <> < <= > >= IN NOT IN IS NULL IS NOT NULL.
+    # For IN the value is a tuple.
+
+    def __init__(self, field, op, value=None):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return "Predicate(%r, %r, %r)" % (self.field, self.op, self.value)
+
+    def matches(self, value):
+        op = self.op
+        if op == "IS NULL":
+            return value is None
+        if op == "IS NOT NULL":
+            return value is not None
+        if value is None:
+            return False
+        if op == "=":
+            return value == self.value
+        if op == "<>":
+            return value != self.value
+        if op == "IN":
+            return value in self.value
+        if op == "NOT IN":
+            return value not in self.value
+        if op == "<":
+            return value < self.value
+        if op == "<=":
+            return value <= self.value
+        if op == ">":
+            return value > self.value
+        return value >= self.value
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError("Cannot parse where clause at %r" % text[pos:])
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "string":
+            token = token[1:-1].replace("''", "'")
+        elif kind == "quoted":
+            kind = "word"
+            token = token[1:-1]
+        elif kind == "number":
+            token = float(token) if re.search(r"[.eE]", token) else int(token)
+        elif kind == "word" or kind == "op":
+            if kind == "op" and token == "!=":
+                token = "<>"
+            elif kind == "word" and token.upper() in ("AND", "IN", "IS", "NOT", "NULL", "OR"):
+                kind = "keyword"
+                token = token.upper()
+        tokens.append((kind, token))
+        pos = match.end()
+    return tokens
+
+
+def parse(text):
+    # List of Predicates that must all hold; an empty clause gives []
+    if text is None or not text.strip():
+        return []
+    tokens = tokenize(text)
+    tokens.append(("end", None))
+    predicates = []
+    pos = 0
+
+    def expect(kind, token=None):
+        if tokens[pos][0] != kind or (token is not None and tokens[pos][1] != token):
+            raise ValueError("Unsupported where clause: %s" % text)
+        return tokens[pos][1]
+
+    while True:
+        field = expect("word")
+        pos += 1
+        kind, token = tokens[pos]
+        if kind == "op":
+            pos += 1
+            if tokens[pos][0] not in ("string", "number"):
+                raise ValueError("Unsupported where clause: %s" % text)
+            predicates.append(Predicate(field, token, tokens[pos][1]))
+            pos += 1
+        elif token == "IS":
+            pos += 1
+            op = "IS NULL"
+            if tokens[pos][1] == "NOT":
+                op = "IS NOT NULL"
+                pos += 1
+            expect("keyword", "NULL")
+            predicates.append(Predicate(field, op))
+            pos += 1
+        elif token in ("IN", "NOT"):
+            op = "IN"
+            if token == "NOT":
+                pos += 1
+                expect("keyword", "IN")
+                op = "NOT IN"
+            pos += 1
+            expect("punct", "(")
+            pos += 1
+            values = []
+            while True:
+                if tokens[pos][0] not in ("string", "number"):
+                    raise ValueError("Unsupported where clause: %s" % text)
+                values.append(tokens[pos][1])
+                pos += 1
+                if tokens[pos] == ("punct", ")"):
+                    pos += 1
+                    break
+                expect("punct", ",")
+                pos += 1
+            predicates.append(Predicate(field, op, tuple(values)))
+        else:
+            raise ValueError("Unsupported where clause: %s" % text)
+        if tokens[pos][0] == "end":
+            return predicates
+        expect("keyword", "AND")
+        pos += 1